@@ -0,0 +1,78 @@
+import json
+import logging
+from typing import Iterable
+
+from load.elastic_config import ElasticIndexName
+from redis.client import Redis
+
+# Событие конца цикла ETL, по нему movies_api прогревает вытесненные страницы
+ETL_CYCLE_FINISHED = "etl_cycle_finished"
+
+
+class CacheInvalidationPublisher:
+    """
+    Publishes ids of documents loaded to ElasticSearch, so movies_api can evict
+    the cached documents and the cached pages that contain them, and the end
+    of every cycle that loaded documents, so movies_api can warm them up.
+    """
+
+    def __init__(
+        self,
+        redis_adapter: Redis,
+        channel: str,
+    ) -> None:
+        self.redis_adapter = redis_adapter
+        self.channel = channel
+        self.published_in_cycle = 0
+
+    def publish(
+        self,
+        es_index: ElasticIndexName,
+        ids: Iterable,
+    ) -> None:
+        """
+        Publish loaded ids of the index.
+
+        :param es_index: Index the documents were loaded to.
+        :param ids: Ids of the loaded documents.
+
+        :return: None
+        """
+        message = {
+            "index": es_index.value,
+            "ids": [str(doc_id) for doc_id in ids],
+        }
+        if not message["ids"]:
+            return
+        receivers = self.redis_adapter.publish(
+            self.channel,
+            json.dumps(message),
+        )
+        self.published_in_cycle += len(message["ids"])
+        logging.info(
+            "Published %s invalidated ids of %s to %s receivers",
+            len(message["ids"]),
+            es_index.value,
+            receivers,
+        )
+
+    def publish_cycle_finished(
+        self,
+    ) -> None:
+        """
+        Publish the end of the cycle, unless nothing was loaded in it.
+
+        :return: None
+        """
+        if not self.published_in_cycle:
+            return
+        receivers = self.redis_adapter.publish(
+            self.channel,
+            json.dumps({"event": ETL_CYCLE_FINISHED}),
+        )
+        logging.info(
+            "Published the end of the cycle with %s invalidated ids to %s receivers",
+            self.published_in_cycle,
+            receivers,
+        )
+        self.published_in_cycle = 0
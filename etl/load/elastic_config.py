@@ -101,6 +101,11 @@ ELASTIC_MOVIE_MAPPING = {
                 },
             },
         },
+        # Id похожих фильмов, их считает ETL после загрузки; по ним не ищут, только читают
+        "similar_ids": {
+            "type": "keyword",
+            "index": False,
+        },
     },
 }
 
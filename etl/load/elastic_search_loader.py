@@ -1,8 +1,11 @@
 import logging
-from typing import Optional
+from typing import Iterator, Optional
 
 from elasticsearch import Elasticsearch, helpers
+from load.cache_invalidation import CacheInvalidationPublisher
 from load.elastic_config import ElasticConfig, ElasticIndexName
+from load.known_ids import KnownIdsWriter
+from load.similar_films import SimilarFilmsWriter
 from time_event_decorators.backoff import backoff_public_methods
 
 
@@ -13,6 +16,9 @@ class ElasticLoader:
         es_configs: list[ElasticConfig],
         es_indexes: list[ElasticIndexName],
         es_url: str,
+        invalidation_publisher: Optional[CacheInvalidationPublisher] = None,
+        known_ids_writer: Optional[KnownIdsWriter] = None,
+        similar_films_writer: Optional[SimilarFilmsWriter] = None,
     ) -> None:
         """
         Initialize the ElasticsearchLoader.
@@ -20,10 +26,16 @@ class ElasticLoader:
         :param es_indexes: The names of the Elasticsearch indexes to use.
         :param mappings: Optional mappings for the Elasticsearch index. Default is None.
         :param settings: Optional settings for the Elasticsearch index. Default is None.
+        :param invalidation_publisher: Optional publisher of loaded ids for cache invalidation. Default is None.
+        :param known_ids_writer: Optional writer of the bloom filters of loaded ids. Default is None.
+        :param similar_films_writer: Optional writer of the similar films of loaded films. Default is None.
         """
         self.es = Elasticsearch(es_url)
         self.es_indexes = es_indexes
         self.es_configs = es_configs
+        self.invalidation_publisher = invalidation_publisher
+        self.known_ids_writer = known_ids_writer
+        self.similar_films_writer = similar_films_writer
         self.create_indexes()
 
     def load_data_to_es(
@@ -47,16 +59,49 @@ class ElasticLoader:
             es_data,
             es_index,
         )
+        if self.known_ids_writer is not None:
+            # Id попадает в фильтр до загрузки документа: иначе API успел бы ответить на него 404
+            self.known_ids_writer.add(
+                es_index,
+                [str(action["_id"]) for action in actions],
+                all_ids=lambda: self._iter_ids(es_index),
+            )
         helpers.bulk(
             self.es,
             actions,
         )
+        if self.similar_films_writer is not None and es_index == ElasticIndexName.MOVIE:
+            self.similar_films_writer.update(
+                self.es,
+                [str(action["_id"]) for action in actions],
+            )
+        if self.invalidation_publisher is not None:
+            self.invalidation_publisher.publish(
+                es_index,
+                (action["_id"] for action in actions),
+            )
+
+    def finish_cycle(
+        self,
+    ):
+        """
+        Tells movies_api that the cycle is over, so it can warm up the pages the cycle evicted.
+
+        :return: None
+        """
+        if self.invalidation_publisher is not None:
+            self.invalidation_publisher.publish_cycle_finished()
 
     def create_indexes(
         self,
     ):
         for elastic_configuration in self.es_configs:
             if self.has_index(elastic_configuration.elastic_index.value):
+                # Новые поля добавляются и в созданный раньше индекс, изменить существующие так нельзя
+                self.es.indices.put_mapping(
+                    index=elastic_configuration.elastic_index.value,
+                    properties=elastic_configuration.mapping["properties"],
+                )
                 continue
             self.es.indices.create(
                 index=elastic_configuration.elastic_index.value,
@@ -75,6 +120,18 @@ class ElasticLoader:
         """
         return self.es.indices.exists(index=es_index).body
 
+    def _iter_ids(
+        self,
+        es_index: ElasticIndexName,
+    ) -> Iterator[str]:
+        for document in helpers.scan(
+            self.es,
+            index=es_index.value,
+            query={"query": {"match_all": {}}},
+            _source=False,
+        ):
+            yield document["_id"]
+
     @staticmethod
     def transform_data_to_actions(
         data: Optional[list],
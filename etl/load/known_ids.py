@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import math
+from typing import Callable, Iterable
+
+from load.elastic_config import ElasticIndexName
+from redis.client import Redis
+
+KNOWN_IDS_KEY_PREFIX = "known_ids"
+
+
+def filter_key(
+    es_index: ElasticIndexName,
+) -> str:
+    return f"{KNOWN_IDS_KEY_PREFIX}_{es_index.value}"
+
+
+def meta_key(
+    es_index: ElasticIndexName,
+) -> str:
+    return f"{KNOWN_IDS_KEY_PREFIX}_{es_index.value}_meta"
+
+
+def bit_positions(
+    item: str,
+    bits: int,
+    hashes: int,
+) -> list[int]:
+    """
+    Positions of the item in a Bloom filter of the given size.
+
+    Double hashing of one blake2b digest (Kirsch-Mitzenmacher). movies_api
+    computes the same positions, the two must never diverge.
+    """
+    digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], "big")
+    second = int.from_bytes(digest[8:], "big") | 1
+    return [(first + i * second) % bits for i in range(hashes)]
+
+
+class KnownIdsWriter:
+    """
+    Keeps a Bloom filter of the ids of every index in redis, so movies_api
+    can answer 404 for ids that were never loaded without asking
+    ElasticSearch.
+
+    The filter is a redis bitmap, its size, number of hashes, capacity and
+    number of ids are kept in a hash next to it. Ids are added before the
+    documents are loaded, so an id is never in ElasticSearch without being
+    in the filter. When the filter is missing or holds more ids than it was
+    sized for, it is rebuilt from all the ids of the index.
+    """
+
+    def __init__(
+        self,
+        redis_adapter: Redis,
+        error_rate: float,
+        min_capacity: int,
+    ) -> None:
+        self.redis_adapter = redis_adapter
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+
+    def add(
+        self,
+        es_index: ElasticIndexName,
+        ids: list[str],
+        all_ids: Callable[[], Iterable[str]],
+    ) -> None:
+        """
+        Add ids to the filter of the index.
+
+        :param es_index: Index the documents are loaded to.
+        :param ids: Ids of the documents.
+        :param all_ids: Returns all ids of the index, used when the filter has to be rebuilt.
+
+        :return: None
+        """
+        if not ids:
+            return
+        meta = self.redis_adapter.hgetall(meta_key(es_index))
+        if not meta:
+            self.rebuild(es_index, [*all_ids(), *ids])
+            return
+        bits, hashes = int(meta[b"bits"]), int(meta[b"hashes"])
+
+        pipe = self.redis_adapter.pipeline(transaction=True)
+        for doc_id in ids:
+            for position in bit_positions(doc_id, bits, hashes):
+                pipe.setbit(filter_key(es_index), position, 1)
+        previous_bits = pipe.execute()
+        # Id новый, если хотя бы один его бит был пуст; обновления уже известных документов не считаются
+        new_ids = sum(not all(previous_bits[start : start + hashes]) for start in range(0, len(previous_bits), hashes))
+        pipe = self.redis_adapter.pipeline(transaction=True)
+        pipe.hincrby(meta_key(es_index), "count", new_ids)
+        pipe.hincrby(meta_key(es_index), "version", 1)
+        count, _ = pipe.execute()
+
+        if count > int(meta[b"capacity"]):
+            logging.info("Bloom filter of %s is over its capacity, rebuilding it", es_index.value)
+            self.rebuild(es_index, [*all_ids(), *ids])
+
+    def rebuild(
+        self,
+        es_index: ElasticIndexName,
+        ids: Iterable[str],
+    ) -> None:
+        """
+        Replace the filter of the index with a new one sized for twice the number of ids.
+
+        :param es_index: Index of the filter.
+        :param ids: All ids of the index.
+
+        :return: None
+        """
+        ids = set(ids)
+        capacity = max(self.min_capacity, 2 * len(ids))
+        # Оптимальный размер и число хэшей для заданной вероятности ложного срабатывания
+        bits = math.ceil(-capacity * math.log(self.error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        bitmap = bytearray((bits + 7) // 8)
+        for doc_id in ids:
+            for position in bit_positions(doc_id, bits, hashes):
+                # Порядок битов как у SETBIT: нулевой бит — старший бит первого байта
+                bitmap[position >> 3] |= 0x80 >> (position & 7)
+
+        pipe = self.redis_adapter.pipeline(transaction=True)
+        pipe.set(filter_key(es_index), bytes(bitmap))
+        pipe.hset(
+            meta_key(es_index),
+            mapping={"bits": bits, "hashes": hashes, "capacity": capacity, "count": len(ids)},
+        )
+        pipe.hincrby(meta_key(es_index), "version", 1)
+        pipe.execute()
+        logging.info(
+            "Rebuilt bloom filter of %s: %s ids, %s bytes, %s hashes",
+            es_index.value,
+            len(ids),
+            len(bitmap),
+            hashes,
+        )
@@ -0,0 +1,95 @@
+import logging
+
+from elasticsearch import Elasticsearch, helpers
+from load.elastic_config import ElasticIndexName
+
+# Поля, по которым more_like_this ищет похожие фильмы; movies_api ищет на лету по тем же полям
+SIMILAR_FILM_FIELDS = ["title", "description", "genre", "actors_names"]
+
+
+def similar_films_query(
+    film_id: str,
+) -> dict:
+    """
+    more_like_this query of the films similar to the film.
+
+    movies_api runs the same query for films with no precomputed neighbours,
+    the two must stay the same.
+    """
+    return {
+        "more_like_this": {
+            "fields": SIMILAR_FILM_FIELDS,
+            "like": [{"_index": ElasticIndexName.MOVIE.value, "_id": film_id}],
+            "min_term_freq": 1,
+            "min_doc_freq": 2,
+            "max_query_terms": 25,
+        }
+    }
+
+
+class SimilarFilmsWriter:
+    """
+    Precomputes the most similar films of every loaded film and stores their
+    ids in the film, so movies_api answers /films/{film_id}/similar with
+    one get instead of a more_like_this search per request.
+
+    The neighbours of a batch of films are searched with one msearch and
+    written with one bulk of partial updates. They are written before the
+    ids of the films are published, so movies_api never caches the
+    neighbours of a film the cycle is about to replace.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        batch_size: int,
+    ) -> None:
+        self.count = count
+        self.batch_size = batch_size
+
+    def update(
+        self,
+        es: Elasticsearch,
+        film_ids: list[str],
+    ) -> None:
+        """
+        Compute and store the neighbours of the films.
+
+        :param es: Client of the cluster the films are loaded to.
+        :param film_ids: Ids of the loaded films.
+
+        :return: None
+        """
+        if not film_ids:
+            return
+        # more_like_this ищет среди видимых документов, а только что загруженные фильмы станут видны после refresh
+        es.indices.refresh(index=ElasticIndexName.MOVIE.value)
+        updated = 0
+        for start in range(0, len(film_ids), self.batch_size):
+            batch = film_ids[start : start + self.batch_size]
+            searches = []
+            for film_id in batch:
+                searches.append({"index": ElasticIndexName.MOVIE.value})
+                searches.append(
+                    {
+                        "query": similar_films_query(film_id),
+                        "size": self.count,
+                        "_source": False,
+                    }
+                )
+            responses = es.msearch(searches=searches)["responses"]
+            actions = []
+            for film_id, response in zip(batch, responses):
+                if "error" in response:
+                    logging.warning("Failed to find films similar to %s: %s", film_id, response["error"])
+                    continue
+                actions.append(
+                    {
+                        "_op_type": "update",
+                        "_index": ElasticIndexName.MOVIE.value,
+                        "_id": film_id,
+                        "doc": {"similar_ids": [hit["_id"] for hit in response["hits"]["hits"]]},
+                    }
+                )
+            updated += helpers.bulk(es, actions)[0]
+        logging.info("Stored similar films of %s films", updated)
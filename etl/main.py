@@ -2,8 +2,11 @@ from extract_transform.boundaries import get_query_boundaries
 from extract_transform.extract_settings import setup_database_orchester
 from extract_transform.postgres_orchester import PostgresOrchester
 from extract_transform.query_manager import PostgresTableName
+from load.cache_invalidation import CacheInvalidationPublisher
 from load.elastic_config import ELASTIC_CONFIGS, ElasticIndexName
 from load.elastic_search_loader import ElasticLoader
+from load.known_ids import KnownIdsWriter
+from load.similar_films import SimilarFilmsWriter
 from project_setup.env_settings import Settings
 from redis.client import Redis
 from state.state import State
@@ -40,17 +43,32 @@ def synchronise_postgres_elastic(
             current_state_key,
             time_boundaries.till_time.isoformat(),
         )
+    loader.finish_cycle()
     return time_boundaries.till_time
 
 
 if __name__ == "__main__":
     settings = Settings()
+    redis_adapter = Redis.from_url(url=settings.redis_url)
     elastic_search_loader = ElasticLoader(
         es_url=settings.elastic_url,
         es_indexes=ELASTIC_INDEXES,
         es_configs=ELASTIC_CONFIGS,
+        invalidation_publisher=CacheInvalidationPublisher(
+            redis_adapter=redis_adapter,
+            channel=settings.cache_invalidation_channel,
+        ),
+        known_ids_writer=KnownIdsWriter(
+            redis_adapter=redis_adapter,
+            error_rate=settings.bloom_filter_error_rate,
+            min_capacity=settings.bloom_filter_min_capacity,
+        ),
+        similar_films_writer=SimilarFilmsWriter(
+            count=settings.similar_films_count,
+            batch_size=settings.similar_films_batch_size,
+        ),
     )
-    redis_storage = RedisStorage(redis_adapter=Redis.from_url(url=settings.redis_url))
+    redis_storage = RedisStorage(redis_adapter=redis_adapter)
     state = State(storage=redis_storage)
     postgres_receiver_orchester = setup_database_orchester(settings.database_url)
     while True:
@@ -17,6 +17,11 @@ class Settings(BaseSettings):
     elastic_port: int
     elastic_scheme: str
     repeat_time_seconds: int
+    cache_invalidation_channel: str = "cache_invalidation"
+    bloom_filter_error_rate: float = 0.01
+    bloom_filter_min_capacity: int = 100_000
+    similar_films_count: int = 10
+    similar_films_batch_size: int = 100
 
     @property
     def elastic_url(
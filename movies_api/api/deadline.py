@@ -0,0 +1,87 @@
+import asyncio
+from typing import Optional
+
+from core.config import settings
+from core.deadline import start_deadline
+from core.metrics import REQUESTS_CANCELLED
+from fastapi import Header, Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+async def request_deadline(
+    request: Request,
+    x_request_timeout: Optional[float] = Header(
+        None,
+        gt=0,
+        description="Time budget of the request in seconds, no more than the configured maximum.",
+    ),
+):
+    """
+    Starts the deadline of the request: the budget of its route, or the one the client asked for.
+
+    The dependency is async on purpose: it runs in the task of the handler, so the handler sees the deadline.
+    """
+    budget = settings.request_budgets.get(request.scope["route"].path, settings.request_budget)
+    if x_request_timeout is not None:
+        budget = min(x_request_timeout, settings.request_budget_max)
+    start_deadline(budget)
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    Cancels the handling of a request when its client disconnects before the response is sent.
+
+    The application runs in its own task while the middleware waits for the
+    messages of the client. Nobody will read the response of a disconnected
+    client, so the task is cancelled together with the calls to elastic it
+    waits for, instead of finishing work for nobody.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+    ):
+        self.app = app
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        messages: asyncio.Queue[Message] = asyncio.Queue()
+        response_finished = False
+
+        async def send_response(message: Message):
+            nonlocal response_finished
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_finished = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, messages.get, send_response))
+
+        async def watch_client():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    # После ответа сервер тоже сообщает об отключении, тогда отменять уже нечего
+                    if not response_finished and not app_task.done():
+                        route = scope.get("route")
+                        REQUESTS_CANCELLED.labels(route.path if route else "unmatched").inc()
+                        app_task.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(watch_client())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            # Отменён сам middleware, а не только обработчик из-за отключения клиента: отмена идёт дальше
+            if not watcher.done():
+                raise
+        finally:
+            watcher.cancel()
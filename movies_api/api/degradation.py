@@ -0,0 +1,47 @@
+from core.circuit_breaker import is_degraded
+from core.degradation import track_degradation
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+DEGRADED_HEADER = "X-Degraded"
+
+
+class DegradedResponseMiddleware:
+    """
+    Marks degraded responses with the X-Degraded header, its value lists the reasons.
+
+    A response is degraded when ElasticSearch is cut off by the circuit
+    breaker (circuit_open), so everything comes from the cache only, or
+    when an expired cache entry was served in place of a fresh one
+    (deadline, overload, unavailable, circuit_open).
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+    ):
+        self.app = app
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Причины собираются до запуска обработчика: его задачи получают этот же набор
+        reasons = track_degradation()
+
+        async def send_response(message: Message):
+            if message["type"] == "http.response.start":
+                if is_degraded():
+                    reasons.add("circuit_open")
+                if reasons:
+                    headers = list(message.get("headers", []))
+                    headers.append((DEGRADED_HEADER.lower().encode(), ",".join(sorted(reasons)).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_response)
@@ -0,0 +1,27 @@
+from http import HTTPStatus
+
+from fastapi import APIRouter, Request, Response
+
+router = APIRouter()
+
+
+@router.get(
+    "/health/live",
+    include_in_schema=False,
+)
+async def live() -> Response:
+    return Response(status_code=HTTPStatus.OK)
+
+
+@router.get(
+    "/health/ready",
+    include_in_schema=False,
+)
+async def ready(
+    request: Request,
+) -> Response:
+    """The worker is ready once the connections are opened and the hot pages are cached."""
+    warm_up_task = getattr(request.app.state, "warm_up_task", None)
+    if warm_up_task is None or not warm_up_task.done():
+        return Response(status_code=HTTPStatus.SERVICE_UNAVAILABLE)
+    return Response(status_code=HTTPStatus.OK)
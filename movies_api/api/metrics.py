@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter()
+
+
+@router.get(
+    "/metrics",
+    include_in_schema=False,
+)
+async def metrics() -> Response:
+    return Response(
+        content=generate_latest(),
+        # media_type добавил бы к типу второй charset
+        headers={"Content-Type": CONTENT_TYPE_LATEST},
+    )
@@ -1,14 +1,52 @@
 from http import HTTPStatus
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from api.v1.params import (
+    DEFAULT_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    etag_matches,
+    json_response,
+    ndjson_response,
+    not_modified_response,
+    parse_fields,
+    parse_ids,
+)
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from models.film import Film
 from models.sort import MoviesSortOptions
+from services.cursor import InvalidCursorError
 from services.film import FilmService, get_film_service
 
 router = APIRouter()
 
 
+@router.get(
+    "",
+    summary="Get many movies by uuids.",
+    description="Returns movies for the given uuids in the requested order. Unknown uuids are skipped.",
+    tags=["Movies"],
+    response_model=List[Film],
+)
+async def film_details_batch(
+    ids: List[str] = Query(
+        [],
+        description="Uuids of movies, repeated or comma separated",
+    ),
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    if_none_match: str = Header(
+        None,
+        description="ETag of a response the client already has, 304 is returned if it has not changed",
+    ),
+    film_service: FilmService = Depends(get_film_service),
+) -> Response:
+    body = await film_service.get_json_many_by_ids(parse_ids(ids), parse_fields(fields, Film))
+    return json_response(body, if_none_match)
+
+
 @router.get(
     "/search",
     summary="Search throw all movies.",
@@ -26,7 +64,7 @@ async def film_details_list(
         description='Sort order (Use "imdb_rating" for ascending or "-imdb_rating" for descending)',
     ),
     page_size: int = Query(
-        50,
+        DEFAULT_PAGE_SIZE,
         ge=1,
         le=100,
         description="Number of films per page",
@@ -36,15 +74,94 @@ async def film_details_list(
         ge=1,
         description="Page number",
     ),
+    cursor: str = Query(
+        None,
+        description="Cursor for deep pagination, replaces page_number. "
+        f"Pass an empty value to get the first page, the next cursor is returned in the {NEXT_CURSOR_HEADER} header",
+    ),
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    if_none_match: str = Header(
+        None,
+        description="ETag of a response the client already has, 304 is returned if it has not changed",
+    ),
     film_service: FilmService = Depends(get_film_service),
-) -> List[Film]:
-    films = await film_service.get_many_by_parameters(
+) -> Response:
+    fields = parse_fields(fields, Film)
+    if cursor is not None:
+        try:
+            if if_none_match:
+                etag = await film_service.get_etag_page_by_cursor(
+                    page_size=page_size,
+                    cursor=cursor,
+                    search=search,
+                    sort=sort,
+                    fields=fields,
+                )
+                if etag_matches(if_none_match, etag):
+                    return not_modified_response(etag)
+            body, next_cursor = await film_service.get_json_page_by_cursor(
+                page_size=page_size,
+                cursor=cursor,
+                search=search,
+                sort=sort,
+                fields=fields,
+            )
+        except InvalidCursorError:
+            raise HTTPException(
+                status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+                detail="invalid cursor",
+            )
+        return json_response(
+            body,
+            if_none_match,
+            headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None,
+        )
+
+    if if_none_match:
+        etag = await film_service.get_etag_by_parameters(
+            search=search,
+            page_number=page_number,
+            page_size=page_size,
+            sort=sort,
+            fields=fields,
+        )
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag)
+
+    body = await film_service.get_json_by_parameters(
         search=search,
         page_number=page_number,
         page_size=page_size,
         sort=sort,
+        fields=fields,
     )
-    return films
+    return json_response(body, if_none_match)
+
+
+@router.get(
+    "/export",
+    summary="Export all movies.",
+    description="Streams all movies in id order as NDJSON, one movie per line. "
+    "An interrupted export resumes from the id of the last received movie passed as after.",
+    tags=["Export"],
+    response_class=StreamingResponse,
+)
+async def film_export(
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    after: str = Query(
+        None,
+        description="Id of the last movie already received, the export continues after it",
+    ),
+    film_service: FilmService = Depends(get_film_service),
+) -> StreamingResponse:
+    lines = await film_service.export_ndjson(parse_fields(fields, Film), after)
+    return ndjson_response(lines)
 
 
 @router.get(
@@ -55,12 +172,60 @@ async def film_details_list(
 )
 async def film_details(
     film_id: str,
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    if_none_match: str = Header(
+        None,
+        description="ETag of a response the client already has, 304 is returned if it has not changed",
+    ),
     film_service: FilmService = Depends(get_film_service),
-) -> Film:
-    film = await film_service.get_by_id(film_id)
-    if not film:
+) -> Response:
+    fields = parse_fields(fields, Film)
+    if if_none_match:
+        etag = await film_service.get_etag_by_id(film_id, fields)
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag)
+
+    body = await film_service.get_json_by_id(film_id, fields)
+    if body is None:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail="film not found",
+        )
+    return json_response(body, if_none_match)
+
+
+@router.get(
+    "/{film_id}/similar",
+    summary="Get movies similar to the movie.",
+    description="Returns the movies most similar to the movie by title, description, genres and actors.",
+    tags=["Movies"],
+    response_model=List[Film],
+)
+async def film_similar(
+    film_id: str,
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    if_none_match: str = Header(
+        None,
+        description="ETag of a response the client already has, 304 is returned if it has not changed",
+    ),
+    film_service: FilmService = Depends(get_film_service),
+) -> Response:
+    fields = parse_fields(fields, Film)
+    if if_none_match:
+        etag = await film_service.get_etag_similar(film_id, fields)
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag)
+
+    body = await film_service.get_json_similar(film_id, fields)
+    if body is None:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND,
             detail="film not found",
         )
-    return film
+    return json_response(body, if_none_match)
@@ -1,13 +1,49 @@
 from http import HTTPStatus
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from api.v1.params import (
+    DEFAULT_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    etag_matches,
+    json_response,
+    not_modified_response,
+    parse_fields,
+    parse_ids,
+)
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 from models.genre import Genre
+from services.cursor import InvalidCursorError
 from services.genre import GenreService, get_genre_service
 
 router = APIRouter()
 
 
+@router.get(
+    "",
+    summary="Get many genres by uuids.",
+    description="Returns genres for the given uuids in the requested order. Unknown uuids are skipped.",
+    tags=["Genres"],
+    response_model=List[Genre],
+)
+async def genre_details_batch(
+    ids: List[str] = Query(
+        [],
+        description="Uuids of genres, repeated or comma separated",
+    ),
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    if_none_match: str = Header(
+        None,
+        description="ETag of a response the client already has, 304 is returned if it has not changed",
+    ),
+    genre_service: GenreService = Depends(get_genre_service),
+) -> Response:
+    body = await genre_service.get_json_many_by_ids(parse_ids(ids), parse_fields(fields, Genre))
+    return json_response(body, if_none_match)
+
+
 @router.get(
     "/search",
     summary="Search throw genres",
@@ -21,7 +57,7 @@ async def genre_details_list(
         description="Searching text",
     ),
     page_size: int = Query(
-        50,
+        DEFAULT_PAGE_SIZE,
         ge=1,
         le=100,
         description="Number of genres per page",
@@ -31,15 +67,68 @@ async def genre_details_list(
         ge=1,
         description="Page number",
     ),
+    cursor: str = Query(
+        None,
+        description="Cursor for deep pagination, replaces page_number. "
+        f"Pass an empty value to get the first page, the next cursor is returned in the {NEXT_CURSOR_HEADER} header",
+    ),
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    if_none_match: str = Header(
+        None,
+        description="ETag of a response the client already has, 304 is returned if it has not changed",
+    ),
     genre_service: GenreService = Depends(get_genre_service),
-) -> List[Genre]:
-    genres = await genre_service.filter(
+) -> Response:
+    fields = parse_fields(fields, Genre)
+    if cursor is not None:
+        try:
+            if if_none_match:
+                etag = await genre_service.get_etag_page_by_cursor(
+                    page_size=page_size,
+                    cursor=cursor,
+                    search=search,
+                    fields=fields,
+                )
+                if etag_matches(if_none_match, etag):
+                    return not_modified_response(etag)
+            body, next_cursor = await genre_service.get_json_page_by_cursor(
+                page_size=page_size,
+                cursor=cursor,
+                search=search,
+                fields=fields,
+            )
+        except InvalidCursorError:
+            raise HTTPException(
+                status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+                detail="invalid cursor",
+            )
+        return json_response(
+            body,
+            if_none_match,
+            headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None,
+        )
+
+    if if_none_match:
+        etag = await genre_service.get_etag_by_parameters(
+            search=search,
+            page_number=page_number,
+            page_size=page_size,
+            fields=fields,
+        )
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag)
+
+    body = await genre_service.get_json_by_parameters(
         search=search,
         page_number=page_number,
         page_size=page_size,
+        fields=fields,
     )
 
-    return genres
+    return json_response(body, if_none_match)
 
 
 @router.get(
@@ -50,13 +139,27 @@ async def genre_details_list(
 )
 async def genre_details(
     genre_id: str,
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    if_none_match: str = Header(
+        None,
+        description="ETag of a response the client already has, 304 is returned if it has not changed",
+    ),
     genre_service: GenreService = Depends(get_genre_service),
-) -> Genre:
-    genre = await genre_service.get_by_id(genre_id)
-    if not genre:
+) -> Response:
+    fields = parse_fields(fields, Genre)
+    if if_none_match:
+        etag = await genre_service.get_etag_by_id(genre_id, fields)
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag)
+
+    body = await genre_service.get_json_by_id(genre_id, fields)
+    if body is None:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND,
             detail="genre not found",
         )
 
-    return genre
+    return json_response(body, if_none_match)
@@ -0,0 +1,118 @@
+from http import HTTPStatus
+from typing import AsyncIterator
+
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from services.cache import JsonBody
+
+MAX_BATCH_SIZE = 100
+DEFAULT_PAGE_SIZE = 50
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+ETAG_HEADER = "ETag"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def parse_ids(
+    ids: list[str],
+) -> list[str]:
+    """
+    Collects ids passed either as repeated query parameters (?ids=1&ids=2)
+    or as a comma separated list (?ids=1,2).
+    """
+    parsed_ids = [item.strip() for value in ids for item in value.split(",") if item.strip()]
+    if not parsed_ids:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail="at least one id is required",
+        )
+    if len(parsed_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail=f"no more than {MAX_BATCH_SIZE} ids per request",
+        )
+    return parsed_ids
+
+
+def parse_fields(
+    fields: str | None,
+    model: type[BaseModel],
+) -> tuple[str, ...] | None:
+    """
+    Parses the comma separated list of fields to return (?fields=id,title).
+
+    The id is always returned, it identifies the documents in the cache.
+    None means that all fields of the model are returned.
+    """
+    if not fields:
+        return None
+    parsed_fields = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown_fields = parsed_fields - model.model_fields.keys()
+    if unknown_fields:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail=f"unknown fields: {', '.join(sorted(unknown_fields))}",
+        )
+    parsed_fields.add("id")
+    if parsed_fields == model.model_fields.keys():
+        return None
+    return tuple(sorted(parsed_fields))
+
+
+def json_response(
+    body: JsonBody,
+    if_none_match: str | None = None,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """
+    Response with an already serialized json body and its ETag.
+
+    Cached bodies are returned as they are, so FastAPI neither validates them
+    against the response model nor serializes them again. If the client
+    already has the body, 304 is returned without it.
+    """
+    if etag_matches(if_none_match, body.etag):
+        return not_modified_response(body.etag)
+    return Response(
+        content=body.data,
+        media_type="application/json",
+        headers={**(headers or {}), ETAG_HEADER: body.etag},
+    )
+
+
+def ndjson_response(
+    lines: AsyncIterator[bytes],
+) -> StreamingResponse:
+    """
+    Response streamed as the lines are produced.
+
+    Every chunk is sent before the next one is requested, so the producer
+    goes no faster than the client reads.
+    """
+    return StreamingResponse(
+        lines,
+        media_type=NDJSON_MEDIA_TYPE,
+    )
+
+
+def not_modified_response(
+    etag: str,
+) -> Response:
+    return Response(
+        status_code=HTTPStatus.NOT_MODIFIED,
+        headers={ETAG_HEADER: etag},
+    )
+
+
+def etag_matches(
+    if_none_match: str | None,
+    etag: str | None,
+) -> bool:
+    """Weak comparison of If-None-Match with the etag (RFC 9110, 13.1.2): W/ is ignored, * matches any etag."""
+    if not if_none_match or not etag:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
@@ -1,13 +1,51 @@
 from http import HTTPStatus
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from api.v1.params import (
+    DEFAULT_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    etag_matches,
+    json_response,
+    ndjson_response,
+    not_modified_response,
+    parse_fields,
+    parse_ids,
+)
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from models.person import Person
+from services.cursor import InvalidCursorError
 from services.person import PersonService, get_person_service
 
 router = APIRouter()
 
 
+@router.get(
+    "",
+    summary="Get many persons by uuids.",
+    description="Returns persons for the given uuids in the requested order. Unknown uuids are skipped.",
+    tags=["Persons"],
+    response_model=List[Person],
+)
+async def person_details_batch(
+    ids: List[str] = Query(
+        [],
+        description="Uuids of persons, repeated or comma separated",
+    ),
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    if_none_match: str = Header(
+        None,
+        description="ETag of a response the client already has, 304 is returned if it has not changed",
+    ),
+    person_service: PersonService = Depends(get_person_service),
+) -> Response:
+    body = await person_service.get_json_many_by_ids(parse_ids(ids), parse_fields(fields, Person))
+    return json_response(body, if_none_match)
+
+
 @router.get(
     "/search",
     summary="Search throw persons according name.",
@@ -21,7 +59,7 @@ async def person_details_list(
         description="Searching text",
     ),
     page_size: int = Query(
-        50,
+        DEFAULT_PAGE_SIZE,
         ge=1,
         le=100,
         description="Number of persons per page",
@@ -31,15 +69,91 @@ async def person_details_list(
         ge=1,
         description="Page number",
     ),
+    cursor: str = Query(
+        None,
+        description="Cursor for deep pagination, replaces page_number. "
+        f"Pass an empty value to get the first page, the next cursor is returned in the {NEXT_CURSOR_HEADER} header",
+    ),
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    if_none_match: str = Header(
+        None,
+        description="ETag of a response the client already has, 304 is returned if it has not changed",
+    ),
     person_service: PersonService = Depends(get_person_service),
-) -> List[Person]:
-    persons = await person_service.filter(
+) -> Response:
+    fields = parse_fields(fields, Person)
+    if cursor is not None:
+        try:
+            if if_none_match:
+                etag = await person_service.get_etag_page_by_cursor(
+                    page_size=page_size,
+                    cursor=cursor,
+                    search=search,
+                    fields=fields,
+                )
+                if etag_matches(if_none_match, etag):
+                    return not_modified_response(etag)
+            body, next_cursor = await person_service.get_json_page_by_cursor(
+                page_size=page_size,
+                cursor=cursor,
+                search=search,
+                fields=fields,
+            )
+        except InvalidCursorError:
+            raise HTTPException(
+                status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+                detail="invalid cursor",
+            )
+        return json_response(
+            body,
+            if_none_match,
+            headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None,
+        )
+
+    if if_none_match:
+        etag = await person_service.get_etag_by_parameters(
+            search=search,
+            page_number=page_number,
+            page_size=page_size,
+            fields=fields,
+        )
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag)
+
+    body = await person_service.get_json_by_parameters(
         search=search,
         page_number=page_number,
         page_size=page_size,
+        fields=fields,
     )
 
-    return persons
+    return json_response(body, if_none_match)
+
+
+@router.get(
+    "/export",
+    summary="Export all persons.",
+    description="Streams all persons in id order as NDJSON, one person per line. "
+    "An interrupted export resumes from the id of the last received person passed as after.",
+    tags=["Export"],
+    response_class=StreamingResponse,
+)
+async def person_export(
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    after: str = Query(
+        None,
+        description="Id of the last person already received, the export continues after it",
+    ),
+    person_service: PersonService = Depends(get_person_service),
+) -> StreamingResponse:
+    lines = await person_service.export_ndjson(parse_fields(fields, Person), after)
+    return ndjson_response(lines)
 
 
 @router.get(
@@ -50,13 +164,27 @@ async def person_details_list(
 )
 async def person_details(
     person_id: str,
+    fields: str = Query(
+        None,
+        description="Comma separated fields to return, all fields if not given",
+    ),
+    if_none_match: str = Header(
+        None,
+        description="ETag of a response the client already has, 304 is returned if it has not changed",
+    ),
     person_service: PersonService = Depends(get_person_service),
-) -> Person:
-    person = await person_service.get_by_id(person_id)
-    if not person:
+) -> Response:
+    fields = parse_fields(fields, Person)
+    if if_none_match:
+        etag = await person_service.get_etag_by_id(person_id, fields)
+        if etag_matches(if_none_match, etag):
+            return not_modified_response(etag)
+
+    body = await person_service.get_json_by_id(person_id, fields)
+    if body is None:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND,
             detail="person not found",
         )
 
-    return person
+    return json_response(body, if_none_match)
@@ -0,0 +1,52 @@
+"""
+Compares codecs of cached values on a page of films.
+
+Usage (from the movies_api directory):
+
+    python -m benchmarks.cache_codecs [--films 100] [--actors 50] [--repeat 200]
+"""
+import argparse
+import time
+
+from benchmarks.fixtures import make_film_documents
+from core.codecs import CODECS
+from models.film import Film
+from services.cache import dump_json_list
+
+
+def _measure(
+    func,
+    data: bytes,
+    repeat: int,
+) -> float:
+    """Returns the mean time of one call in microseconds."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(data)
+    return (time.perf_counter() - started) / repeat * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=100, help="films per page")
+    parser.add_argument("--actors", type=int, default=50, help="actors per film")
+    parser.add_argument("--repeat", type=int, default=200, help="calls per measurement")
+    args = parser.parse_args()
+
+    films = [Film.parse_from_elastic(document) for document in make_film_documents(args.films, args.actors)]
+    page = dump_json_list(films)
+    film = films[0].model_dump_json().encode()
+
+    print(f"{'codec':<8}{'value':<8}{'bytes':>10}{'ratio':>8}{'compress, us':>16}{'decompress, us':>18}")
+    for name, codec in CODECS.items():
+        for value_name, data in (("film", film), ("page", page)):
+            compressed = codec.compress(data)
+            print(
+                f"{name:<8}{value_name:<8}{len(compressed):>10}{len(data) / len(compressed):>8.2f}"
+                f"{_measure(codec.compress, data, args.repeat):>16.1f}"
+                f"{_measure(codec.decompress, compressed, args.repeat):>18.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Replays a sample of search requests against the previous and the canonical cache keys and reports the hit ratio of each.
+
+The sample is a file with one request per line, a request target such as
+/api/v1/films/search?search=Star+Wars&sort=-imdb_rating or an access log
+line that contains one. Without a file a synthetic sample is replayed, in
+which people type the same popular searches in different case and with
+stray spaces. Only search pages are replayed: documents are cached by id,
+which the canonical keys do not change.
+
+Usage (from the movies_api directory):
+
+    python -m benchmarks.cache_keys [--sample access.log] [--requests 20000] [--capacity 0]
+"""
+import argparse
+import random
+import re
+from collections import OrderedDict
+from typing import Iterable, Iterator, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from api.v1.params import DEFAULT_PAGE_SIZE
+from benchmarks.fixtures import GENRES, LAST_NAMES, WORDS
+from models.sort import MoviesSortOptions
+from services.cache_key import build_cache_key, normalize_search
+
+# Путь поиска -> пространство страниц в кэше
+SEARCH_NAMESPACES = {
+    "/api/v1/films/search": "movies",
+    "/api/v1/genres/search": "genres",
+    "/api/v1/persons/search": "persons",
+}
+
+REQUEST_TARGET = re.compile(r"/api/v1/\S+")
+
+
+def previous_key(
+    namespace: str,
+    search: Optional[str],
+    sort: Optional[MoviesSortOptions],
+    page_size: int,
+    page_number: int,
+) -> str:
+    """The key the services built before the canonical keys, with the sort enum formatted by its name."""
+    return f"{namespace}_{search or ''}_{sort or ''}_{page_size}_{page_number}"
+
+
+def canonical_key(
+    namespace: str,
+    search: Optional[str],
+    sort: Optional[MoviesSortOptions],
+    page_size: int,
+    page_number: int,
+) -> str:
+    return build_cache_key(namespace, "page", normalize_search(search), sort, page_size, page_number)
+
+
+def read_sample(
+    lines: Iterable[str],
+) -> Iterator[tuple]:
+    """Yields the arguments of the key functions for every search request of the sample."""
+    for line in lines:
+        match = REQUEST_TARGET.search(line)
+        if not match:
+            continue
+        target = urlsplit(match.group())
+        namespace = SEARCH_NAMESPACES.get(target.path)
+        query = parse_qs(target.query, keep_blank_values=True)
+        if namespace is None or "cursor" in query:
+            continue
+        sort = query.get("sort", [None])[0] or None
+        try:
+            yield (
+                namespace,
+                query.get("search", [None])[0],
+                MoviesSortOptions(sort) if sort else None,
+                int(query.get("page_size", [DEFAULT_PAGE_SIZE])[0]),
+                int(query.get("page_number", [1])[0]),
+            )
+        except ValueError:
+            # Такой запрос отклонила бы валидация параметров, до кэша он не доходит
+            continue
+
+
+def synthetic_sample(
+    count: int,
+    seed: int = 0,
+) -> list[str]:
+    """Search requests with a long tail of popular searches, typed as people type them."""
+    rng = random.Random(seed)
+    phrases = [f"{first} {second}" for first in WORDS for second in WORDS if first != second]
+    rng.shuffle(phrases)
+    searches = [
+        ("/api/v1/films/search", phrases),
+        ("/api/v1/persons/search", list(LAST_NAMES)),
+        ("/api/v1/genres/search", list(GENRES)),
+    ]
+    variants = (
+        lambda text: text,
+        lambda text: text.title(),
+        lambda text: text.upper(),
+        lambda text: f"{text} ",
+        lambda text: text.replace(" ", "  "),
+    )
+    sample = []
+    for _ in range(count):
+        path, texts = rng.choices(searches, (6, 2, 2))[0]
+        text = rng.choices(texts, [1 / rank for rank in range(1, len(texts) + 1)])[0]
+        search = rng.choices(variants, (5, 3, 1, 1, 1))[0](text)
+        query = f"search={search}&page_number={rng.choices((1, 2, 3), (6, 3, 1))[0]}"
+        if path == "/api/v1/films/search":
+            query += f"&sort={rng.choice(('-imdb_rating', 'imdb_rating'))}"
+        sample.append(f"{path}?{query.replace(' ', '+')}")
+    return sample
+
+
+def replay(
+    keys: list[str],
+    capacity: int,
+) -> int:
+    """Returns the hits of a cache of the given number of entries evicting the least recently used, 0 for unbounded."""
+    cache: OrderedDict[str, None] = OrderedDict()
+    hits = 0
+    for key in keys:
+        if key in cache:
+            hits += 1
+            cache.move_to_end(key)
+            continue
+        cache[key] = None
+        if capacity and len(cache) > capacity:
+            cache.popitem(last=False)
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sample", help="file with request targets or access log lines, synthetic if not given")
+    parser.add_argument("--requests", type=int, default=20000, help="requests of the synthetic sample")
+    parser.add_argument("--capacity", type=int, default=0, help="pages the cache holds, 0 for unbounded")
+    args = parser.parse_args()
+
+    if args.sample:
+        with open(args.sample, encoding="utf-8") as sample:
+            requests = list(read_sample(sample))
+    else:
+        requests = list(read_sample(synthetic_sample(args.requests)))
+    if not requests:
+        print("No search requests in the sample")
+        return
+
+    cache = f"a cache of {args.capacity} pages" if args.capacity else "an unbounded cache"
+    print(f"{len(requests)} search requests, {cache}")
+    print(f"{'keys':<12}{'distinct':>10}{'hit ratio':>12}{'longest':>10}{'mean length':>14}")
+    for name, key in (("previous", previous_key), ("canonical", canonical_key)):
+        keys = [key(*request) for request in requests]
+        lengths = [len(key.encode()) for key in keys]
+        print(
+            f"{name:<12}{len(set(keys)):>10}{replay(keys, args.capacity) / len(keys):>12.1%}"
+            f"{max(lengths):>10}{sum(lengths) / len(lengths):>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
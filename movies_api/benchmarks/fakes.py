@@ -0,0 +1,289 @@
+"""
+In-process stand-ins for redis and ElasticSearch with injected latency.
+
+Redis is emulated by fakeredis, ElasticSearch by a small in-memory index
+that supports the queries the services send: match_all, multi_match,
+sorting, from/size, point in time with search_after and source filtering.
+"""
+import asyncio
+import itertools
+from functools import cmp_to_key
+from typing import Any, Optional
+
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+from elasticsearch import NotFoundError
+from fakeredis.aioredis import FakeRedis
+from redis.asyncio.client import Pipeline
+
+
+class SlowPipeline(Pipeline):
+    latency: float = 0
+
+    async def execute(
+        self,
+        raise_on_error: bool = True,
+    ) -> list[Any]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await super().execute(raise_on_error)
+
+
+class SlowRedis(FakeRedis):
+    """In-memory redis, every command and every pipeline waits for the latency, as a round trip would."""
+
+    def __init__(
+        self,
+        latency: float = 0,
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        self.latency = latency
+
+    async def execute_command(
+        self,
+        *args: Any,
+        **options: Any,
+    ) -> Any:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await super().execute_command(*args, **options)
+
+    def pipeline(
+        self,
+        transaction: bool = True,
+        shard_hint: str | None = None,
+    ) -> SlowPipeline:
+        pipe = SlowPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipe.latency = self.latency
+        return pipe
+
+
+def _not_found(
+    message: str,
+) -> NotFoundError:
+    meta = ApiResponseMeta(
+        status=404,
+        http_version="1.1",
+        headers=HttpHeaders(),
+        duration=0.0,
+        node=NodeConfig("http", "localhost", 9200),
+    )
+    return NotFoundError(message, meta, {"error": message})
+
+
+def _text(
+    value: Any,
+) -> str:
+    """Every string of the document in lower case, like the `*` field of multi_match sees it."""
+    if isinstance(value, str):
+        return value.lower()
+    if isinstance(value, dict):
+        return " ".join(_text(item) for item in value.values())
+    if isinstance(value, list):
+        return " ".join(_text(item) for item in value)
+    return ""
+
+
+def _compare(
+    values: list[Any],
+    other: list[Any],
+    orders: list[tuple[str, str]],
+) -> int:
+    """Compares sort values of two hits the way ElasticSearch orders them, missing values go last."""
+    for value, other_value, (_, order) in zip(values, other, orders):
+        if value == other_value:
+            continue
+        if value is None or other_value is None:
+            return 1 if value is None else -1
+        ascending = value < other_value
+        return -1 if ascending == (order == "asc") else 1
+    return 0
+
+
+class FakeElasticsearch:
+    """
+    In-memory ElasticSearch with the subset of the AsyncElasticsearch API the services use.
+
+    Relevance is the number of query words found in the document, which is
+    enough to have realistic result sizes and a stable order, while the
+    stand-in itself stays cheap next to the application it measures.
+    """
+
+    def __init__(
+        self,
+        indices: dict[str, list[dict]],
+        latency: float = 0,
+    ):
+        self.indices = {
+            index: {document["id"]: document for document in documents} for index, documents in indices.items()
+        }
+        self.latency = latency
+        self.calls = 0
+        self._words = {
+            index: {document_id: frozenset(_text(document).split()) for document_id, document in documents.items()}
+            for index, documents in self.indices.items()
+        }
+        self._pits: dict[str, str] = {}
+        self._pit_ids = itertools.count()
+
+    def options(
+        self,
+        **kwargs: Any,
+    ) -> "FakeElasticsearch":
+        return self
+
+    async def close(
+        self,
+    ):
+        pass
+
+    async def get(
+        self,
+        index: str,
+        id: str,
+        source_includes: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> dict:
+        await self._wait()
+        document = self.indices.get(index, {}).get(id)
+        if document is None:
+            raise _not_found(f"document {id} not found in {index}")
+        return self._hit(index, document, source_includes)
+
+    async def mget(
+        self,
+        index: str,
+        ids: list[str],
+        source_includes: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> dict:
+        await self._wait()
+        documents = self.indices.get(index, {})
+        return {
+            "docs": [
+                {**self._hit(index, documents[document_id], source_includes), "found": True}
+                if document_id in documents
+                else {"_index": index, "_id": document_id, "found": False}
+                for document_id in ids
+            ]
+        }
+
+    async def open_point_in_time(
+        self,
+        index: str,
+        keep_alive: str,
+        **kwargs: Any,
+    ) -> dict:
+        await self._wait()
+        pit_id = f"pit-{next(self._pit_ids)}"
+        self._pits[pit_id] = index
+        return {"id": pit_id}
+
+    async def close_point_in_time(
+        self,
+        id: str,
+        **kwargs: Any,
+    ) -> dict:
+        await self._wait()
+        self._pits.pop(id, None)
+        return {"succeeded": True}
+
+    async def search(
+        self,
+        index: Optional[str] = None,
+        body: Optional[dict] = None,
+        source_includes: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> dict:
+        await self._wait()
+        body = {**(body or {}), **kwargs}
+        pit_id = body.get("pit", {}).get("id")
+        if pit_id is not None:
+            if pit_id not in self._pits:
+                raise _not_found("search_context_missing_exception")
+            index = self._pits[pit_id]
+        if index not in self.indices:
+            raise _not_found(f"no such index [{index}]")
+
+        hits = self._match(index, body.get("query", {"match_all": {}}))
+        sort = body.get("sort")
+        if sort:
+            hits = self._sort(hits, sort)
+            search_after = body.get("search_after")
+            if search_after:
+                orders = [next(iter(clause.items())) for clause in sort]
+                hits = [hit for hit in hits if _compare(hit["sort"], search_after, orders) > 0]
+
+        start = body.get("from", 0)
+        page = hits[start : start + body.get("size", 10)]
+        response = {
+            "hits": {
+                "total": {"value": len(hits), "relation": "eq"},
+                "hits": [self._search_hit(index, hit, source_includes) for hit in page],
+            }
+        }
+        if pit_id is not None:
+            response["pit_id"] = pit_id
+        return response
+
+    async def _wait(
+        self,
+    ):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _match(
+        self,
+        index: str,
+        query: dict,
+    ) -> list[dict]:
+        documents = self.indices[index]
+        if "multi_match" not in query:
+            return [{"document": document, "_score": 1.0} for document in documents.values()]
+
+        words = query["multi_match"]["query"].lower().split()
+        hits = []
+        for document_id, document_words in self._words[index].items():
+            score = sum(word in document_words for word in words)
+            if score:
+                hits.append({"document": documents[document_id], "_score": float(score)})
+        hits.sort(key=lambda hit: -hit["_score"])
+        return hits
+
+    @staticmethod
+    def _sort(
+        hits: list[dict],
+        sort: list[dict],
+    ) -> list[dict]:
+        orders = [next(iter(clause.items())) for clause in sort]
+        for hit in hits:
+            hit["sort"] = [hit["_score"] if field == "_score" else hit["document"].get(field) for field, _ in orders]
+        return sorted(hits, key=cmp_to_key(lambda left, right: _compare(left["sort"], right["sort"], orders)))
+
+    def _search_hit(
+        self,
+        index: str,
+        hit: dict,
+        source_includes: Optional[list[str]],
+    ) -> dict:
+        search_hit = self._hit(index, hit["document"], source_includes)
+        search_hit["_score"] = hit["_score"]
+        if "sort" in hit:
+            search_hit["sort"] = hit["sort"]
+        return search_hit
+
+    @staticmethod
+    def _hit(
+        index: str,
+        document: dict,
+        source_includes: Optional[list[str]],
+    ) -> dict:
+        source = document
+        if source_includes:
+            source = {field: value for field, value in document.items() if field in source_includes}
+        return {
+            "_index": index,
+            "_id": document["id"],
+            "_source": source,
+        }
@@ -0,0 +1,169 @@
+"""Deterministic documents shaped like the ones the ETL loads into ElasticSearch."""
+import random
+import uuid
+
+GENRES = (
+    "Action",
+    "Adventure",
+    "Animation",
+    "Comedy",
+    "Crime",
+    "Documentary",
+    "Drama",
+    "Fantasy",
+    "History",
+    "Horror",
+    "Mystery",
+    "Romance",
+    "Sci-Fi",
+    "Thriller",
+    "War",
+    "Western",
+)
+
+WORDS = (
+    "star",
+    "galaxy",
+    "empire",
+    "return",
+    "night",
+    "dark",
+    "captain",
+    "planet",
+    "lost",
+    "city",
+    "hope",
+    "shadow",
+    "war",
+    "journey",
+    "secret",
+    "last",
+    "rebel",
+    "storm",
+    "kingdom",
+    "dream",
+)
+
+FIRST_NAMES = ("John", "Anna", "Mark", "Carrie", "Harrison", "Natalie", "Ewan", "Liam", "Emma", "Daisy")
+LAST_NAMES = ("Smith", "Fisher", "Ford", "Portman", "McGregor", "Neeson", "Watson", "Ridley", "Hamill", "Lucas")
+
+
+def _uuid(
+    rng: random.Random,
+) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _sentence(
+    rng: random.Random,
+    length: int,
+) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(length)).capitalize()
+
+
+def make_persons(
+    count: int,
+    seed: int = 0,
+) -> list[dict]:
+    """Returns persons as they are nested into films: id and name."""
+    rng = random.Random(seed)
+    return [
+        {
+            "id": _uuid(rng),
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        }
+        for _ in range(count)
+    ]
+
+
+def make_film_sources(
+    count: int,
+    actors_per_film: int = 50,
+    seed: int = 0,
+    persons: list[dict] | None = None,
+) -> list[dict]:
+    """Returns `_source` of film documents, every film has many actors, like the largest films of the index."""
+    rng = random.Random(seed)
+    persons = persons or make_persons(max(actors_per_film * 4, 100), seed=seed)
+    films = []
+    for _ in range(count):
+        actors = rng.sample(persons, actors_per_film)
+        writers = rng.sample(persons, 3)
+        directors = rng.sample(persons, 1)
+        films.append(
+            {
+                "id": _uuid(rng),
+                "imdb_rating": round(rng.uniform(1, 10), 1),
+                "genre": rng.sample(GENRES, 3),
+                "title": _sentence(rng, 3),
+                "description": _sentence(rng, 40),
+                "director": [director["name"] for director in directors],
+                "actors_names": [actor["name"] for actor in actors],
+                "writers_names": [writer["name"] for writer in writers],
+                "actors": actors,
+                "writers": writers,
+            }
+        )
+    return films
+
+
+def make_film_documents(
+    count: int,
+    actors_per_film: int = 50,
+    seed: int = 0,
+) -> list[dict]:
+    """Returns film hits as ElasticSearch returns them from search and get."""
+    return [
+        {
+            "_index": "movies",
+            "_id": source["id"],
+            "_score": 1.0,
+            "_source": source,
+        }
+        for source in make_film_sources(count, actors_per_film, seed)
+    ]
+
+
+def make_indices(
+    films: int = 1000,
+    persons: int = 2000,
+    actors_per_film: int = 50,
+    seed: int = 0,
+) -> dict[str, list[dict]]:
+    """
+    Returns `_source` of the documents of every index: movies, persons and genres.
+
+    The persons index is built from the films, so the films of a person
+    and the roles in them are consistent with the casts of the films.
+    """
+    rng = random.Random(seed)
+    people = make_persons(persons, seed=seed)
+    film_sources = make_film_sources(films, actors_per_film, seed, persons=people)
+
+    roles: dict[str, dict[str, list[str]]] = {person["id"]: {} for person in people}
+    for film in film_sources:
+        for role, members in (("actor", film["actors"]), ("writer", film["writers"])):
+            for member in members:
+                roles[member["id"]].setdefault(film["id"], []).append(role)
+
+    person_sources = [
+        {
+            "id": person["id"],
+            "full_name": person["name"],
+            "films": [{"id": film_id, "roles": film_roles} for film_id, film_roles in roles[person["id"]].items()],
+        }
+        for person in people
+    ]
+    genre_sources = [
+        {
+            "id": _uuid(rng),
+            "name": genre,
+            "description": _sentence(rng, 12),
+        }
+        for genre in GENRES
+    ]
+    return {
+        "movies": film_sources,
+        "persons": person_sources,
+        "genres": genre_sources,
+    }
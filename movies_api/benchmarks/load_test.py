@@ -0,0 +1,275 @@
+"""
+Load test of movies_api against in-process redis and ElasticSearch.
+
+The application is called directly through ASGI, so the numbers include
+routing, middleware, services and serialization, but no sockets. Every
+scenario is run twice: with empty caches (cold) and right after that
+with the caches filled by the first run (warm).
+
+Usage (from the movies_api directory):
+
+    python -m benchmarks.load_test [--requests 2000] [--concurrency 50]
+        [--es-latency 0.005] [--redis-latency 0.0005] [--allocations]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import tracemalloc
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+from urllib.parse import urlencode
+
+from benchmarks.fakes import FakeElasticsearch, SlowRedis
+from benchmarks.fixtures import GENRES, LAST_NAMES, WORDS, make_indices
+from db import elastic, redis
+from db.local_cache import local_cache
+from main import app
+
+
+@dataclass
+class Request:
+    route: str
+    path: str
+    query: str = ""
+
+
+@dataclass
+class ScenarioResult:
+    """
+    Attributes:
+    - name (str): Scenario name.
+    - duration (float): Wall time of the whole scenario in seconds.
+    - latencies (dict): Latencies of successful requests in seconds by route.
+    - errors (dict): Responses with a status other than 200 and 404 by route.
+    - allocated_peak (int): Peak of traced memory in bytes, if allocations were traced.
+    - allocated_retained (int): Traced memory left after the scenario in bytes, if allocations were traced.
+    """
+
+    name: str
+    duration: float = 0
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    errors: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    allocated_peak: int | None = None
+    allocated_retained: int | None = None
+
+    @property
+    def requests(
+        self,
+    ) -> int:
+        return sum(len(latencies) for latencies in self.latencies.values()) + sum(self.errors.values())
+
+
+def build_workload(
+    indices: dict[str, list[dict]],
+    count: int,
+    seed: int = 0,
+) -> list[Request]:
+    """
+    Mix of detail and search requests.
+
+    Popularity of films and searches follows a long tail, so a warm cache
+    answers most of the requests, as it does in production.
+    """
+    rng = random.Random(seed)
+    film_ids = [film["id"] for film in indices["movies"]]
+    film_weights = [1 / rank for rank in range(1, len(film_ids) + 1)]
+    routes: list[tuple[str, Callable[[], Request]]] = [
+        (
+            "/films/{film_id}",
+            lambda: Request("/films/{film_id}", f"/api/v1/films/{rng.choices(film_ids, film_weights)[0]}"),
+        ),
+        (
+            "/films/search",
+            lambda: Request(
+                "/films/search",
+                "/api/v1/films/search",
+                urlencode(
+                    {
+                        "search": rng.choice(WORDS),
+                        "page_number": rng.choices((1, 2, 3), (6, 3, 1))[0],
+                        "sort": rng.choice(("-imdb_rating", "imdb_rating")),
+                    }
+                ),
+            ),
+        ),
+        (
+            "/persons/search",
+            lambda: Request("/persons/search", "/api/v1/persons/search", urlencode({"search": rng.choice(LAST_NAMES)})),
+        ),
+        (
+            "/genres/search",
+            lambda: Request("/genres/search", "/api/v1/genres/search", urlencode({"search": rng.choice(GENRES)})),
+        ),
+    ]
+    route_weights = (5, 3, 1, 1)
+    return [rng.choices(routes, route_weights)[0][1]() for _ in range(count)]
+
+
+async def call(
+    request: Request,
+) -> int:
+    """Calls the application through ASGI and returns the response status."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": request.path,
+        "raw_path": request.path.encode(),
+        "query_string": request.query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"benchmark")],
+        "client": ("127.0.0.1", 0),
+        "server": ("benchmark", 80),
+    }
+    status = 0
+    response_sent = asyncio.Event()
+    request_received = False
+
+    async def receive() -> dict:
+        nonlocal request_received
+        if not request_received:
+            request_received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Клиент не отключается, пока ответ не отправлен
+        await response_sent.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            response_sent.set()
+
+    await app(scope, receive, send)
+    return status
+
+
+async def run_scenario(
+    name: str,
+    workload: list[Request],
+    concurrency: int,
+) -> ScenarioResult:
+    result = ScenarioResult(name)
+    requests: Iterator[Request] = iter(workload)
+
+    async def worker():
+        for request in requests:
+            started = time.perf_counter()
+            status = await call(request)
+            elapsed = time.perf_counter() - started
+            if status in (200, 404):
+                result.latencies[request.route].append(elapsed)
+            else:
+                result.errors[request.route] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.duration = time.perf_counter() - started
+    return result
+
+
+async def reset_caches():
+    await redis.redis.flushall()
+    local_cache.clear()
+
+
+async def run(
+    requests: int,
+    concurrency: int,
+    es_latency: float,
+    redis_latency: float,
+    films: int,
+    actors: int,
+    trace_allocations: bool,
+) -> list[ScenarioResult]:
+    indices = make_indices(films=films, persons=films * 2, actors_per_film=actors)
+    elastic.es = FakeElasticsearch(indices, latency=es_latency)
+    redis.redis = SlowRedis(latency=redis_latency)
+    workload = build_workload(indices, requests)
+
+    await reset_caches()
+    results = [
+        await run_scenario("cold", workload, concurrency),
+        await run_scenario("warm", workload, concurrency),
+    ]
+    if trace_allocations:
+        # Трассировка замедляет выполнение в разы, поэтому задержки берутся из прогонов без неё
+        await reset_caches()
+        tracemalloc.start()
+        for result in results:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await run_scenario(result.name, workload, concurrency)
+            after, peak = tracemalloc.get_traced_memory()
+            result.allocated_peak = peak - before
+            result.allocated_retained = after - before
+        tracemalloc.stop()
+    return results
+
+
+def _percentile(
+    latencies: list[float],
+    percentile: int,
+) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100)[percentile - 1]
+
+
+def report(
+    results: list[ScenarioResult],
+):
+    print(f"{'scenario':<10}{'route':<20}{'requests':>10}{'errors':>8}{'p50, ms':>10}{'p95, ms':>10}{'p99, ms':>10}")
+    for result in results:
+        all_latencies = [latency for latencies in result.latencies.values() for latency in latencies]
+        rows = [*sorted(result.latencies.items()), ("all", all_latencies)]
+        for route, latencies in rows:
+            errors = sum(result.errors.values()) if route == "all" else result.errors.get(route, 0)
+            print(
+                f"{result.name:<10}{route:<20}{len(latencies) + errors:>10}{errors:>8}"
+                f"{_percentile(latencies, 50) * 1000:>10.2f}"
+                f"{_percentile(latencies, 95) * 1000:>10.2f}"
+                f"{_percentile(latencies, 99) * 1000:>10.2f}"
+            )
+        line = f"{result.name:<10}{'throughput':<20}{result.requests / result.duration:>10.0f} rps"
+        if result.allocated_peak is not None:
+            line += (
+                f", allocations: peak {result.allocated_peak / 1024:.0f} KiB,"
+                f" retained {result.allocated_retained / 1024:.0f} KiB"
+            )
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="requests in flight")
+    parser.add_argument("--es-latency", type=float, default=0.005, help="latency of every elastic call, seconds")
+    parser.add_argument("--redis-latency", type=float, default=0.0005, help="latency of every redis call, seconds")
+    parser.add_argument("--films", type=int, default=1000, help="films in the index")
+    parser.add_argument("--actors", type=int, default=50, help="actors per film")
+    parser.add_argument("--allocations", action="store_true", help="repeat the scenarios with traced allocations")
+    args = parser.parse_args()
+
+    results = asyncio.run(
+        run(
+            requests=args.requests,
+            concurrency=args.concurrency,
+            es_latency=args.es_latency,
+            redis_latency=args.redis_latency,
+            films=args.films,
+            actors=args.actors,
+            trace_allocations=args.allocations,
+        )
+    )
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compares the (de)serialization paths of a page of films before and after the move to json bytes.
+
+The previous implementations are kept here as the reference: models were
+built object by object from ElasticSearch and redis and dumped model by
+model. Now the json is built from the trusted ElasticSearch source without
+models, cached and returned as is.
+
+Usage (from the movies_api directory):
+
+    python -m benchmarks.serialization [--films 100] [--actors 50] [--repeat 50]
+"""
+import argparse
+import time
+from typing import Callable
+
+import orjson
+from benchmarks.fixtures import make_film_documents
+from models.film import Film, film_from_source
+from models.genre import MovieGenre
+from models.person import MoviePerson, MoviePersonName
+from services.cache import dump_json_list, join_json_list
+
+
+def reference_film_from_elastic(
+    document: dict,
+) -> Film:
+    source = document["_source"]
+    return Film(
+        id=source["id"],
+        title=source["title"],
+        description=source["description"],
+        imdb_rating=source["imdb_rating"],
+        actors=[MoviePerson(id=person["id"], full_name=person["name"]) for person in source["actors"]],
+        writers=[MoviePerson(id=person["id"], full_name=person["name"]) for person in source["writers"]],
+        directors=[MoviePersonName(full_name=name) for name in source["director"] if name is not None],
+        genres=[MovieGenre(name=name) for name in source["genre"]],
+    )
+
+
+def reference_film_from_redis(
+    film: dict,
+) -> Film:
+    return Film(
+        id=film["id"],
+        title=film["title"],
+        description=film["description"],
+        imdb_rating=film["imdb_rating"],
+        actors=[MoviePerson(id=person["id"], full_name=person["full_name"]) for person in film["actors"]],
+        writers=[MoviePerson(id=person["id"], full_name=person["full_name"]) for person in film["writers"]],
+        directors=[MoviePersonName(full_name=director["full_name"]) for director in film["directors"]],
+        genres=[MovieGenre(name=genre["name"]) for genre in film["genres"]],
+    )
+
+
+def _measure(
+    func: Callable[[], object],
+    repeat: int,
+) -> float:
+    """Returns the best time of one call in milliseconds, the best one is the least disturbed by the system."""
+    func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=100, help="films per page")
+    parser.add_argument("--actors", type=int, default=50, help="actors per film")
+    parser.add_argument("--repeat", type=int, default=50, help="calls per measurement")
+    args = parser.parse_args()
+
+    documents = make_film_documents(args.films, args.actors)
+    page = orjson.dumps([film_from_source(document["_source"]) for document in documents])
+    films = [orjson.dumps(film) for film in orjson.loads(page)]
+    # Новый путь обязан отдавать ровно тот же json, что и модели
+    assert page == dump_json_list(reference_film_from_elastic(document) for document in documents)
+
+    cases = (
+        (
+            "elastic -> response",
+            lambda: dump_json_list([reference_film_from_elastic(document) for document in documents]),
+            lambda: orjson.dumps([film_from_source(document["_source"]) for document in documents]),
+        ),
+        (
+            "cache -> batch response",
+            lambda: dump_json_list([reference_film_from_redis(orjson.loads(film)) for film in films]),
+            lambda: join_json_list(films),
+        ),
+    )
+    print(f"{'path':<26}{'before, ms':>12}{'after, ms':>12}{'speedup':>10}")
+    for name, before, after in cases:
+        before_ms = _measure(before, args.repeat)
+        after_ms = _measure(after, args.repeat)
+        print(f"{name:<26}{before_ms:>12.2f}{after_ms:>12.3f}{before_ms / after_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
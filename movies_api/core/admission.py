@@ -0,0 +1,245 @@
+import asyncio
+import contextlib
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Iterator
+
+from core.config import settings
+from core.deadline import DeadlineExceededError, remaining_budget
+from elasticsearch import ApiError
+
+# Фоновые обновления устаревших записей не ждут в очереди: их место отдаётся запросам клиентов
+_background: ContextVar[bool] = ContextVar("admission_background", default=False)
+
+
+class OverloadedError(Exception):
+    """The call was not admitted: the limit is reached and the wait queue is full or the wait timed out."""
+
+
+@dataclass
+class AdmissionStats:
+    admitted: int = 0
+    queued: int = 0
+    rejected_queue_full: int = 0
+    rejected_queue_timeout: int = 0
+    rejected_background: int = 0
+    rejected_deadline: int = 0
+    wait_seconds: float = 0.0
+    increases: int = 0
+    decreases: int = 0
+
+
+class AdmissionController:
+    """
+    Adaptive concurrency limit with a bounded wait queue (AIMD).
+
+    A call is admitted while the calls in flight are below the limit,
+    otherwise it waits in a FIFO queue. A call that finds the queue full,
+    or waits longer than the queue timeout, is rejected at once, so a slow
+    backend gets a bounded amount of work instead of a growing pile of it.
+
+    The limit follows the latency of the calls: every call faster than the
+    target adds 1/limit to it, so a fully used limit grows by about one per
+    round of calls. A slower or failed call multiplies it by the backoff
+    ratio, at most once per target latency, so one burst of slow calls
+    does not collapse the limit to the minimum.
+
+    Attributes:
+    - limit (float): Current limit of calls in flight.
+    - min_limit (int): The limit never goes below it.
+    - max_limit (int): The limit never goes above it.
+    - latency_target (float): Calls slower than this, in seconds, decrease the limit.
+    - backoff_ratio (float): Multiplier of the limit on a slow or failed call.
+    - queue_size (int): Maximum number of waiting calls.
+    - queue_timeout (float): Maximum wait in the queue, in seconds.
+    - is_failure (Callable): Tells if an exception of the call signals overload.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+        queue_size: int,
+        queue_timeout: float,
+        backoff_ratio: float = 0.9,
+        is_failure: Callable[[Exception], bool] = lambda error: True,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.is_failure = is_failure
+        self.in_flight = 0
+        self.stats = AdmissionStats()
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+    ):
+        """Holds a slot for the duration of the call, the latency and the outcome of the call adjust the limit."""
+        await self.acquire()
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Отменённый вызов ничего не говорит о задержке, предел не меняется
+            self.release(0.0, failed=False, adjust=False)
+            raise
+        except Exception as error:
+            failed = self.is_failure(error)
+            self.release(time.perf_counter() - started, failed)
+            raise
+        else:
+            self.release(time.perf_counter() - started, failed)
+
+    async def acquire(
+        self,
+    ):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self.stats.admitted += 1
+            return
+        if _background.get():
+            self.stats.rejected_background += 1
+            raise OverloadedError("no free slot for a background call")
+        if len(self._waiters) >= self.queue_size:
+            self.stats.rejected_queue_full += 1
+            raise OverloadedError("wait queue is full")
+
+        # Ждать слот дольше, чем осталось у запроса, бессмысленно: ответ уже никому не нужен
+        timeout = self.queue_timeout
+        remaining = remaining_budget()
+        bound_by_deadline = remaining is not None and remaining < timeout
+        if bound_by_deadline:
+            timeout = max(remaining, 0)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats.queued += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            if bound_by_deadline:
+                self.stats.rejected_deadline += 1
+                raise DeadlineExceededError("request budget ran out in the wait queue") from None
+            self.stats.rejected_queue_timeout += 1
+            raise OverloadedError("wait in the queue timed out") from None
+        except asyncio.CancelledError:
+            # Слот мог быть передан этому вызову перед самой отменой, тогда его надо вернуть
+            if waiter.done() and not waiter.cancelled():
+                self.release(0.0, failed=False, adjust=False)
+            raise
+        finally:
+            self.stats.wait_seconds += time.perf_counter() - started
+            with contextlib.suppress(ValueError):
+                self._waiters.remove(waiter)
+        self.stats.admitted += 1
+
+    def release(
+        self,
+        latency: float,
+        failed: bool,
+        adjust: bool = True,
+    ):
+        self.in_flight -= 1
+        if adjust:
+            self._adjust(latency, failed)
+        # Слот передаётся ожидающему сразу, in_flight за него уже посчитан
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def _adjust(
+        self,
+        latency: float,
+        failed: bool,
+    ):
+        if failed or latency > self.latency_target:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.latency_target:
+                self._last_decrease = now
+                self.limit = max(float(self.min_limit), self.limit * self.backoff_ratio)
+                self.stats.decreases += 1
+        elif self.in_flight + 1 >= self.limit / 2:
+            # Предел растёт, только пока он действительно используется
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self.stats.increases += 1
+
+    def queue_length(
+        self,
+    ) -> int:
+        return len(self._waiters)
+
+
+@contextlib.contextmanager
+def background_priority() -> Iterator[None]:
+    """
+    Calls started inside, including the tasks created here, are rejected instead of queued when the limit is reached.
+    """
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+def admission_stats() -> dict[str, float]:
+    """Returns the state and the counters of the ElasticSearch admission controller."""
+    controller = elastic_admission
+    return {
+        "limit": controller.limit,
+        "in_flight": controller.in_flight,
+        "queue_length": controller.queue_length(),
+        "admitted": controller.stats.admitted,
+        "queued": controller.stats.queued,
+        "rejected_queue_full": controller.stats.rejected_queue_full,
+        "rejected_queue_timeout": controller.stats.rejected_queue_timeout,
+        "rejected_background": controller.stats.rejected_background,
+        "rejected_deadline": controller.stats.rejected_deadline,
+        "wait_seconds": controller.stats.wait_seconds,
+        "increases": controller.stats.increases,
+        "decreases": controller.stats.decreases,
+    }
+
+
+def is_elastic_failure(
+    error: Exception,
+) -> bool:
+    """
+    Not found and bad request answers are fast and normal, only server errors and timeouts signal overload.
+
+    A call cut by the deadline of its request is not a failure: its latency alone tells if it was slow.
+    A call rejected by the circuit breaker never reached ElasticSearch and says nothing about its load.
+    """
+    # Модуль размыкателя сам импортирует этот, поэтому импорт внутри функции
+    from core.circuit_breaker import CircuitOpenError
+
+    if isinstance(error, (DeadlineExceededError, CircuitOpenError)):
+        return False
+    return not isinstance(error, ApiError) or error.meta.status >= 500
+
+
+# Один на процесс воркера: предел относится ко всем вызовам elastic из этого воркера
+elastic_admission = AdmissionController(
+    initial_limit=settings.elastic_concurrency_initial_limit,
+    min_limit=settings.elastic_concurrency_min_limit,
+    max_limit=settings.elastic_concurrency_max_limit,
+    latency_target=settings.elastic_latency_target,
+    queue_size=settings.elastic_queue_size,
+    queue_timeout=settings.elastic_queue_timeout,
+    is_failure=is_elastic_failure,
+)
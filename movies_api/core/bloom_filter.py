@@ -0,0 +1,75 @@
+import hashlib
+
+
+def bit_positions(
+    item: str,
+    bits: int,
+    hashes: int,
+) -> list[int]:
+    """
+    Positions of the item in a Bloom filter of the given size.
+
+    Double hashing of one blake2b digest (Kirsch-Mitzenmacher). The ETL
+    computes the same positions when it writes the filter, the two must
+    never diverge.
+    """
+    digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], "big")
+    second = int.from_bytes(digest[8:], "big") | 1
+    return [(first + i * second) % bits for i in range(hashes)]
+
+
+class BloomFilter:
+    """
+    Bloom filter over a redis bitmap: bit 0 is the most significant bit of the first byte, as for SETBIT.
+
+    An item that was added is always reported as possibly present, an item
+    that was not is reported as present with the false positive rate.
+
+    Attributes:
+    - bits (int): Size of the filter in bits.
+    - hashes (int): Number of positions of every item.
+    - bits_set (int): Number of set bits, it gives the estimated false positive rate.
+    """
+
+    def __init__(
+        self,
+        bitmap: bytes,
+        bits: int,
+        hashes: int,
+    ):
+        self.bits = bits
+        self.hashes = hashes
+        # Битовая карта redis короче размера фильтра, если её старшие биты ещё не устанавливались
+        self._bitmap = bytearray(bitmap.ljust((bits + 7) // 8, b"\0"))
+        self.bits_set = int.from_bytes(self._bitmap, "big").bit_count()
+
+    def might_contain(
+        self,
+        item: str,
+    ) -> bool:
+        bitmap = self._bitmap
+        return all(
+            bitmap[position >> 3] & (0x80 >> (position & 7)) for position in bit_positions(item, self.bits, self.hashes)
+        )
+
+    def add(
+        self,
+        item: str,
+    ):
+        for position in bit_positions(item, self.bits, self.hashes):
+            mask = 0x80 >> (position & 7)
+            if not self._bitmap[position >> 3] & mask:
+                self._bitmap[position >> 3] |= mask
+                self.bits_set += 1
+
+    def estimated_false_positive_rate(
+        self,
+    ) -> float:
+        """Probability that an item never added is reported as present, given the share of set bits."""
+        return (self.bits_set / self.bits) ** self.hashes
+
+    def memory_bytes(
+        self,
+    ) -> int:
+        return len(self._bitmap)
@@ -0,0 +1,234 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable
+
+from core.admission import is_elastic_failure
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+
+class CircuitOpenError(Exception):
+    """The call was not made: the backend is considered unhealthy and is left alone to recover."""
+
+
+@dataclass
+class CircuitBreakerStats:
+    rejected: int = 0
+    transitions: dict[tuple[str, str], int] = field(default_factory=dict)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker: stops calling a backend that fails or is too slow, and probes it until it recovers.
+
+    While closed every call is made and its outcome goes to a window of the
+    last calls. A call is bad if it failed or took longer than the slow call
+    duration. When the share of bad calls in a window of at least min_calls
+    reaches the failure rate, the circuit opens: calls are rejected at once
+    with CircuitOpenError, so the backend gets no load while it recovers.
+
+    After the open duration the circuit is half-open: at most probe_calls
+    calls are let through. If all of them are good the circuit closes, one
+    bad call opens it again for another open duration.
+
+    Attributes:
+    - name (str): Name of the backend, used in logs and stats.
+    - state (str): closed, open or half_open.
+    - window_size (int): Number of the last calls the failure rate is computed over.
+    - min_calls (int): The circuit never opens on fewer calls in the window.
+    - failure_rate (float): Share of bad calls that opens the circuit.
+    - slow_call_duration (float): Calls slower than this, in seconds, are bad.
+    - open_duration (float): Seconds the circuit stays open before the probes.
+    - probe_calls (int): Calls let through, and needed to succeed, while half-open.
+    - is_failure (Callable): Tells if an exception of the call is a failure of the backend.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int,
+        min_calls: int,
+        failure_rate: float,
+        slow_call_duration: float,
+        open_duration: float,
+        probe_calls: int,
+        is_failure: Callable[[Exception], bool] = lambda error: True,
+    ):
+        self.name = name
+        self.state = CLOSED
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.open_duration = open_duration
+        self.probe_calls = probe_calls
+        self.is_failure = is_failure
+        self.stats = CircuitBreakerStats()
+        self._window: deque[bool] = deque(maxlen=window_size)
+        self._bad_calls = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probes_succeeded = 0
+
+    def check(
+        self,
+    ):
+        """Rejects the call if it would be rejected by guard, without taking a probe slot."""
+        if self.state == OPEN and not self._open_elapsed():
+            self._reject()
+        if self.state == HALF_OPEN and self._probes_in_flight >= self.probe_calls:
+            self._reject()
+
+    @contextlib.asynccontextmanager
+    async def guard(
+        self,
+    ):
+        """Lets the call through or rejects it with CircuitOpenError, the outcome of the call updates the state."""
+        probe = self._enter()
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Отменённый вызов ничего не говорит о здоровье backend
+            if probe:
+                self._probes_in_flight -= 1
+            raise
+        except Exception as error:
+            self._record(probe, self.is_failure(error) or time.perf_counter() - started > self.slow_call_duration)
+            raise
+        else:
+            self._record(probe, time.perf_counter() - started > self.slow_call_duration)
+
+    def retry_after(
+        self,
+    ) -> float:
+        """Seconds until the circuit lets probe calls through, 0 if it does not reject calls."""
+        if self.state != OPEN:
+            return 0.0
+        return max(self._opened_at + self.open_duration - time.monotonic(), 0.0)
+
+    def window_failure_rate(
+        self,
+    ) -> float:
+        if not self._window:
+            return 0.0
+        return self._bad_calls / len(self._window)
+
+    def _enter(
+        self,
+    ) -> bool:
+        if self.state == OPEN:
+            if not self._open_elapsed():
+                self._reject()
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.probe_calls:
+                self._reject()
+            self._probes_in_flight += 1
+            return True
+        return False
+
+    def _record(
+        self,
+        probe: bool,
+        bad: bool,
+    ):
+        if probe:
+            self._probes_in_flight -= 1
+            if self.state != HALF_OPEN:
+                return
+            if bad:
+                self._open()
+                return
+            self._probes_succeeded += 1
+            if self._probes_succeeded >= self.probe_calls:
+                self._transition(CLOSED)
+            return
+
+        # Вызовы, начатые до открытия, завершаются позже и на состояние уже не влияют
+        if self.state != CLOSED:
+            return
+        if len(self._window) == self._window.maxlen and self._window[0]:
+            self._bad_calls -= 1
+        self._window.append(bad)
+        self._bad_calls += bad
+        if len(self._window) >= self.min_calls and self.window_failure_rate() >= self.failure_rate:
+            self._open()
+
+    def _open(
+        self,
+    ):
+        self._opened_at = time.monotonic()
+        self._transition(OPEN)
+
+    def _open_elapsed(
+        self,
+    ) -> bool:
+        return time.monotonic() - self._opened_at >= self.open_duration
+
+    def _reject(
+        self,
+    ):
+        self.stats.rejected += 1
+        raise CircuitOpenError(f"circuit of {self.name} is {self.state}")
+
+    def _transition(
+        self,
+        state: str,
+    ):
+        previous, self.state = self.state, state
+        transition = (previous, state)
+        self.stats.transitions[transition] = self.stats.transitions.get(transition, 0) + 1
+        if state == OPEN:
+            logger.warning(
+                "Circuit of %s is open after %s, calls are rejected for %.1f s (bad calls in the window: %.0f%%)",
+                self.name,
+                previous,
+                self.open_duration,
+                self.window_failure_rate() * 100,
+            )
+        else:
+            logger.info("Circuit of %s is %s after %s", self.name, state, previous)
+        # Каждое состояние начинается с чистого счёта
+        self._window.clear()
+        self._bad_calls = 0
+        self._probes_succeeded = 0
+
+
+def circuit_breaker_stats() -> dict[str, object]:
+    """Returns the state and the counters of the ElasticSearch circuit breaker."""
+    breaker = elastic_breaker
+    return {
+        "state": breaker.state,
+        "failure_rate": breaker.window_failure_rate(),
+        "rejected": breaker.stats.rejected,
+        "transitions": dict(breaker.stats.transitions),
+    }
+
+
+def is_degraded() -> bool:
+    """Tells if ElasticSearch calls are rejected or only probed, so the answers come from the cache only."""
+    return elastic_breaker.state != CLOSED
+
+
+# Один на процесс воркера, как и предел одновременных запросов
+elastic_breaker = CircuitBreaker(
+    name="elastic",
+    window_size=settings.elastic_breaker_window_size,
+    min_calls=settings.elastic_breaker_min_calls,
+    failure_rate=settings.elastic_breaker_failure_rate,
+    slow_call_duration=settings.elastic_breaker_slow_call_duration,
+    open_duration=settings.elastic_breaker_open_duration,
+    probe_calls=settings.elastic_breaker_probe_calls,
+    is_failure=is_elastic_failure,
+)
@@ -0,0 +1,87 @@
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+@dataclass(frozen=True)
+class Codec:
+    """
+    Compression codec of cached values.
+
+    Attributes:
+    - id (int): Identifier written to the header of a cached value, must never change.
+    - name (str): Name used in settings.
+    - compress (Callable): Compresses bytes.
+    - decompress (Callable): Decompresses bytes.
+    """
+
+    id: int
+    name: str
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+IDENTITY = Codec(
+    id=0,
+    name="none",
+    compress=bytes,
+    decompress=bytes,
+)
+
+CODECS: dict[str, Codec] = {
+    IDENTITY.name: IDENTITY,
+    "zlib": Codec(
+        id=1,
+        name="zlib",
+        compress=lambda data: zlib.compress(data, 1),
+        decompress=zlib.decompress,
+    ),
+}
+
+if lz4_frame is not None:
+    CODECS["lz4"] = Codec(
+        id=2,
+        name="lz4",
+        compress=lz4_frame.compress,
+        decompress=lz4_frame.decompress,
+    )
+
+if zstandard is not None:
+    _zstd_compressor = zstandard.ZstdCompressor(level=3)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+    CODECS["zstd"] = Codec(
+        id=3,
+        name="zstd",
+        compress=_zstd_compressor.compress,
+        decompress=_zstd_decompressor.decompress,
+    )
+
+CODECS_BY_ID: dict[int, Codec] = {codec.id: codec for codec in CODECS.values()}
+
+# Порядок предпочтения, если настроенный кодек недоступен
+PREFERRED_CODECS = ("zstd", "lz4", "zlib")
+
+
+def get_codec(
+    name: str,
+) -> Codec:
+    """Returns the codec by name, or the best available one if the library of the codec is not installed."""
+    if name in CODECS:
+        return CODECS[name]
+    return next(CODECS[preferred] for preferred in PREFERRED_CODECS if preferred in CODECS)
+
+
+def get_codec_by_id(
+    codec_id: int,
+) -> Optional[Codec]:
+    return CODECS_BY_ID.get(codec_id)
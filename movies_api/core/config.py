@@ -2,7 +2,7 @@ import os
 from logging import config as logging_config
 
 from core.logger import LOGGING
-from pydantic import Field
+from pydantic import AliasChoices, Field
 from pydantic_settings import BaseSettings
 
 logging_config.dictConfig(LOGGING)
@@ -12,13 +12,200 @@ class Settings(BaseSettings):
     project_name: str = Field("movies", env="PROJECT_NAME")
 
     cache_expire_time: int = Field(300, env="CACHE_EXPIRE_TIME_IN_SECONDS")
+    # Время жизни ключа, который читают часто: между cache_expire_time и им время растёт с популярностью ключа.
+    # Изменённые документы и их страницы всё равно вытесняет ETL, поэтому горячие значения можно держать долго
+    cache_max_expire_time: int = Field(
+        3600,
+        validation_alias=AliasChoices("cache_max_expire_time", "CACHE_MAX_EXPIRE_TIME_IN_SECONDS"),
+    )
+    # Свои границы времени жизни для пространств (например {"movie": [60, 3600]}), вместо двух настроек выше
+    cache_expire_times: dict[str, tuple[int, int]] = Field(
+        {},
+        validation_alias=AliasChoices("cache_expire_times", "CACHE_EXPIRE_TIMES_IN_SECONDS"),
+    )
+    # Сколько чтений ключа за окно в одном воркере делают его популярным: он получает верхнюю границу времени
+    # и полное cache_retention_time; сколько ключей воркер считает за окно
+    cache_popular_reads: int = Field(50, env="CACHE_POPULAR_READS")
+    cache_popularity_window: float = Field(
+        300.0,
+        validation_alias=AliasChoices("cache_popularity_window", "CACHE_POPULARITY_WINDOW_IN_SECONDS"),
+    )
+    cache_popularity_max_keys: int = Field(100_000, env="CACHE_POPULARITY_MAX_KEYS")
+    # Сколько секунд после cache_expire_time запись ещё отдаётся (устаревшей), пока обновляется в фоне
+    cache_stale_times: dict[str, int] = Field(
+        {
+            "movie": 60,
+            "movies": 60,
+            "person": 60,
+            "persons": 60,
+            "genre": 600,
+            "genres": 600,
+        },
+        validation_alias=AliasChoices("cache_stale_times", "CACHE_STALE_TIMES_IN_SECONDS"),
+    )
+
+    # Сколько секунд после устаревания запись ещё хранится в redis: её отдают, если загрузить свежую не успели
+    cache_retention_time: int = Field(
+        3600,
+        validation_alias=AliasChoices("cache_retention_time", "CACHE_RETENTION_TIME_IN_SECONDS"),
+    )
+    # Время хранения ключа, который не читали: между ним и cache_retention_time оно растёт с популярностью ключа
+    cache_min_retention_time: int = Field(
+        300,
+        validation_alias=AliasChoices("cache_min_retention_time", "CACHE_MIN_RETENTION_TIME_IN_SECONDS"),
+    )
+
+    # Сколько секунд одна реплика держит право пересчитать значение, пока остальные ждут его или отдают старое
+    cache_lease_time: float = Field(
+        5.0,
+        validation_alias=AliasChoices("cache_lease_time", "CACHE_LEASE_TIME_IN_SECONDS"),
+    )
+    # Сколько секунд реплика без аренды ждёт значение, прежде чем загрузить его сама, и как часто проверяет аренду
+    cache_lease_wait: float = Field(
+        1.0,
+        validation_alias=AliasChoices("cache_lease_wait", "CACHE_LEASE_WAIT_IN_SECONDS"),
+    )
+    cache_lease_poll_interval: float = Field(
+        0.05,
+        validation_alias=AliasChoices("cache_lease_poll_interval", "CACHE_LEASE_POLL_INTERVAL_IN_SECONDS"),
+    )
+    # Насколько рано обновлять горячие значения до устаревания (XFetch), 0 отключает досрочное обновление
+    cache_early_refresh_beta: float = Field(1.0, env="CACHE_EARLY_REFRESH_BETA")
+
+    # Сколько секунд помнить, что документа с таким id нет (negative caching)
+    cache_missing_time: int = Field(
+        30,
+        validation_alias=AliasChoices("cache_missing_time", "CACHE_MISSING_TIME_IN_SECONDS"),
+    )
+    # Как часто перечитывать из redis фильтры Блума известных id, которые пишет ETL
+    known_ids_reload_interval: float = Field(
+        60.0,
+        validation_alias=AliasChoices("known_ids_reload_interval", "KNOWN_IDS_RELOAD_INTERVAL_IN_SECONDS"),
+    )
+
+    # Значения кэша больше порога сжимаются: zstd, lz4, zlib или auto (лучший из установленных)
+    cache_compression_codec: str = Field("auto", env="CACHE_COMPRESSION_CODEC")
+    cache_compression_threshold: int = Field(
+        2048,
+        validation_alias=AliasChoices("cache_compression_threshold", "CACHE_COMPRESSION_THRESHOLD_IN_BYTES"),
+    )
+
+    # Канал redis, в который ETL публикует id перезагруженных документов
+    cache_invalidation_channel: str = Field("cache_invalidation", env="CACHE_INVALIDATION_CHANNEL")
+
+    # Локальный (L1) кэш воркера перед redis
+    local_cache_max_entries: int = Field(10_000, env="LOCAL_CACHE_MAX_ENTRIES")
+    local_cache_max_bytes: int = Field(64 * 1024 * 1024, env="LOCAL_CACHE_MAX_BYTES")
+    local_cache_expire_time: int = Field(
+        30,
+        validation_alias=AliasChoices("local_cache_expire_time", "LOCAL_CACHE_EXPIRE_TIME_IN_SECONDS"),
+    )
 
     redis_host: str = Field("127.0.0.1", env="REDIS_PORT")
     redis_port: int = Field(6379, env="PROJECT_NAME")
+    # Пул соединений redis: при нехватке соединений запрос ждёт освободившееся не дольше redis_pool_timeout
+    redis_max_connections: int = Field(64, env="REDIS_MAX_CONNECTIONS")
+    redis_pool_timeout: float = Field(
+        1.0,
+        validation_alias=AliasChoices("redis_pool_timeout", "REDIS_POOL_TIMEOUT_IN_SECONDS"),
+    )
+    redis_socket_timeout: float = Field(
+        1.0,
+        validation_alias=AliasChoices("redis_socket_timeout", "REDIS_SOCKET_TIMEOUT_IN_SECONDS"),
+    )
+    redis_socket_connect_timeout: float = Field(
+        1.0,
+        validation_alias=AliasChoices("redis_socket_connect_timeout", "REDIS_SOCKET_CONNECT_TIMEOUT_IN_SECONDS"),
+    )
+    redis_socket_keepalive: bool = Field(True, env="REDIS_SOCKET_KEEPALIVE")
+    redis_health_check_interval: int = Field(
+        30,
+        validation_alias=AliasChoices("redis_health_check_interval", "REDIS_HEALTH_CHECK_INTERVAL_IN_SECONDS"),
+    )
 
     elastic_host: str = Field("127.0.0.1", env="ELASTIC_HOST")
     elastic_port: int = Field(9200, env="ELASTIC_PORT")
     elastic_schema: str = Field("http", env="ELASTIC_SCHEME")
+    elastic_connections_per_node: int = Field(32, env="ELASTIC_CONNECTIONS_PER_NODE")
+    elastic_request_timeout: float = Field(
+        10.0,
+        validation_alias=AliasChoices("elastic_request_timeout", "ELASTIC_REQUEST_TIMEOUT_IN_SECONDS"),
+    )
+    elastic_max_retries: int = Field(2, env="ELASTIC_MAX_RETRIES")
+    # Адаптивный предел одновременных запросов в elastic (AIMD) и очередь ожидающих его запросов
+    elastic_concurrency_initial_limit: int = Field(16, env="ELASTIC_CONCURRENCY_INITIAL_LIMIT")
+    elastic_concurrency_min_limit: int = Field(2, env="ELASTIC_CONCURRENCY_MIN_LIMIT")
+    elastic_concurrency_max_limit: int = Field(32, env="ELASTIC_CONCURRENCY_MAX_LIMIT")
+    elastic_latency_target: float = Field(
+        0.5,
+        validation_alias=AliasChoices("elastic_latency_target", "ELASTIC_LATENCY_TARGET_IN_SECONDS"),
+    )
+    elastic_queue_size: int = Field(64, env="ELASTIC_QUEUE_SIZE")
+    elastic_queue_timeout: float = Field(
+        1.0,
+        validation_alias=AliasChoices("elastic_queue_timeout", "ELASTIC_QUEUE_TIMEOUT_IN_SECONDS"),
+    )
+
+    # Размыкатель цепи elastic: доля плохих (упавших или медленнее порога) вызовов среди последних, после которой
+    # вызовы отклоняются, на сколько секунд, и сколько пробных вызовов должны пройти, чтобы цепь снова замкнулась
+    elastic_breaker_window_size: int = Field(50, env="ELASTIC_BREAKER_WINDOW_SIZE")
+    elastic_breaker_min_calls: int = Field(20, env="ELASTIC_BREAKER_MIN_CALLS")
+    elastic_breaker_failure_rate: float = Field(0.5, env="ELASTIC_BREAKER_FAILURE_RATE")
+    elastic_breaker_slow_call_duration: float = Field(
+        2.0,
+        validation_alias=AliasChoices(
+            "elastic_breaker_slow_call_duration", "ELASTIC_BREAKER_SLOW_CALL_DURATION_IN_SECONDS"
+        ),
+    )
+    elastic_breaker_open_duration: float = Field(
+        10.0,
+        validation_alias=AliasChoices("elastic_breaker_open_duration", "ELASTIC_BREAKER_OPEN_DURATION_IN_SECONDS"),
+    )
+    elastic_breaker_probe_calls: int = Field(3, env="ELASTIC_BREAKER_PROBE_CALLS")
+
+    # Прогрев при старте: сколько соединений открыть заранее и прогревать ли горячие ключи кэша
+    warm_up_redis_connections: int = Field(8, env="WARM_UP_REDIS_CONNECTIONS")
+    warm_up_elastic_connections: int = Field(8, env="WARM_UP_ELASTIC_CONNECTIONS")
+    warm_up_hot_keys: bool = Field(True, env="WARM_UP_HOT_KEYS")
+    # Прогрев самыми частыми запросами при старте и после цикла ETL: сколько их повторить, сколько одновременно
+    # и сколько в секунду
+    warm_up_hot_requests: bool = Field(True, env="WARM_UP_HOT_REQUESTS")
+    warm_up_hot_requests_limit: int = Field(200, env="WARM_UP_HOT_REQUESTS_LIMIT")
+    warm_up_concurrency: int = Field(8, env="WARM_UP_CONCURRENCY")
+    warm_up_rate: float = Field(100.0, env="WARM_UP_RATE")
+    # Частые запросы в redis: сколько сигнатур хранить, за сколько секунд их счёт уменьшается вдвое
+    # и как часто воркер добавляет в redis посчитанные у себя запросы
+    hot_requests_capacity: int = Field(10_000, env="HOT_REQUESTS_CAPACITY")
+    hot_requests_half_life: int = Field(
+        6 * 3600,
+        validation_alias=AliasChoices("hot_requests_half_life", "HOT_REQUESTS_HALF_LIFE_IN_SECONDS"),
+    )
+    hot_requests_flush_interval: float = Field(
+        10.0,
+        validation_alias=AliasChoices("hot_requests_flush_interval", "HOT_REQUESTS_FLUSH_INTERVAL_IN_SECONDS"),
+    )
+
+    # Сколько похожих фильмов отдаёт /films/{film_id}/similar, ETL считает заранее не меньше
+    similar_films_count: int = Field(10, env="SIMILAR_FILMS_COUNT")
+    # Сколько документов выгрузка читает из elastic за один запрос
+    export_page_size: int = Field(1000, env="EXPORT_PAGE_SIZE")
+
+    # Бюджет времени запроса: по умолчанию, по шаблонам путей и верхняя граница бюджета из заголовка X-Request-Timeout
+    request_budget: float = Field(
+        5.0,
+        validation_alias=AliasChoices("request_budget", "REQUEST_BUDGET_IN_SECONDS"),
+    )
+    request_budgets: dict[str, float] = Field(
+        {
+            "/api/v1/films/search": 3.0,
+            "/api/v1/persons/search": 3.0,
+        },
+        validation_alias=AliasChoices("request_budgets", "REQUEST_BUDGETS_IN_SECONDS"),
+    )
+    request_budget_max: float = Field(
+        10.0,
+        validation_alias=AliasChoices("request_budget_max", "REQUEST_BUDGET_MAX_IN_SECONDS"),
+    )
 
     @property
     def elastic_url(
@@ -0,0 +1,53 @@
+import asyncio
+import contextlib
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Момент (по time.monotonic), к которому запрос должен быть обработан; None — без ограничения
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceededError(Exception):
+    """The time budget of the request ran out before the call finished."""
+
+
+def start_deadline(
+    budget: float,
+):
+    """Sets the deadline of the current request, tasks created after it inherit the deadline."""
+    _deadline.set(time.monotonic() + budget)
+
+
+@contextlib.contextmanager
+def no_deadline() -> Iterator[None]:
+    """Calls started inside, including the tasks created here, are not bound to the deadline of the request."""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left until the deadline of the current request, None if the request has no deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+async def within_deadline(
+    awaitable: Awaitable[T],
+) -> T:
+    """Awaits no longer than the remaining budget, the awaitable is cancelled when the budget runs out."""
+    remaining = remaining_budget()
+    if remaining is None:
+        return await awaitable
+    try:
+        # При исчерпанном бюджете wait_for отменяет awaitable сразу, не дожидаясь его
+        return await asyncio.wait_for(awaitable, max(remaining, 0))
+    except asyncio.TimeoutError:
+        raise DeadlineExceededError("request budget is exhausted") from None
@@ -0,0 +1,21 @@
+from contextvars import ContextVar
+from typing import Optional
+
+# Причины, по которым ответ на текущий запрос хуже обычного; None — вне запроса
+_reasons: ContextVar[Optional[set[str]]] = ContextVar("degradation_reasons", default=None)
+
+
+def track_degradation() -> set[str]:
+    """Starts collecting the reasons of degradation of the current request, tasks created after it share them."""
+    reasons: set[str] = set()
+    _reasons.set(reasons)
+    return reasons
+
+
+def mark_degraded(
+    reason: str,
+):
+    """Records that the answer to the current request is degraded, for example served from an expired cache entry."""
+    reasons = _reasons.get()
+    if reasons is not None:
+        reasons.add(reason)
@@ -0,0 +1,292 @@
+from typing import Iterator
+
+from core.admission import admission_stats
+from core.circuit_breaker import STATES, circuit_breaker_stats
+from core.single_flight import single_flight_stats
+from db.known_ids import known_ids
+from db.local_cache import local_cache
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+from services.cache import FALLBACK_REASONS, cache_stats
+
+# Границы корзин в секундах: от попаданий в локальный кэш до медленных поисков в elastic
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests being processed",
+    ["method"],
+)
+REQUESTS_CANCELLED = Counter(
+    "http_requests_cancelled",
+    "Requests cancelled because the client disconnected before the response",
+    ["route"],
+)
+REQUEST_DEADLINE_EXCEEDED = Counter(
+    "http_request_deadline_exceeded",
+    "Requests answered with 504 because their time budget ran out",
+    ["route"],
+)
+ELASTIC_LATENCY = Histogram(
+    "elastic_request_duration_seconds",
+    "Latency of ElasticSearch calls",
+    ["operation", "index"],
+    buckets=LATENCY_BUCKETS,
+)
+ELASTIC_ERRORS = Counter(
+    "elastic_request_errors",
+    "ElasticSearch calls failed with an exception",
+    ["operation", "index"],
+)
+REDIS_LATENCY = Histogram(
+    "redis_command_duration_seconds",
+    "Latency of redis commands, a pipeline is measured as a whole",
+    ["command"],
+    buckets=LATENCY_BUCKETS,
+)
+REDIS_POOL_WAIT = Histogram(
+    "redis_pool_wait_seconds",
+    "Time to get a connected connection from the redis pool",
+    buckets=LATENCY_BUCKETS,
+)
+EXPORTED_DOCUMENTS = Counter(
+    "exported_documents",
+    "Documents streamed by the NDJSON exports",
+    ["index"],
+)
+POOL_CONNECTIONS = Gauge(
+    "connection_pool_connections",
+    "Connections of the redis and ElasticSearch pools: in use, open and the configured maximum",
+    ["pool", "state"],
+)
+
+
+class CacheStatsCollector(Collector):
+    """
+    Exports the counters the caches already keep.
+
+    The counters are read only when metrics are scraped, so the hot path
+    does not pay for them twice.
+    """
+
+    def collect(
+        self,
+    ) -> Iterator[Metric]:
+        requests = CounterMetricFamily(
+            "cache_requests",
+            "Redis cache lookups by result",
+            labels=["namespace", "result"],
+        )
+        writes = CounterMetricFamily(
+            "cache_writes",
+            "Values written to the redis cache",
+            labels=["namespace"],
+        )
+        written_bytes = CounterMetricFamily(
+            "cache_written_bytes",
+            "Bytes written to the redis cache, before and after compression",
+            labels=["namespace", "stage"],
+        )
+        fallbacks = CounterMetricFamily(
+            "cache_fallbacks",
+            "Expired values served because a fresh one could not be loaded, by reason",
+            labels=["namespace", "reason"],
+        )
+        written_ttl = CounterMetricFamily(
+            "cache_written_fresh_seconds",
+            "Sum of the soft TTLs of the values written, divided by cache_writes it is their mean TTL",
+            labels=["namespace"],
+        )
+        written_byte_seconds = CounterMetricFamily(
+            "cache_written_byte_seconds",
+            "Sum of the stored size times the redis TTL of the values written, its rate estimates the redis memory used",
+            labels=["namespace"],
+        )
+        early_refreshes = CounterMetricFamily(
+            "cache_early_refreshes",
+            "Fresh values refreshed ahead of their expiry by the probabilistic early refresh",
+            labels=["namespace"],
+        )
+        leases = CounterMetricFamily(
+            "cache_leases",
+            "Redis leases taken to load a missing value, waits for the lease of another replica and waits it served",
+            labels=["namespace", "result"],
+        )
+        for namespace, stats in cache_stats().items():
+            # stale попадания входят в hits, а истёкшие записи в misses, поэтому они экспортируются отдельными сериями
+            requests.add_metric([namespace, "hit"], stats["hits"] - stats["stale_hits"])
+            requests.add_metric([namespace, "stale"], stats["stale_hits"])
+            requests.add_metric([namespace, "miss"], stats["misses"] - stats["expired_reads"])
+            requests.add_metric([namespace, "expired"], stats["expired_reads"])
+            requests.add_metric([namespace, "missing"], stats["missing_hits"])
+            for reason in FALLBACK_REASONS:
+                fallbacks.add_metric([namespace, reason], stats[f"{reason}_fallbacks"])
+            writes.add_metric([namespace], stats["writes"])
+            written_bytes.add_metric([namespace, "raw"], stats["bytes_before_compression"])
+            written_bytes.add_metric([namespace, "stored"], stats["bytes_written"])
+            written_ttl.add_metric([namespace], stats["fresh_seconds_written"])
+            written_byte_seconds.add_metric([namespace], stats["byte_seconds_written"])
+            early_refreshes.add_metric([namespace], stats["early_refreshes"])
+            leases.add_metric([namespace, "acquired"], stats["leases_acquired"])
+            leases.add_metric([namespace, "waited"], stats["lease_waits"])
+            leases.add_metric([namespace, "served_by_holder"], stats["lease_wait_hits"])
+        yield requests
+        yield writes
+        yield written_bytes
+        yield fallbacks
+        yield written_ttl
+        yield written_byte_seconds
+        yield early_refreshes
+        yield leases
+
+        local_requests = CounterMetricFamily(
+            "local_cache_requests",
+            "Local cache lookups by result",
+            labels=["namespace", "result"],
+        )
+        local_removals = CounterMetricFamily(
+            "local_cache_removals",
+            "Entries removed from the local cache by reason",
+            labels=["namespace", "reason"],
+        )
+        local_entries = GaugeMetricFamily(
+            "local_cache_entries",
+            "Entries in the local cache",
+            labels=["namespace"],
+        )
+        for namespace, stats in local_cache.stats().items():
+            local_requests.add_metric([namespace, "hit"], stats["hits"])
+            local_requests.add_metric([namespace, "miss"], stats["misses"])
+            local_removals.add_metric([namespace, "eviction"], stats["evictions"])
+            local_removals.add_metric([namespace, "expiration"], stats["expirations"])
+            local_entries.add_metric([namespace], stats["entries"])
+        yield local_requests
+        yield local_removals
+        yield local_entries
+
+        loads = CounterMetricFamily(
+            "single_flight_calls",
+            "Cache misses by whether they loaded the value or joined a concurrent load, and loads left by all callers",
+            labels=["group", "result"],
+        )
+        loads_in_flight = GaugeMetricFamily(
+            "single_flight_in_flight",
+            "Loads being executed",
+            labels=["group"],
+        )
+        for group, stats in single_flight_stats().items():
+            loads.add_metric([group, "executed"], stats["executed"])
+            loads.add_metric([group, "coalesced"], stats["coalesced"])
+            loads.add_metric([group, "abandoned"], stats["abandoned"])
+            loads_in_flight.add_metric([group], stats["in_flight"])
+        yield loads
+        yield loads_in_flight
+
+        known_ids_checks = CounterMetricFamily(
+            "known_ids_checks",
+            "Lookups of ids in the bloom filters of known ids by result, false positives are ids absent in elastic",
+            labels=["index", "result"],
+        )
+        known_ids_memory = GaugeMetricFamily(
+            "known_ids_memory_bytes",
+            "Memory taken by the bloom filter of known ids",
+            labels=["index"],
+        )
+        known_ids_false_positive_rate = GaugeMetricFamily(
+            "known_ids_estimated_false_positive_rate",
+            "False positive rate of the bloom filter of known ids estimated from the share of set bits",
+            labels=["index"],
+        )
+        for index, stats in known_ids.stats().items():
+            known_ids_checks.add_metric([index, "absent"], stats["absent"])
+            known_ids_checks.add_metric([index, "present"], stats["present"])
+            known_ids_checks.add_metric([index, "false_positive"], stats["false_positives"])
+            known_ids_memory.add_metric([index], stats["memory_bytes"])
+            known_ids_false_positive_rate.add_metric([index], stats["estimated_false_positive_rate"])
+        yield known_ids_checks
+        yield known_ids_memory
+        yield known_ids_false_positive_rate
+
+
+class AdmissionCollector(Collector):
+    """Exports the adaptive limit of ElasticSearch calls, its queue and the rejected calls."""
+
+    def collect(
+        self,
+    ) -> Iterator[Metric]:
+        stats = admission_stats()
+        yield GaugeMetricFamily("elastic_admission_limit", "Current limit of calls in flight", stats["limit"])
+        yield GaugeMetricFamily("elastic_admission_in_flight", "ElasticSearch calls in flight", stats["in_flight"])
+        yield GaugeMetricFamily("elastic_admission_queue_length", "Calls waiting for the limit", stats["queue_length"])
+        yield CounterMetricFamily("elastic_admission_admitted", "Calls admitted to ElasticSearch", stats["admitted"])
+        yield CounterMetricFamily("elastic_admission_queued", "Calls that waited in the queue", stats["queued"])
+        yield CounterMetricFamily(
+            "elastic_admission_wait_seconds",
+            "Total time calls waited in the queue",
+            stats["wait_seconds"],
+        )
+        rejected = CounterMetricFamily(
+            "elastic_admission_rejected",
+            "Calls rejected without reaching ElasticSearch by reason",
+            labels=["reason"],
+        )
+        rejected.add_metric(["queue_full"], stats["rejected_queue_full"])
+        rejected.add_metric(["queue_timeout"], stats["rejected_queue_timeout"])
+        rejected.add_metric(["background"], stats["rejected_background"])
+        rejected.add_metric(["deadline"], stats["rejected_deadline"])
+        yield rejected
+        adjustments = CounterMetricFamily(
+            "elastic_admission_limit_changes",
+            "Changes of the limit by direction",
+            labels=["direction"],
+        )
+        adjustments.add_metric(["increase"], stats["increases"])
+        adjustments.add_metric(["decrease"], stats["decreases"])
+        yield adjustments
+
+
+class CircuitBreakerCollector(Collector):
+    """Exports the state of the ElasticSearch circuit breaker, its transitions and the rejected calls."""
+
+    def collect(
+        self,
+    ) -> Iterator[Metric]:
+        stats = circuit_breaker_stats()
+        state = GaugeMetricFamily(
+            "elastic_circuit_state",
+            "State of the ElasticSearch circuit breaker, 1 for the current one",
+            labels=["state"],
+        )
+        for name in STATES:
+            state.add_metric([name], int(stats["state"] == name))
+        yield state
+        yield GaugeMetricFamily(
+            "elastic_circuit_failure_rate",
+            "Share of failed or slow calls among the last ones while the circuit is closed",
+            stats["failure_rate"],
+        )
+        yield CounterMetricFamily(
+            "elastic_circuit_rejected",
+            "Calls rejected by the open circuit without reaching ElasticSearch",
+            stats["rejected"],
+        )
+        transitions = CounterMetricFamily(
+            "elastic_circuit_transitions",
+            "Changes of the circuit state",
+            labels=["from_state", "to_state"],
+        )
+        for (previous, current), count in stats["transitions"].items():
+            transitions.add_metric([previous, current], count)
+        yield transitions
+
+
+REGISTRY.register(CacheStatsCollector())
+REGISTRY.register(AdmissionCollector())
+REGISTRY.register(CircuitBreakerCollector())
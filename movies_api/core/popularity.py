@@ -0,0 +1,75 @@
+import time
+from typing import Hashable
+
+from core.config import settings
+
+
+class AccessCounter:
+    """
+    Counts the reads of cache keys in this worker over a sliding window.
+
+    The window is approximated with two fixed windows: the count of the
+    previous one is weighted by the part of it still inside the sliding
+    window. Only the keys read in the last two windows are kept, and new
+    keys are not counted once max_keys keys are counted in the window, so
+    the memory is bounded whatever the keys are.
+
+    Attributes:
+    - window (float): Length of the window in seconds.
+    - max_keys (int): Maximum number of keys counted in one window.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        max_keys: int,
+    ):
+        self.window = window
+        self.max_keys = max_keys
+        self._started = time.monotonic()
+        self._current: dict[Hashable, int] = {}
+        self._previous: dict[Hashable, int] = {}
+
+    def record(
+        self,
+        key: Hashable,
+    ):
+        self._rotate()
+        count = self._current.get(key)
+        if count is not None:
+            self._current[key] = count + 1
+        elif len(self._current) < self.max_keys:
+            self._current[key] = 1
+
+    def estimate(
+        self,
+        key: Hashable,
+    ) -> float:
+        """Returns the number of reads of the key in the last window."""
+        self._rotate()
+        previous_weight = 1 - (time.monotonic() - self._started) / self.window
+        return self._current.get(key, 0) + self._previous.get(key, 0) * previous_weight
+
+    def clear(
+        self,
+    ):
+        self._current.clear()
+        self._previous.clear()
+
+    def _rotate(
+        self,
+    ):
+        elapsed = time.monotonic() - self._started
+        if elapsed < self.window:
+            return
+        # После простоя дольше двух окон прошлое окно тоже пустое
+        self._previous = self._current if elapsed < 2 * self.window else {}
+        self._current = {}
+        self._started += elapsed // self.window * self.window
+
+
+# Один экземпляр на процесс воркера: считает чтения из локального кэша, через который проходит каждое чтение
+access_counter = AccessCounter(
+    window=settings.cache_popularity_window,
+    max_keys=settings.cache_popularity_max_keys,
+)
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, TypeVar
+
+from core.admission import OverloadedError
+from core.circuit_breaker import CircuitOpenError
+from core.deadline import no_deadline, within_deadline
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share the same key into one execution.
+
+    The first caller (leader) starts the call as a task, every caller that
+    arrives while it is still running awaits the same task instead of
+    starting its own. The task is shielded, so a leader cancelled by a client
+    disconnect does not cancel the call for the rest of the group.
+
+    Every caller waits no longer than the deadline of its own request. When
+    the last caller is gone, cancelled or out of budget, nobody needs the
+    result any more and the call is cancelled, unless it was started in
+    background.
+
+    Attributes:
+    - name (str): Name of the group, used in stats.
+    - executed (int): Number of calls that were actually executed.
+    - coalesced (int): Number of calls that joined an already running call.
+    - abandoned (int): Number of calls cancelled because all their callers left.
+    """
+
+    def __init__(
+        self,
+        name: str,
+    ):
+        self.name = name
+        self.executed = 0
+        self.coalesced = 0
+        self.abandoned = 0
+        self._calls: dict[str, asyncio.Task] = {}
+        self._waiters: dict[asyncio.Task, int] = {}
+        self._background: set[asyncio.Task] = set()
+
+    async def do(
+        self,
+        key: str,
+        func: Callable[..., Awaitable[T]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = self._start(key, func, *args, **kwargs)
+        else:
+            self.coalesced += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await within_deadline(asyncio.shield(task))
+        finally:
+            self._leave(key, task)
+
+    def do_in_background(
+        self,
+        key: str,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        **kwargs: Any,
+    ):
+        """Starts the call without waiting for it, unless a call with the same key is already running."""
+        if key in self._calls:
+            return
+        # Фоновый вызов переживает запрос, который его запустил, поэтому бюджет запроса к нему не относится
+        with no_deadline():
+            task = self._start(key, func, *args, **kwargs)
+        self._background.add(task)
+        task.add_done_callback(lambda _: self._log_failure(key, task))
+
+    def in_flight(
+        self,
+    ) -> int:
+        return len(self._calls)
+
+    def _start(
+        self,
+        key: str,
+        func: Callable[..., Awaitable[T]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> asyncio.Task:
+        task = asyncio.ensure_future(func(*args, **kwargs))
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._forget(key, task))
+        self.executed += 1
+        return task
+
+    def _leave(
+        self,
+        key: str,
+        task: asyncio.Task,
+    ):
+        self._waiters[task] -= 1
+        if self._waiters[task]:
+            return
+        del self._waiters[task]
+        if not task.done() and task not in self._background:
+            self.abandoned += 1
+            # Отменённая задача ещё выполняет очистку (снимает аренду), новый вызов не должен к ней присоединиться
+            if self._calls.get(key) is task:
+                del self._calls[key]
+            task.cancel()
+
+    def _log_failure(
+        self,
+        key: str,
+        task: asyncio.Task,
+    ):
+        if task.cancelled() or task.exception() is None:
+            return
+        if isinstance(task.exception(), (OverloadedError, CircuitOpenError)):
+            # Под перегрузкой и при разомкнутой цепи отказы фоновым вызовам массовые и ожидаемые,
+            # трассировки только засорили бы лог
+            logger.debug("Background call %s was not admitted: %s", key, task.exception())
+            return
+        logger.warning(
+            "Background call %s failed",
+            key,
+            exc_info=task.exception(),
+        )
+
+    def _forget(
+        self,
+        key: str,
+        task: asyncio.Task,
+    ):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        self._background.discard(task)
+        # Помечаем исключение как полученное, даже если лидер был отменён и никто его не дождался
+        if not task.cancelled():
+            task.exception()
+
+
+def get_single_flight(
+    name: str,
+) -> SingleFlight:
+    group = _groups.get(name)
+    if group is None:
+        group = _groups[name] = SingleFlight(name)
+    return group
+
+
+def single_flight_stats() -> dict[str, dict[str, int]]:
+    """Returns counters of every single-flight group created in this process."""
+    return {
+        name: {
+            "executed": group.executed,
+            "coalesced": group.coalesced,
+            "abandoned": group.abandoned,
+            "in_flight": group.in_flight(),
+        }
+        for name, group in _groups.items()
+    }
+
+
+_groups: dict[str, SingleFlight] = {}
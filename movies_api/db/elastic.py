@@ -1,10 +1,149 @@
-from typing import Optional
+import asyncio
+import time
+from typing import Any, Optional
 
-from elasticsearch import AsyncElasticsearch
+from core.admission import AdmissionController
+from core.circuit_breaker import CircuitBreaker
+from core.deadline import DeadlineExceededError, remaining_budget
+from core.metrics import ELASTIC_ERRORS, ELASTIC_LATENCY, POOL_CONNECTIONS
+from elasticsearch import AsyncElasticsearch, ConnectionTimeout
 
 es: AsyncElasticsearch | None = None
 
 
+class MeasuredElasticsearch:
+    """
+    Thin proxy over the client that measures the latency of every call by operation and index.
+
+    Searches in a point in time have no index, they are reported with an empty one.
+    Every call in flight holds a connection of the pool, so the calls in
+    flight are reported as the connections in use.
+
+    With an admission controller every call first takes a slot of its
+    adaptive limit and fails fast with OverloadedError when there is none.
+    The time spent waiting for the slot is not part of the measured latency.
+
+    With a circuit breaker a call is rejected with CircuitOpenError before
+    it waits for a slot while the circuit is open, and the outcome of every
+    call made goes to the breaker.
+
+    A call made for a request with a deadline gets what is left of the
+    budget as its timeout and is not retried after it: a timeout at the
+    deadline and a call started after it raise DeadlineExceededError.
+    Searches get the budget as their server side timeout as well, so the
+    cluster stops a search the client has given up on. A search stopped by
+    it returns partial hits, they are never used: it raises
+    DeadlineExceededError too.
+    """
+
+    def __init__(
+        self,
+        client: AsyncElasticsearch,
+        admission: Optional[AdmissionController] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self._client = client
+        self._admission = admission
+        self._breaker = breaker
+
+    def options(
+        self,
+        **kwargs: Any,
+    ) -> "MeasuredElasticsearch":
+        return MeasuredElasticsearch(self._client.options(**kwargs), self._admission, self._breaker)
+
+    def __getattr__(
+        self,
+        name: str,
+    ) -> Any:
+        attribute = getattr(self._client, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        async def measured(*args: Any, **kwargs: Any) -> Any:
+            if self._breaker is not None:
+                # Отклонённый размыкателем вызов не должен занимать место в очереди за слотом
+                self._breaker.check()
+            if self._admission is None:
+                return await guarded(*args, **kwargs)
+            async with self._admission.slot():
+                return await guarded(*args, **kwargs)
+
+        async def guarded(*args: Any, **kwargs: Any) -> Any:
+            if self._breaker is None:
+                return await call(*args, **kwargs)
+            async with self._breaker.guard():
+                return await call(*args, **kwargs)
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            # Бюджет читается после ожидания слота: ожидание тоже его расходует
+            remaining = remaining_budget()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceededError("request budget is exhausted")
+            method = attribute
+            if remaining is not None:
+                method = getattr(self._client.options(request_timeout=remaining, retry_on_timeout=False), name)
+                kwargs = with_search_timeout(name, kwargs, remaining)
+
+            index = kwargs.get("index") or ""
+            in_use = POOL_CONNECTIONS.labels("elastic", "in_use")
+            in_use.inc()
+            started = time.perf_counter()
+            try:
+                response = await method(*args, **kwargs)
+                if remaining is not None and search_timed_out(name, response):
+                    raise DeadlineExceededError("request budget ran out while ElasticSearch was searching")
+                return response
+            except ConnectionTimeout as error:
+                ELASTIC_ERRORS.labels(name, index).inc()
+                if remaining is None:
+                    raise
+                raise DeadlineExceededError("request budget ran out waiting for ElasticSearch") from error
+            except Exception:
+                ELASTIC_ERRORS.labels(name, index).inc()
+                raise
+            finally:
+                in_use.dec()
+                ELASTIC_LATENCY.labels(name, index).observe(time.perf_counter() - started)
+
+        # Обёртка сохраняется в экземпляре, следующие вызовы не проходят через __getattr__
+        setattr(self, name, measured)
+        return measured
+
+
+def with_search_timeout(
+    name: str,
+    kwargs: dict[str, Any],
+    remaining: float,
+) -> dict[str, Any]:
+    """Returns the arguments of the call with the remaining budget as the timeout of every search it makes."""
+    timeout = f"{max(int(remaining * 1000), 1)}ms"
+    if name == "search":
+        if "timeout" in kwargs or "timeout" in (kwargs.get("body") or {}):
+            return kwargs
+        return {**kwargs, "timeout": timeout}
+    if name == "msearch" and kwargs.get("searches"):
+        # Заголовки и тела поисков чередуются, таймаут задаётся в теле
+        searches = [
+            {"timeout": timeout, **search} if position % 2 else search
+            for position, search in enumerate(kwargs["searches"])
+        ]
+        return {**kwargs, "searches": searches}
+    return kwargs
+
+
+def search_timed_out(
+    name: str,
+    response: Any,
+) -> bool:
+    """Tells if ElasticSearch stopped a search of the call at its timeout and returned only partial hits."""
+    if name == "search":
+        return bool(response["timed_out"]) if "timed_out" in response else False
+    if name == "msearch":
+        return any(search.get("timed_out") for search in response["responses"])
+    return False
+
+
 # Функция понадобится при внедрении зависимостей
 async def get_elastic() -> AsyncElasticsearch:
     return es
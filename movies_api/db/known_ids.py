@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from core.bloom_filter import BloomFilter
+from core.config import settings
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Индексы, фильтры которых пишет ETL
+INDICES = ("movies", "persons", "genres")
+
+
+@dataclass
+class KnownIdsStats:
+    absent: int = 0
+    present: int = 0
+    false_positives: int = 0
+
+
+class KnownIds:
+    """
+    Bloom filters of the ids of every index, written by the ETL to redis and kept in the memory of the worker.
+
+    An id the filter of its index does not contain was never loaded, so it
+    is answered with 404 without asking redis or ElasticSearch. Without a
+    filter, before the first load or when redis has none, every id may exist.
+
+    The ETL adds the ids to the filter in redis and changes its version
+    before it loads the documents, so an id is never in ElasticSearch
+    without being in the filter in redis. The copy in memory is reloaded
+    when the version changes, and the ids of the cache invalidation
+    messages are added to it in between, but both come after the load. So
+    an id the copy does not contain is checked once more against the
+    version in redis: the filter is reloaded if it changed, and only an id
+    the current filter does not contain is answered with 404.
+    """
+
+    def __init__(
+        self,
+    ):
+        self._redis: Optional[Redis] = None
+        self._filters: dict[str, BloomFilter] = {}
+        self._versions: dict[str, bytes] = {}
+        self._stats: dict[str, KnownIdsStats] = {index: KnownIdsStats() for index in INDICES}
+
+    async def might_exist(
+        self,
+        index: str,
+        doc_id: str,
+    ) -> bool:
+        bloom = self._filters.get(index)
+        if bloom is not None and not bloom.might_contain(doc_id):
+            try:
+                await self.load(self._redis, index)
+            except RedisError:
+                # Без redis версию не проверить: ответ даёт фильтр, который уже есть
+                logger.warning("Failed to check the version of the bloom filter of %s", index)
+            bloom = self._filters.get(index)
+            if bloom is not None and not bloom.might_contain(doc_id):
+                self._stats[index].absent += 1
+                return False
+        if bloom is not None:
+            self._stats[index].present += 1
+        return True
+
+    def record_not_found(
+        self,
+        index: str,
+        count: int = 1,
+    ):
+        """Counts ids the filter let through, but ElasticSearch does not have: the false positives."""
+        if index in self._filters:
+            self._stats[index].false_positives += count
+
+    def add(
+        self,
+        index: str,
+        ids: Iterable[str],
+    ):
+        bloom = self._filters.get(index)
+        if bloom is None:
+            return
+        for doc_id in ids:
+            bloom.add(doc_id)
+
+    async def load(
+        self,
+        redis: Redis,
+        index: str,
+    ):
+        self._redis = redis
+        version = await redis.hget(meta_key(index), "version")
+        if version is None:
+            # Фильтра в redis нет: без него любой id может существовать
+            self._filters.pop(index, None)
+            self._versions.pop(index, None)
+            return
+        if version == self._versions.get(index):
+            return
+
+        # Транзакция: ETL меняет карту и её описание тоже одной транзакцией
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(meta_key(index))
+            pipe.get(filter_key(index))
+            meta, bitmap = await pipe.execute()
+        if not meta or bitmap is None:
+            return
+        self._filters[index] = BloomFilter(bitmap, int(meta[b"bits"]), int(meta[b"hashes"]))
+        self._versions[index] = meta[b"version"]
+
+    async def refresh_periodically(
+        self,
+        redis: Redis,
+        interval: float = settings.known_ids_reload_interval,
+    ):
+        """Reloads the changed filters until cancelled."""
+        while True:
+            try:
+                for index in INDICES:
+                    await self.load(redis, index)
+            except RedisError:
+                logger.exception("Failed to reload the bloom filters of known ids")
+            await asyncio.sleep(interval)
+
+    def stats(
+        self,
+    ) -> dict[str, dict[str, float]]:
+        """Returns the counters and the size of the filter of every index that has one."""
+        stats = {}
+        for index, bloom in self._filters.items():
+            index_stats = self._stats[index]
+            stats[index] = {
+                "absent": index_stats.absent,
+                "present": index_stats.present,
+                "false_positives": index_stats.false_positives,
+                "memory_bytes": bloom.memory_bytes(),
+                "estimated_false_positive_rate": bloom.estimated_false_positive_rate(),
+            }
+        return stats
+
+
+def filter_key(
+    index: str,
+) -> str:
+    return f"known_ids_{index}"
+
+
+def meta_key(
+    index: str,
+) -> str:
+    return f"known_ids_{index}_meta"
+
+
+known_ids = KnownIds()
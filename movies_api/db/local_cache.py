@@ -0,0 +1,167 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional
+
+from core.config import settings
+from core.popularity import AccessCounter, access_counter
+
+
+@dataclass
+class LocalCacheEntry:
+    value: Any
+    size: int
+    expires_at: float
+
+
+@dataclass
+class LocalCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache with TTL eviction.
+
+    Sits in front of redis and keeps serialized json, so a hit skips the
+    network round trip and is written to the response as is. The cache is
+    bounded both by the number of entries and by the total size of the
+    cached payloads; the size of an entry is the length of its serialized form.
+
+    Every read, hit or miss, is counted by the access counter, so the redis
+    cache can keep popular values longer (see ServiceCache).
+
+    Attributes:
+    - max_entries (int): Maximum number of entries kept in the cache.
+    - max_bytes (int): Maximum total size of the cached payloads.
+    - ttl (float): Default time to live of an entry in seconds.
+    - access_counter (AccessCounter, optional): Counter of the reads of the keys.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        ttl: float,
+        access_counter: Optional[AccessCounter] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.access_counter = access_counter
+        self.size = 0
+        self._entries: OrderedDict[tuple[str, Hashable], LocalCacheEntry] = OrderedDict()
+        self._stats: dict[str, LocalCacheStats] = {}
+
+    def get(
+        self,
+        namespace: str,
+        key: Hashable,
+    ) -> Optional[Any]:
+        stats = self._namespace_stats(namespace)
+        if self.access_counter is not None:
+            self.access_counter.record(key)
+        entry = self._entries.get((namespace, key))
+        if entry is None:
+            stats.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove((namespace, key))
+            stats.expirations += 1
+            stats.misses += 1
+            return None
+        self._entries.move_to_end((namespace, key))
+        stats.hits += 1
+        return entry.value
+
+    def set(
+        self,
+        namespace: str,
+        key: Hashable,
+        value: Any,
+        size: int,
+        ttl: Optional[float] = None,
+    ):
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        self._remove((namespace, key))
+        self._entries[(namespace, key)] = LocalCacheEntry(
+            value=value,
+            size=size,
+            expires_at=time.monotonic() + (self.ttl if ttl is None else ttl),
+        )
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            (evicted_namespace, _), _ = self._pop_oldest()
+            self._namespace_stats(evicted_namespace).evictions += 1
+
+    def delete(
+        self,
+        namespace: str,
+        key: Hashable,
+    ):
+        self._remove((namespace, key))
+
+    def clear(
+        self,
+    ):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(
+        self,
+    ) -> dict[str, dict[str, int]]:
+        entries: dict[str, int] = {}
+        for namespace, _ in self._entries:
+            entries[namespace] = entries.get(namespace, 0) + 1
+        return {
+            namespace: {
+                "hits": stats.hits,
+                "misses": stats.misses,
+                "evictions": stats.evictions,
+                "expirations": stats.expirations,
+                "entries": entries.get(namespace, 0),
+            }
+            for namespace, stats in self._stats.items()
+        }
+
+    def _namespace_stats(
+        self,
+        namespace: str,
+    ) -> LocalCacheStats:
+        stats = self._stats.get(namespace)
+        if stats is None:
+            stats = self._stats[namespace] = LocalCacheStats()
+        return stats
+
+    def _remove(
+        self,
+        full_key: tuple[str, Hashable],
+    ):
+        entry = self._entries.pop(full_key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def _pop_oldest(
+        self,
+    ) -> tuple[tuple[str, Hashable], LocalCacheEntry]:
+        full_key, entry = self._entries.popitem(last=False)
+        self.size -= entry.size
+        return full_key, entry
+
+
+# Один экземпляр на процесс воркера uvicorn
+local_cache = LocalCache(
+    max_entries=settings.local_cache_max_entries,
+    max_bytes=settings.local_cache_max_bytes,
+    ttl=settings.local_cache_expire_time,
+    access_counter=access_counter,
+)
+
+
+# Функция понадобится при внедрении зависимостей
+async def get_local_cache() -> LocalCache:
+    return local_cache
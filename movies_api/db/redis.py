@@ -1,8 +1,106 @@
-from redis.asyncio import Redis
+import time
+from typing import Any
+
+from core.metrics import POOL_CONNECTIONS, REDIS_LATENCY, REDIS_POOL_WAIT
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.client import Pipeline
+from redis.asyncio.connection import Connection
 
 redis: Redis | None = None
 
 
+class MeasuredConnectionPool(BlockingConnectionPool):
+    """
+    Pool that waits for a released connection instead of failing when all of them are in use.
+
+    Reports the open connections, the connections in use and the time it
+    takes to get a connection, so the pool size can be tuned.
+    """
+
+    def __init__(
+        self,
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        POOL_CONNECTIONS.labels("redis", "max").set(self.max_connections)
+
+    def reset(
+        self,
+    ):
+        super().reset()
+        self._in_use: set[Connection] = set()
+        POOL_CONNECTIONS.labels("redis", "open").set(0)
+        POOL_CONNECTIONS.labels("redis", "in_use").set(0)
+
+    def make_connection(
+        self,
+    ) -> Connection:
+        connection = super().make_connection()
+        POOL_CONNECTIONS.labels("redis", "open").set(len(self._connections))
+        return connection
+
+    async def get_connection(
+        self,
+        command_name: str,
+        *keys: Any,
+        **options: Any,
+    ) -> Connection:
+        started = time.perf_counter()
+        connection = await super().get_connection(command_name, *keys, **options)
+        REDIS_POOL_WAIT.observe(time.perf_counter() - started)
+        self._in_use.add(connection)
+        POOL_CONNECTIONS.labels("redis", "in_use").set(len(self._in_use))
+        return connection
+
+    async def release(
+        self,
+        connection: Connection,
+    ):
+        # Пул сам возвращает соединение, которое не удалось подключить, поэтому его может не быть в _in_use
+        self._in_use.discard(connection)
+        POOL_CONNECTIONS.labels("redis", "in_use").set(len(self._in_use))
+        await super().release(connection)
+
+
+class MeasuredPipeline(Pipeline):
+    async def execute(
+        self,
+        raise_on_error: bool = True,
+    ) -> list[Any]:
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            REDIS_LATENCY.labels("PIPELINE").observe(time.perf_counter() - started)
+
+
+class MeasuredRedis(Redis):
+    """Redis client that measures the latency of every command, a pipeline is measured as one command."""
+
+    async def execute_command(
+        self,
+        *args: Any,
+        **options: Any,
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_LATENCY.labels(args[0]).observe(time.perf_counter() - started)
+
+    def pipeline(
+        self,
+        transaction: bool = True,
+        shard_hint: str | None = None,
+    ) -> MeasuredPipeline:
+        return MeasuredPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint,
+        )
+
+
 # Функция понадобится при внедрении зависимостей
 async def get_redis() -> Redis:
     return redis
@@ -1,10 +1,39 @@
+import asyncio
+import contextlib
+import math
+import time
+from http import HTTPStatus
+
+from api import health, metrics
+from api.deadline import CancelOnDisconnectMiddleware, request_deadline
+from api.degradation import DegradedResponseMiddleware
 from api.v1 import films, genres, persons
+from core.admission import OverloadedError, elastic_admission
+from core.circuit_breaker import CircuitOpenError, elastic_breaker
 from core.config import settings
+from core.deadline import DeadlineExceededError
+from core.metrics import (
+    POOL_CONNECTIONS,
+    REQUEST_DEADLINE_EXCEEDED,
+    REQUEST_LATENCY,
+    REQUESTS_IN_PROGRESS,
+)
 from db import elastic, redis
+from db.known_ids import known_ids
+from db.local_cache import local_cache
 from elasticsearch import AsyncElasticsearch
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request, Response
 from fastapi.responses import ORJSONResponse
-from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from services.cache_warmer import CacheWarmer, hot_requests
+from services.invalidation import CacheInvalidator
+from services.warm_up import warm_up
+from starlette.middleware.base import RequestResponseEndpoint
+
+# Через сколько секунд повторить запрос, отклонённый из-за перегрузки elastic
+RETRY_AFTER_SECONDS = 1
+# Статус запроса, клиент которого отключился до ответа (как в логах nginx)
+CLIENT_CLOSED_REQUEST = 499
 
 app = FastAPI(
     title=f"Read-only API for {settings.project_name}",
@@ -18,29 +47,153 @@ app = FastAPI(
 
 @app.on_event("startup")
 async def startup():
-    redis.redis = Redis(
-        host=settings.redis_host,
-        port=settings.redis_port,
+    redis.redis = redis.MeasuredRedis(
+        connection_pool=redis.MeasuredConnectionPool(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            max_connections=settings.redis_max_connections,
+            timeout=settings.redis_pool_timeout,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_socket_connect_timeout,
+            socket_keepalive=settings.redis_socket_keepalive,
+            health_check_interval=settings.redis_health_check_interval,
+        ),
+    )
+    elastic.es = elastic.MeasuredElasticsearch(
+        AsyncElasticsearch(
+            hosts=[settings.elastic_url],
+            connections_per_node=settings.elastic_connections_per_node,
+            request_timeout=settings.elastic_request_timeout,
+            max_retries=settings.elastic_max_retries,
+            retry_on_timeout=True,
+        ),
+        admission=elastic_admission,
+        breaker=elastic_breaker,
+    )
+    POOL_CONNECTIONS.labels("elastic", "max").set(settings.elastic_connections_per_node)
+    app.state.cache_warmer = CacheWarmer(redis.redis, elastic.es, local_cache)
+    app.state.cache_invalidator = CacheInvalidator(
+        redis.redis,
+        local_cache,
+        known_ids,
+        on_etl_cycle=app.state.cache_warmer.trigger if settings.warm_up_hot_requests else None,
     )
-    elastic.es = AsyncElasticsearch(hosts=[settings.elastic_url])
+    app.state.cache_invalidation_task = asyncio.create_task(app.state.cache_invalidator.listen())
+    app.state.known_ids_task = asyncio.create_task(known_ids.refresh_periodically(redis.redis))
+    app.state.hot_requests_task = asyncio.create_task(hot_requests.flush_periodically(redis.redis))
+    # Прогрев идёт в фоне: пока он не закончен, /health/ready отвечает 503
+    app.state.warm_up_task = asyncio.create_task(warm_up(redis.redis, elastic.es, local_cache))
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await redis.redis.close()
+    tasks = (
+        app.state.warm_up_task,
+        app.state.cache_invalidation_task,
+        app.state.known_ids_task,
+        app.state.hot_requests_task,
+    )
+    for task in tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    # Запросы, посчитанные после последней записи в redis, иначе пропали бы вместе с воркером
+    with contextlib.suppress(RedisError):
+        await hot_requests.flush(redis.redis)
+    await redis.redis.close(close_connection_pool=True)
     await elastic.es.close()
 
 
+@app.exception_handler(OverloadedError)
+async def overloaded(
+    request: Request,
+    error: OverloadedError,
+) -> Response:
+    # Попадания в кэш до elastic не доходят, отказ получают только промахи
+    return ORJSONResponse(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        content={"detail": "service is overloaded, retry later"},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open(
+    request: Request,
+    error: CircuitOpenError,
+) -> Response:
+    # Ответы из кэша elastic не нужен, сюда доходят только промахи без истёкшей записи
+    return ORJSONResponse(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        content={"detail": "search is temporarily unavailable, only cached answers are served"},
+        headers={"Retry-After": str(max(math.ceil(elastic_breaker.retry_after()), RETRY_AFTER_SECONDS))},
+    )
+
+
+@app.exception_handler(DeadlineExceededError)
+async def deadline_exceeded(
+    request: Request,
+    error: DeadlineExceededError,
+) -> Response:
+    # Сюда доходят только промахи без истёкшей записи в кэше: с ней сервис отдал бы её
+    route = request.scope.get("route")
+    REQUEST_DEADLINE_EXCEEDED.labels(route.path if route else "unmatched").inc()
+    return ORJSONResponse(
+        status_code=HTTPStatus.GATEWAY_TIMEOUT,
+        content={"detail": "request time budget is exhausted"},
+    )
+
+
+@app.middleware("http")
+async def measure_request(
+    request: Request,
+    call_next: RequestResponseEndpoint,
+) -> Response:
+    in_progress = REQUESTS_IN_PROGRESS.labels(request.method)
+    in_progress.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    except asyncio.CancelledError:
+        status = CLIENT_CLOSED_REQUEST
+        raise
+    finally:
+        in_progress.dec()
+        # Шаблон пути, а не сам путь: иначе каждый id станет отдельной серией
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(
+            request.method,
+            route.path if route else "unmatched",
+            status,
+        ).observe(time.perf_counter() - started)
+        if route and status in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED):
+            # Успешные запросы считаются в воркере, прогрев потом повторит самые частые из них
+            hot_requests.record(route.path, request.path_params, request.query_params)
+
+
+# Отключение клиента отменяет обработку его запроса, поэтому middleware снаружи всех остальных,
+# кроме пометки деградированных ответов: набор её причин должен появиться до запуска обработчика
+app.add_middleware(CancelOnDisconnectMiddleware)
+app.add_middleware(DegradedResponseMiddleware)
+
 # Подключаем роутер к серверу, указав префикс /v1/films
 app.include_router(
     films.router,
     prefix="/api/v1/films",
+    dependencies=[Depends(request_deadline)],
 )
 app.include_router(
     genres.router,
     prefix="/api/v1/genres",
+    dependencies=[Depends(request_deadline)],
 )
 app.include_router(
     persons.router,
     prefix="/api/v1/persons",
+    dependencies=[Depends(request_deadline)],
 )
+app.include_router(metrics.router)
+app.include_router(health.router)
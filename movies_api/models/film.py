@@ -1,9 +1,20 @@
-import orjson
 from pydantic import BaseModel
 
 from .genre import MovieGenre
 from .person import MoviePerson, MoviePersonName
 
+# Поле ответа -> поля документа elastic, из которых оно собирается
+FILM_SOURCE_FIELDS = {
+    "id": ["id"],
+    "title": ["title"],
+    "description": ["description"],
+    "imdb_rating": ["imdb_rating"],
+    "actors": ["actors"],
+    "writers": ["writers"],
+    "directors": ["director"],
+    "genres": ["genre"],
+}
+
 
 class Film(BaseModel):
     """
@@ -33,64 +44,35 @@ class Film(BaseModel):
     def parse_from_elastic(
         document,
     ):
-        return Film(
-            id=document["_source"]["id"],
-            title=document["_source"]["title"],
-            description=document["_source"]["description"],
-            imdb_rating=document["_source"]["imdb_rating"],
-            actors=[
-                MoviePerson(
-                    id=person["id"],
-                    full_name=person["name"],
-                )
-                for person in document["_source"]["actors"]
-            ],
-            writers=[
-                MoviePerson(
-                    id=person["id"],
-                    full_name=person["name"],
-                )
-                for person in document["_source"]["writers"]
-            ],
-            directors=[
-                MoviePersonName(full_name=director_name)
-                for director_name in document["_source"]["director"]
-                if director_name is not None
-            ],
-            genres=[MovieGenre(name=genre_name) for genre_name in document["_source"]["genre"]],
-        )
+        return Film.model_validate(film_from_source(document["_source"]))
 
-    @staticmethod
-    def parse_from_redis(
-        film_str: str,
-    ):
-        film = orjson.loads(film_str)
 
-        return Film(
-            id=film["id"],
-            title=film["title"],
-            description=film["description"],
-            imdb_rating=film["imdb_rating"],
-            actors=[
-                MoviePerson(
-                    id=person["id"],
-                    full_name=person["full_name"],
-                )
-                for person in film["actors"]
-                if person is not None
-            ],
-            writers=[
-                MoviePerson(
-                    id=person["id"],
-                    full_name=person["full_name"],
-                )
-                for person in film["writers"]
-                if person is not None
-            ],
-            directors=[
-                MoviePersonName(full_name=director["full_name"])
-                for director in film["directors"]
-                if director is not None
-            ],
-            genres=[MovieGenre(name=genre["name"]) for genre in film["genres"] if genre is not None],
-        )
+def film_from_source(
+    source: dict,
+) -> dict:
+    """
+    Converts `_source` of a film document to the json of the film without building the models.
+
+    The documents are written by our own ETL, so they are trusted and only
+    reshaped, not validated. Only the fields present in the source are
+    converted, so a source read with _source_includes gives a partial film.
+    The keys follow the order of the fields of Film, so the json is the same
+    as the one the model would dump.
+    """
+    film = {}
+    for field in ("id", "title", "description"):
+        if field in source:
+            film[field] = source[field]
+    if "imdb_rating" in source:
+        rating = source["imdb_rating"]
+        film["imdb_rating"] = float(rating) if rating is not None else None
+    for field in ("actors", "writers"):
+        if field in source:
+            film[field] = [{"id": person["id"], "full_name": person["name"]} for person in source[field]]
+    if "director" in source:
+        film["directors"] = [
+            {"full_name": director_name} for director_name in source["director"] if director_name is not None
+        ]
+    if "genre" in source:
+        film["genres"] = [{"name": genre_name} for genre_name in source["genre"]]
+    return film
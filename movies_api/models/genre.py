@@ -25,3 +25,10 @@ class Genre(BaseModel):
     id: str
     name: str
     description: str | None
+
+
+def genre_from_source(
+    source: dict,
+) -> dict:
+    """Converts `_source` of a trusted genre document to the json of the genre, see film_from_source."""
+    return {field: source[field] for field in ("id", "name", "description") if field in source}
@@ -1,5 +1,12 @@
 from pydantic import BaseModel
 
+# Поле ответа -> поля документа elastic, из которых оно собирается
+PERSON_SOURCE_FIELDS = {
+    "id": ["id"],
+    "full_name": ["full_name"],
+    "films": ["films"],
+}
+
 
 class PersonFilms(BaseModel):
     """
@@ -50,3 +57,13 @@ class Person(BaseModel):
     id: str
     full_name: str
     films: list["PersonFilms"] | None
+
+
+def person_from_source(
+    source: dict,
+) -> dict:
+    """Converts `_source` of a trusted person document to the json of the person, see film_from_source."""
+    person = {field: source[field] for field in ("id", "full_name") if field in source}
+    if "films" in source:
+        person["films"] = [{"id": film["id"], "roles": film.get("roles", [])} for film in source["films"]]
+    return person
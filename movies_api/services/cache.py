@@ -0,0 +1,709 @@
+import asyncio
+import contextlib
+import hashlib
+import math
+import random
+import secrets
+import struct
+import time
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, Optional, TypeVar
+
+import orjson
+from core.admission import OverloadedError
+from core.circuit_breaker import CircuitOpenError
+from core.codecs import IDENTITY, get_codec, get_codec_by_id
+from core.config import settings
+from core.deadline import DeadlineExceededError, remaining_budget
+from core.degradation import mark_degraded
+from core.popularity import access_counter
+from elasticsearch import ApiError, TransportError
+from pydantic import BaseModel
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import WatchError
+from services.cache_key import build_cache_key
+
+# Заголовок записи: версия формата, кодек сжатия, время, до которого значение считается свежим,
+# время, за которое значение было вычислено, и хэш содержимого.
+# Записи другого формата лежат под ключами другой версии (CACHE_KEY_VERSION), поэтому читается только этот
+ENVELOPE_VERSION = 4
+ENVELOPE_HEADER = struct.Struct(">BBdf16s")
+
+# Почему вместо свежего значения отдано истёкшее: кончился бюджет запроса, elastic перегружен, недоступен
+# или отключён размыкателем цепи
+FALLBACK_REASONS = ("deadline", "overload", "unavailable", "circuit_open")
+
+# Хэш записи об отсутствии документа: ETag у неё нет, он нигде не используется
+MISSING_DIGEST = bytes(16)
+
+T = TypeVar("T")
+
+# Когда начато вычисление значения, которое сейчас будет записано: по нему считается время вычисления
+_computing_since: ContextVar[Optional[float]] = ContextVar("computing_since", default=None)
+
+
+@dataclass
+class CachedValue:
+    """
+    Value read from redis.
+
+    Attributes:
+    - data (bytes): Serialized payload.
+    - etag (str): Entity tag of the payload, computed when it was written.
+    - is_stale (bool): The soft TTL has passed, the value must be refreshed in background.
+    - is_expired (bool): The hard TTL has passed too, the value is kept only as a fallback.
+    - is_missing (bool): There is no such document, the entry only remembers it for a short time.
+    """
+
+    data: bytes
+    etag: str
+    is_stale: bool = False
+    is_expired: bool = False
+    is_missing: bool = False
+
+
+@dataclass(frozen=True)
+class JsonBody:
+    """
+    Serialized response body with its entity tag.
+
+    Attributes:
+    - data (bytes): Json of the response.
+    - etag (str): Quoted entity tag for the ETag header.
+    """
+
+    data: bytes
+    etag: str
+
+
+@dataclass(frozen=True)
+class IdList:
+    """
+    Cached result of a search: the ids of the found documents in the order of the result.
+
+    The documents themselves are cached once each, under their own keys, and
+    a page is built from them when it is read. A document is thus stored once
+    however many pages contain it, and a page always has its latest version.
+
+    Attributes:
+    - ids (list[str]): Ids of the documents of the page.
+    - total (Optional[int]): Number of documents matching the search, None if it was not counted.
+    - next_cursor (Optional[str]): Cursor of the next page for a page read by cursor, None for the last one.
+    """
+
+    ids: list[str]
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
+
+    def dump(
+        self,
+    ) -> bytes:
+        return orjson.dumps(asdict(self))
+
+    @staticmethod
+    def load(
+        data: bytes,
+    ) -> "IdList":
+        return IdList(**orjson.loads(data))
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stale_hits: int = 0
+    writes: int = 0
+    compressed_writes: int = 0
+    bytes_written: int = 0
+    bytes_before_compression: int = 0
+    expired_reads: int = 0
+    missing_hits: int = 0
+    missing_writes: int = 0
+    early_refreshes: int = 0
+    leases_acquired: int = 0
+    lease_waits: int = 0
+    lease_wait_hits: int = 0
+    # Сумма мягких TTL записанных значений и сумма произведений их размера на время хранения в redis:
+    # скорость роста второй по закону Литтла равна памяти, которую значения занимают в redis
+    fresh_seconds_written: int = 0
+    byte_seconds_written: int = 0
+    fallbacks: dict[str, int] = field(default_factory=lambda: dict.fromkeys(FALLBACK_REASONS, 0))
+
+
+class ServiceCache:
+    """
+    Redis cache of one namespace (movie, movies, person, ...) with stale-while-revalidate.
+
+    Every value is stored with a soft and a hard TTL. Until the soft TTL the
+    value is fresh, between the soft and the hard TTL it is still served but
+    reported as stale, so the caller can refresh it in background. After the
+    hard TTL the value is expired: it is a miss, but redis keeps it for the
+    retention time, and it is served when the fresh value can not be loaded
+    in time (see with_fallback).
+
+    The soft TTL and the retention time grow with the popularity of the key,
+    the number of its reads counted by the local cache, within the bounds of
+    the namespace: the values everyone reads are rebuilt rarely, and the long
+    tail read once leaves redis soon.
+
+    A page namespace (movies, persons, ...) is created with the namespace of
+    its documents. A page holds only the ids of its documents (see IdList).
+    Every page is registered in a set per document it contains, so the pages
+    can be evicted when a change of one of the documents changes the result.
+
+    Values larger than the compression threshold are compressed, the codec
+    is written to the header, so values written with another codec or
+    without compression are still read.
+
+    A document that does not exist is remembered by an entry with an empty
+    payload for the missing time (negative caching), so repeated lookups of
+    unknown ids do not reach ElasticSearch. Loading the document evicts the
+    entry like any other cached document.
+
+    The digest of every value is computed once, when it is written, and is
+    kept in the header. The digest of a document is also kept in a small
+    side key, which answers conditional requests (If-None-Match) without
+    reading the value itself. Pages have no side key: the etag of a page is
+    derived from the etags of its documents.
+
+    Many replicas share the cache, so a value is recomputed under a lease in
+    redis (see load_with_lease and refresh_with_lease): one replica loads it
+    from ElasticSearch, the others wait for it or keep serving the old one.
+    A fresh value is reported stale a little before its soft TTL, the earlier
+    the longer it took to compute (XFetch, probabilistic early expiration),
+    so a hot value is refreshed before it becomes stale for every replica.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        namespace: str,
+        document_namespace: Optional[str] = None,
+    ):
+        self.redis = redis
+        self.namespace = namespace
+        self.document_namespace = document_namespace
+        self.min_fresh_time, self.max_fresh_time = settings.cache_expire_times.get(
+            namespace,
+            (settings.cache_expire_time, max(settings.cache_expire_time, settings.cache_max_expire_time)),
+        )
+        self.stale_time = settings.cache_stale_times.get(namespace, 0)
+        self.min_retention_time = min(settings.cache_min_retention_time, settings.cache_retention_time)
+        self.retention_time = settings.cache_retention_time
+        self.popular_reads = settings.cache_popular_reads
+        self.missing_time = settings.cache_missing_time
+        self.early_refresh_beta = settings.cache_early_refresh_beta
+        self.lease_time = settings.cache_lease_time
+        self.lease_wait = settings.cache_lease_wait
+        self.lease_poll_interval = settings.cache_lease_poll_interval
+        self.codec = get_codec(settings.cache_compression_codec)
+        self.compression_threshold = settings.cache_compression_threshold
+        self.stats = get_cache_stats(namespace)
+
+    async def get(
+        self,
+        key: str,
+    ) -> Optional[CachedValue]:
+        return self._unpack(await self.redis.get(key))
+
+    async def mget(
+        self,
+        keys: list[str],
+    ) -> list[Optional[CachedValue]]:
+        return [self._unpack(data) for data in await self.redis.mget(keys)]
+
+    async def get_etag(
+        self,
+        key: str,
+    ) -> Optional[str]:
+        """Returns the entity tag of the cached value without reading the value."""
+        digest = await self.redis.get(etag_key(key))
+        if not digest:
+            return None
+        return f'"{digest.decode()}"'
+
+    async def mget_etags(
+        self,
+        keys: list[str],
+    ) -> list[Optional[str]]:
+        """Returns the entity tags of the cached values in one call, None for the values not cached."""
+        digests = await self.redis.mget([etag_key(key) for key in keys])
+        return [f'"{digest.decode()}"' if digest else None for digest in digests]
+
+    async def with_fallback(
+        self,
+        load: Awaitable[T],
+        fallback: Optional[T],
+    ) -> T:
+        """
+        Awaits the load of a fresh value, the fallback is returned if the load fails for lack of time or of elastic.
+
+        The fallback is usually built from the expired value and marks the response as degraded.
+        Without it, and for any other error, the error is raised.
+        """
+        try:
+            return await load
+        except Exception as error:
+            reason = fallback_reason(error)
+            if reason is None or fallback is None:
+                raise
+            self.stats.fallbacks[reason] += 1
+            mark_degraded(reason)
+            return fallback
+
+    async def load_with_lease(
+        self,
+        key: str,
+        load: Callable[..., Awaitable[T]],
+        decode: Callable[[CachedValue], T],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        """
+        Loads the value of the key if this replica takes the lease of the key, otherwise waits for the holder.
+
+        When the holder writes the value in time, the written value is decoded
+        and returned without a call to ElasticSearch. When it does not, the
+        value is loaded here as well: the lease only saves calls, it never
+        makes a request fail. The value is read once more after the lease is
+        taken, so a miss that raced the previous holder does not load it again.
+        """
+        token = await self._acquire_lease(key)
+        if token is None:
+            cached = await self._wait_for_lease(key)
+            if cached and not cached.is_expired:
+                self.stats.lease_wait_hits += 1
+                return decode(cached)
+            # Держатель аренды не записал значение вовремя или упал: аренда, если она освободилась, достаётся нам
+            token = await self._acquire_lease(key)
+        try:
+            if token is not None:
+                # Предыдущий держатель мог записать значение и отпустить аренду между нашим промахом и SET NX;
+                # промах уже посчитан, поэтому повторное чтение в статистику не входит
+                cached = self._unpack(await self.redis.get(key), record=False)
+                if cached and not cached.is_expired:
+                    self.stats.lease_wait_hits += 1
+                    return decode(cached)
+            with computing():
+                return await load(*args, **kwargs)
+        finally:
+            if token is not None:
+                await self._release_lease(key, token)
+
+    async def refresh_with_lease(
+        self,
+        key: str,
+        load: Callable[..., Awaitable[Any]],
+        *args: Any,
+        **kwargs: Any,
+    ):
+        """Reloads the value of the key in background, unless another replica holds the lease and reloads it already."""
+        token = await self._acquire_lease(key)
+        if token is None:
+            return
+        try:
+            with computing():
+                await load(*args, **kwargs)
+        finally:
+            await self._release_lease(key, token)
+
+    async def set(
+        self,
+        key: str,
+        data: bytes | str,
+        document_ids: Iterable[str] = (),
+    ) -> str:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            etag = self.set_in_pipeline(pipe, key, data, document_ids)
+            await pipe.execute()
+        return etag
+
+    def set_in_pipeline(
+        self,
+        pipe: Pipeline,
+        key: str,
+        data: bytes | str,
+        document_ids: Iterable[str] = (),
+    ) -> str:
+        """Adds the commands writing the value to the pipeline and returns the entity tag of the value."""
+        if isinstance(data, str):
+            data = data.encode()
+        digest = content_digest(data)
+        popularity = self._popularity(key)
+        fresh_time = round(self.min_fresh_time + (self.max_fresh_time - self.min_fresh_time) * popularity)
+        expire_time = fresh_time + self.stale_time
+        retain_time = expire_time + round(
+            self.min_retention_time + (self.retention_time - self.min_retention_time) * popularity
+        )
+        packed = self._pack(data, digest, fresh_time)
+        pipe.set(key, packed, retain_time)
+        if not self.document_namespace:
+            # По тегу отвечают 304 без чтения значения, поэтому он живёт, только пока значение не истекло
+            pipe.set(etag_key(key), digest.hex(), expire_time)
+        else:
+            # Множество общее для страниц разной популярности, поэтому живёт столько, сколько самая популярная
+            longest_retain_time = self.max_fresh_time + self.stale_time + self.retention_time
+            for document_id in document_ids:
+                document_pages_key = pages_key(self.document_namespace, document_id)
+                pipe.sadd(document_pages_key, key)
+                pipe.expire(document_pages_key, longest_retain_time)
+        self.stats.writes += 1
+        self.stats.fresh_seconds_written += fresh_time
+        self.stats.byte_seconds_written += len(packed) * retain_time
+        return f'"{digest.hex()}"'
+
+    async def set_missing(
+        self,
+        key: str,
+    ):
+        await self.redis.set(key, self._pack_missing(), self.missing_time)
+
+    def set_missing_in_pipeline(
+        self,
+        pipe: Pipeline,
+        key: str,
+    ):
+        """Adds the command remembering that there is no document for the key to the pipeline."""
+        pipe.set(key, self._pack_missing(), self.missing_time)
+
+    async def _acquire_lease(
+        self,
+        key: str,
+    ) -> Optional[str]:
+        """Returns the token of the taken lease, None if another replica holds it."""
+        token = secrets.token_hex(8)
+        # Аренда истекает сама, поэтому упавшая реплика не блокирует ключ дольше lease_time
+        if not await self.redis.set(lease_key(key), token, px=int(self.lease_time * 1000), nx=True):
+            return None
+        self.stats.leases_acquired += 1
+        return token
+
+    async def _release_lease(
+        self,
+        key: str,
+        token: str,
+    ):
+        # Аренда могла истечь и достаться другой реплике, поэтому удаляется, только если она всё ещё наша
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(lease_key(key))
+                if await pipe.get(lease_key(key)) == token.encode():
+                    pipe.multi()
+                    pipe.delete(lease_key(key))
+                    await pipe.execute()
+            except WatchError:
+                pass
+
+    async def _wait_for_lease(
+        self,
+        key: str,
+    ) -> Optional[CachedValue]:
+        """Waits until the lease is released, but no longer than the lease wait and the budget, and reads the value."""
+        self.stats.lease_waits += 1
+        remaining = remaining_budget()
+        wait_until = time.monotonic() + min(self.lease_wait, remaining if remaining is not None else math.inf)
+        while time.monotonic() < wait_until and await self.redis.exists(lease_key(key)):
+            await asyncio.sleep(self.lease_poll_interval)
+        return await self.get(key)
+
+    def _pack_missing(
+        self,
+    ) -> bytes:
+        self.stats.missing_writes += 1
+        fresh_until = time.time() + self.missing_time
+        return ENVELOPE_HEADER.pack(ENVELOPE_VERSION, IDENTITY.id, fresh_until, 0.0, MISSING_DIGEST)
+
+    def _pack(
+        self,
+        data: bytes,
+        digest: bytes,
+        fresh_time: float,
+    ) -> bytes:
+        self.stats.bytes_before_compression += len(data)
+        codec = IDENTITY
+        if len(data) >= self.compression_threshold:
+            codec = self.codec
+            data = codec.compress(data)
+            self.stats.compressed_writes += 1
+        started = _computing_since.get()
+        compute_time = time.perf_counter() - started if started is not None else 0.0
+        header = ENVELOPE_HEADER.pack(ENVELOPE_VERSION, codec.id, time.time() + fresh_time, compute_time, digest)
+        packed = header + data
+        self.stats.bytes_written += len(packed)
+        return packed
+
+    def _unpack(
+        self,
+        raw: Optional[bytes],
+        record: bool = True,
+    ) -> Optional[CachedValue]:
+        """Decodes a value read from redis, the read is counted in the stats unless record is False."""
+        stats = self.stats if record else CacheStats()
+        if not raw:
+            stats.misses += 1
+            return None
+        _, codec_id, fresh_until, compute_time, digest = ENVELOPE_HEADER.unpack_from(raw)
+        data = raw[ENVELOPE_HEADER.size :]
+        if not data:
+            # Сериализованный документ или страница не бывают пустыми: пустое значение — запись об отсутствии
+            stats.missing_hits += 1
+            return CachedValue(data=data, etag="", is_missing=True)
+
+        codec = get_codec_by_id(codec_id)
+        if codec is None:
+            # Значение сжато кодеком, библиотеки которого нет в этом процессе
+            stats.misses += 1
+            return None
+        now = time.time()
+        is_expired = fresh_until + self.stale_time <= now
+        if is_expired:
+            stats.misses += 1
+            stats.expired_reads += 1
+        else:
+            stats.hits += 1
+        if codec is not IDENTITY:
+            data = codec.decompress(data)
+        is_stale = fresh_until <= now
+        if is_stale and not is_expired:
+            stats.stale_hits += 1
+        is_early = not is_stale and self._refresh_early(fresh_until, compute_time, now)
+        if is_early:
+            stats.early_refreshes += 1
+        return CachedValue(
+            data=data,
+            etag=f'"{digest.hex()}"',
+            # Досрочно обновляемое значение отдаётся, как устаревшее: как есть, с обновлением в фоне
+            is_stale=is_stale or is_early,
+            is_expired=is_expired,
+        )
+
+    def _popularity(
+        self,
+        key: str,
+    ) -> float:
+        """Returns the popularity of the key: 0 for a key nobody read, 1 for one read popular_reads times or more."""
+        if self.min_fresh_time == self.max_fresh_time and self.min_retention_time == self.retention_time:
+            return 1.0
+        return min(1.0, access_counter.estimate(key) / self.popular_reads)
+
+    def _refresh_early(
+        self,
+        fresh_until: float,
+        compute_time: float,
+        now: float,
+    ) -> bool:
+        """
+        XFetch: tells if a fresh value should be refreshed already.
+
+        The chance grows as the soft TTL approaches, and the refresh starts
+        the earlier the longer the value took to compute, so it is usually
+        done before the value is stale. Each read draws on its own, so on
+        average one of many concurrent readers refreshes the value early.
+        """
+        if not compute_time or not self.early_refresh_beta:
+            return False
+        # 1 - random() лежит в (0, 1], логарифм от него конечен
+        return now - compute_time * self.early_refresh_beta * math.log(1 - random.random()) >= fresh_until
+
+
+def expired_body(
+    cached: Optional[CachedValue],
+) -> Optional[JsonBody]:
+    """The body to fall back to if the cached value is expired, None if there is no such value."""
+    if not cached or not cached.is_expired:
+        return None
+    return JsonBody(cached.data, cached.etag)
+
+
+def fallback_reason(
+    error: Exception,
+) -> Optional[str]:
+    """Tells if the error allows to serve an expired value instead of a fresh one, and why."""
+    if isinstance(error, DeadlineExceededError):
+        return "deadline"
+    if isinstance(error, OverloadedError):
+        return "overload"
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, TransportError) or (isinstance(error, ApiError) and error.meta.status >= 500):
+        return "unavailable"
+    return None
+
+
+def dump_json_list(
+    models: Iterable[BaseModel],
+    include: Optional[set[str]] = None,
+) -> bytes:
+    """Serializes models to a json array, ready to be cached and returned as a response body."""
+    return b"[" + b",".join(model.model_dump_json(include=include).encode() for model in models) + b"]"
+
+
+def join_json_list(
+    documents: Iterable[bytes],
+) -> bytes:
+    """Joins already serialized documents into a json array without decoding them."""
+    return b"[" + b",".join(documents) + b"]"
+
+
+def project_json(
+    document: bytes,
+    fields: Iterable[str],
+) -> bytes:
+    """Cuts the given fields out of a serialized document."""
+    return orjson.dumps({field: value for field, value in orjson.loads(document).items() if field in fields})
+
+
+def project_etag(
+    etag: str,
+    fields: Optional[tuple[str, ...]],
+) -> str:
+    """
+    Entity tag of a document cut to the given fields.
+
+    The projection depends only on the full document and the fields, so
+    the tag is derived from the tag of the full document without the body.
+    """
+    if not fields:
+        return etag
+    return content_etag(f"{etag}{projection_key(fields)}".encode())
+
+
+def content_digest(
+    data: bytes,
+) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def content_etag(
+    data: bytes,
+) -> str:
+    return f'"{content_digest(data).hex()}"'
+
+
+def list_etag(
+    etags: Iterable[str],
+    next_cursor: Optional[str] = None,
+) -> str:
+    """
+    Entity tag of a json array of documents, derived from the tags of the documents.
+
+    The array depends only on its documents and their order, so the tag is
+    known without building the array. The tag of a page read by cursor
+    covers the next cursor too.
+    """
+    return content_etag(f"{','.join(etags)}\n{next_cursor or ''}".encode())
+
+
+def join_json_bodies(
+    documents: list[JsonBody],
+    next_cursor: Optional[str] = None,
+) -> JsonBody:
+    """Joins serialized documents into a json array with the tag given by list_etag."""
+    return JsonBody(
+        join_json_list(document.data for document in documents),
+        list_etag((document.etag for document in documents), next_cursor),
+    )
+
+
+@contextlib.contextmanager
+def computing():
+    """Measures the computation of the values written inside the block, XFetch needs it to refresh them early."""
+    token = _computing_since.set(time.perf_counter())
+    try:
+        yield
+    finally:
+        _computing_since.reset(token)
+
+
+def decode_document(
+    cached: CachedValue,
+) -> Optional[JsonBody]:
+    """The value load_with_lease returns for a cached document, None if the document does not exist."""
+    if cached.is_missing:
+        return None
+    return JsonBody(cached.data, cached.etag)
+
+
+def decode_id_list(
+    cached: CachedValue,
+) -> IdList:
+    """The value load_with_lease returns for a cached page."""
+    return IdList.load(cached.data)
+
+
+def lease_key(
+    key: str,
+) -> str:
+    """Key of the lease of the replica that recomputes the value."""
+    return f"lease_{key}"
+
+
+def etag_key(
+    key: str,
+) -> str:
+    """Key of the digest of the cached value."""
+    return f"etag_{key}"
+
+
+def batch_key(
+    document_ids: Iterable[str],
+) -> str:
+    """Single flight key of a load of several documents, never equal to the key of one document."""
+    return "mget_" + ",".join(document_ids)
+
+
+def pages_key(
+    document_namespace: str,
+    document_id: str,
+) -> str:
+    """Key of the set of cached pages that contain the document."""
+    return build_cache_key(f"{document_namespace}_pages", document_id)
+
+
+def projection_key(
+    fields: Optional[tuple[str, ...]],
+) -> str:
+    """Suffix of the cache key of a page with only the given fields, so projected and full pages never collide."""
+    if not fields:
+        return ""
+    return "_fields_" + ",".join(fields)
+
+
+def get_cache_stats(
+    namespace: str,
+) -> CacheStats:
+    stats = _stats.get(namespace)
+    if stats is None:
+        stats = _stats[namespace] = CacheStats()
+    return stats
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    """Returns redis cache counters of every namespace used in this process."""
+    return {
+        namespace: {
+            "hits": stats.hits,
+            "misses": stats.misses,
+            "stale_hits": stats.stale_hits,
+            "writes": stats.writes,
+            "compressed_writes": stats.compressed_writes,
+            "bytes_written": stats.bytes_written,
+            "bytes_before_compression": stats.bytes_before_compression,
+            "expired_reads": stats.expired_reads,
+            "missing_hits": stats.missing_hits,
+            "missing_writes": stats.missing_writes,
+            "early_refreshes": stats.early_refreshes,
+            "leases_acquired": stats.leases_acquired,
+            "lease_waits": stats.lease_waits,
+            "lease_wait_hits": stats.lease_wait_hits,
+            "fresh_seconds_written": stats.fresh_seconds_written,
+            "byte_seconds_written": stats.byte_seconds_written,
+            **{f"{reason}_fallbacks": count for reason, count in stats.fallbacks.items()},
+        }
+        for namespace, stats in _stats.items()
+    }
+
+
+_stats: dict[str, CacheStats] = {}
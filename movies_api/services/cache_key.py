@@ -0,0 +1,58 @@
+import hashlib
+from enum import Enum
+from typing import Any, Optional
+
+# Версия схемы ключей: её повышают, когда меняется формат кэшированных значений, и старые записи просто истекают
+CACHE_KEY_VERSION = 1
+
+KEY_SEPARATOR = ":"
+HASHED_PART_PREFIX = "#"
+# Части длиннее этого, как длинный поисковый текст или курсор, попадают в ключ хэшем
+KEY_PART_MAX_LENGTH = 64
+
+
+def build_cache_key(
+    namespace: str,
+    *parts: Any,
+) -> str:
+    """
+    Builds the redis key of a cached value from the namespace and the parts that identify the value.
+
+    Every service builds its keys here, so the same request always maps to
+    the same key: the key starts with the schema version and the namespace,
+    None becomes an empty part and an enum its value. A part that is long,
+    or could be mistaken for the separator or a hash, is replaced with its
+    hash, so user text never makes a key long or ambiguous.
+    """
+    return KEY_SEPARATOR.join((f"v{CACHE_KEY_VERSION}", namespace, *(key_part(part) for part in parts)))
+
+
+def key_part(
+    value: Any,
+) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, Enum):
+        value = value.value
+    part = str(value)
+    if len(part) > KEY_PART_MAX_LENGTH or KEY_SEPARATOR in part or part.startswith(HASHED_PART_PREFIX):
+        return HASHED_PART_PREFIX + hashlib.sha1(part.encode()).hexdigest()
+    return part
+
+
+def normalize_search(
+    search: Optional[str],
+) -> Optional[str]:
+    """
+    Returns the searching text as the ru_en analyzer sees it, None for a text without words.
+
+    The analyzer splits the text on whitespace and lowercases it, so the
+    texts that differ only in case and whitespace find the same documents
+    and share one cache entry. The normalized text is what is sent to
+    ElasticSearch as well, so the cached page is exactly the result of the
+    query of its key.
+    """
+    if not search:
+        return None
+    # Фильтр lowercase в elastic понижает регистр так же, как str.lower, а casefold заменил бы, например, ß на ss
+    return " ".join(search.lower().split()) or None
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Mapping, Optional
+
+import orjson
+from api.v1.params import DEFAULT_PAGE_SIZE
+from core.admission import background_priority
+from core.config import settings
+from db.local_cache import LocalCache
+from elasticsearch import AsyncElasticsearch
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from services.cache_key import build_cache_key, normalize_search
+from services.film import FilmService, get_film_service
+from services.genre import GenreService, get_genre_service
+from services.person import PersonService, get_person_service
+
+logger = logging.getLogger(__name__)
+
+# Сигнатуры горячих запросов, счёт сигнатуры — её затухающая частота
+HOT_REQUESTS_KEY = build_cache_key("hot_requests")
+# Пока ключ жив, счёты в этом периоде полураспада уже уменьшила одна из реплик
+HOT_REQUESTS_DECAY_KEY = build_cache_key("hot_requests_decay")
+# Пока ключ жив, прогрев после ETL уже запустила одна из реплик
+WARM_UP_LOCK_KEY = build_cache_key("warm_up_lock")
+WARM_UP_LOCK_SECONDS = 60
+
+# Шаблон пути -> параметры, по которым запрос повторяется; остальные, как fields, на ключи кэша не влияют
+REPLAYED_PARAMS = {
+    "/api/v1/films/{film_id}": ("film_id",),
+    "/api/v1/films/{film_id}/similar": ("film_id",),
+    "/api/v1/films/search": ("search", "sort", "page_size", "page_number"),
+    "/api/v1/genres/{genre_id}": ("genre_id",),
+    "/api/v1/genres/search": ("search", "page_size", "page_number"),
+    "/api/v1/persons/{person_id}": ("person_id",),
+    "/api/v1/persons/search": ("search", "page_size", "page_number"),
+}
+
+Services = tuple[FilmService, GenreService, PersonService]
+
+# Шаблон пути -> вызов сервиса, который заполняет те же записи кэша, что и запрос
+REPLAYS: dict[str, Callable[[Services, dict[str, Any]], Awaitable[Any]]] = {
+    "/api/v1/films/{film_id}": lambda services, params: services[0].get_json_by_id(params["film_id"]),
+    "/api/v1/films/{film_id}/similar": lambda services, params: services[0].get_json_similar(params["film_id"]),
+    "/api/v1/films/search": lambda services, params: services[0].get_json_by_parameters(**params),
+    "/api/v1/genres/{genre_id}": lambda services, params: services[1].get_json_by_id(params["genre_id"]),
+    "/api/v1/genres/search": lambda services, params: services[1].get_json_by_parameters(**params),
+    "/api/v1/persons/{person_id}": lambda services, params: services[2].get_json_by_id(params["person_id"]),
+    "/api/v1/persons/search": lambda services, params: services[2].get_json_by_parameters(**params),
+}
+
+
+class HotRequests:
+    """
+    Counts the requests by signature and keeps the most frequent ones in a redis sorted set.
+
+    A signature is the route and the parameters the cache keys depend on,
+    normalized as the keys normalize them. Requests are counted in the
+    worker and added to redis in one pipeline every flush interval, so
+    counting costs no redis call per request. Once per half-life one of
+    the replicas halves the scores and trims the set, so it follows what is
+    hot now rather than what was hot once.
+    """
+
+    def __init__(
+        self,
+        capacity: int = settings.hot_requests_capacity,
+        half_life: int = settings.hot_requests_half_life,
+        flush_interval: float = settings.hot_requests_flush_interval,
+    ):
+        self.capacity = capacity
+        self.half_life = half_life
+        self.flush_interval = flush_interval
+        self.pending: Counter[str] = Counter()
+
+    def record(
+        self,
+        route: str,
+        path_params: Mapping[str, str],
+        query_params: Mapping[str, str],
+    ):
+        signature = request_signature(route, path_params, query_params)
+        # Новые сигнатуры сверх ёмкости не копятся: память воркера не растёт от перебора параметров
+        if signature is not None and (signature in self.pending or len(self.pending) < self.capacity):
+            self.pending[signature] += 1
+
+    async def flush(
+        self,
+        redis: Redis,
+    ):
+        """Adds the counted requests to the scores in redis."""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, Counter()
+        # Счёты уменьшаются до добавления новых запросов, чтобы уменьшились только старые
+        if await redis.set(HOT_REQUESTS_DECAY_KEY, 1, ex=self.half_life, nx=True):
+            await self.decay(redis)
+        async with redis.pipeline(transaction=False) as pipe:
+            for signature, count in pending.items():
+                pipe.zincrby(HOT_REQUESTS_KEY, count, signature)
+            await pipe.execute()
+
+    async def decay(
+        self,
+        redis: Redis,
+    ):
+        """Halves the scores and keeps only the most frequent signatures."""
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zunionstore(HOT_REQUESTS_KEY, {HOT_REQUESTS_KEY: 0.5})
+            pipe.zremrangebyrank(HOT_REQUESTS_KEY, 0, -self.capacity - 1)
+            await pipe.execute()
+
+    async def flush_periodically(
+        self,
+        redis: Redis,
+    ):
+        """Flushes the counted requests every flush interval until cancelled."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush(redis)
+            except RedisError:
+                logger.warning("Failed to record hot requests in redis", exc_info=True)
+
+    @staticmethod
+    async def top(
+        redis: Redis,
+        limit: int,
+    ) -> list[str]:
+        """Returns the signatures of the most frequent requests, the most frequent first."""
+        return [signature.decode() for signature in await redis.zrevrange(HOT_REQUESTS_KEY, 0, limit - 1)]
+
+
+class CacheWarmer:
+    """
+    Replays the hottest requests through the services, so the pages and
+    documents most requested are cached before users ask for them.
+
+    Replays run with background priority and are paced by the concurrency
+    and rate limits, so a warm-up never crowds out user requests to
+    ElasticSearch. Requests already cached cost only a read from redis.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        elastic: AsyncElasticsearch,
+        local_cache: LocalCache,
+        limit: int = settings.warm_up_hot_requests_limit,
+        concurrency: int = settings.warm_up_concurrency,
+        rate: float = settings.warm_up_rate,
+    ):
+        self.redis = redis
+        self.services = (
+            get_film_service(redis, elastic, local_cache),
+            get_genre_service(redis, elastic, local_cache),
+            get_person_service(redis, elastic, local_cache),
+        )
+        self.limit = limit
+        self.concurrency = concurrency
+        self.rate = rate
+        self.task: Optional[asyncio.Task] = None
+
+    async def warm(
+        self,
+    ) -> tuple[int, int]:
+        """Replays the hottest requests, returns how many were replayed and how many of them failed."""
+        started = time.perf_counter()
+        signatures = await HotRequests.top(self.redis, self.limit)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failed = 0
+
+        async def replay_paced(
+            position: int,
+            signature: str,
+        ):
+            nonlocal failed
+            if self.rate:
+                # Запросы начинаются не чаще rate в секунду
+                await asyncio.sleep(max(0.0, started + position / self.rate - time.perf_counter()))
+            async with semaphore:
+                try:
+                    await self.replay(signature)
+                except Exception:
+                    failed += 1
+                    logger.debug("Failed to replay hot request %s", signature, exc_info=True)
+
+        with background_priority():
+            await asyncio.gather(*(replay_paced(position, signature) for position, signature in enumerate(signatures)))
+        logger.info(
+            "Replayed %s hot requests in %.2f s, %s failed",
+            len(signatures),
+            time.perf_counter() - started,
+            failed,
+        )
+        return len(signatures), failed
+
+    async def replay(
+        self,
+        signature: str,
+    ):
+        route, params = orjson.loads(signature)
+        await REPLAYS[route](self.services, params)
+
+    def trigger(
+        self,
+    ):
+        """Starts a warm-up in background, unless one is running here or one of the replicas has just started it."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._warm_once())
+
+    async def _warm_once(
+        self,
+    ):
+        try:
+            # После ETL кэш в redis общий, поэтому его прогревает одна реплика
+            if await self.redis.set(WARM_UP_LOCK_KEY, 1, ex=WARM_UP_LOCK_SECONDS, nx=True):
+                await self.warm()
+        except Exception:
+            logger.exception("Warm-up after the ETL cycle failed")
+
+
+def request_signature(
+    route: str,
+    path_params: Mapping[str, str],
+    query_params: Mapping[str, str],
+) -> Optional[str]:
+    """Returns the signature of a request the warmer can replay, None for other requests."""
+    names = REPLAYED_PARAMS.get(route)
+    # Страницы по курсору живут, пока жив курсор, повторять их незачем
+    if names is None or "cursor" in query_params:
+        return None
+    params = {name: _normalize_param(name, path_params.get(name, query_params.get(name))) for name in names}
+    return orjson.dumps([route, params], option=orjson.OPT_SORT_KEYS).decode()
+
+
+def _normalize_param(
+    name: str,
+    value: Optional[str],
+) -> Any:
+    if name == "search":
+        return normalize_search(value)
+    if name == "page_size":
+        return int(value) if value else DEFAULT_PAGE_SIZE
+    if name == "page_number":
+        return int(value) if value else 1
+    return value or None
+
+
+hot_requests = HotRequests()
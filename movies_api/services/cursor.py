@@ -0,0 +1,138 @@
+import base64
+import binascii
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+import orjson
+from elasticsearch import AsyncElasticsearch, NotFoundError
+
+PIT_KEEP_ALIVE = "1m"
+TIEBREAKER_FIELD = "id"
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+@dataclass
+class Cursor:
+    """
+    Position in a search result opened with point in time.
+
+    Attributes:
+    - search (Optional[str]): Searching text of the first page.
+    - sort (Optional[str]): Sort option of the first page.
+    - search_after (Optional[list]): Sort values of the last returned hit.
+    - pit_id (Optional[str]): Id of the point in time the pages are read from.
+    """
+
+    search: str | None = None
+    sort: str | None = None
+    search_after: list[Any] | None = None
+    pit_id: str | None = None
+
+    def encode(
+        self,
+    ) -> str:
+        return base64.urlsafe_b64encode(orjson.dumps(asdict(self))).rstrip(b"=").decode()
+
+    @staticmethod
+    def decode(
+        value: str,
+    ) -> "Cursor":
+        try:
+            data = orjson.loads(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+            return Cursor(**data)
+        except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError) as error:
+            raise InvalidCursorError("invalid cursor") from error
+
+
+def sort_with_tiebreaker(
+    sort: list[dict] | None,
+) -> list[dict]:
+    """search_after requires a total order, so hits with equal sort values are ordered by id."""
+    return [*(sort or [{"_score": "desc"}]), {TIEBREAKER_FIELD: "asc"}]
+
+
+async def search_after_page(
+    elastic: AsyncElasticsearch,
+    index: str,
+    query: dict,
+    sort: list[dict],
+    page_size: int,
+    cursor: Cursor,
+    source_includes: Optional[list[str]] = None,
+    fetch_source: bool = True,
+) -> tuple[list[dict], Optional[Cursor]]:
+    """
+    Reads one page of hits after the cursor position.
+
+    Every page costs the same as the first one, no matter how deep it is. If
+    the point in time has already expired, a new one is opened and the
+    reading continues from the same sort values.
+
+    :param source_includes: fields of the documents to return, all of them if not given
+    :param fetch_source: if false, the hits have only the ids and the sort values of the documents
+    :return: hits of the page and the cursor of the next page (None for the last page)
+    """
+    pit_id = cursor.pit_id or await _open_point_in_time(elastic, index)
+    search_args = (query, sort, page_size, cursor.search_after, source_includes, fetch_source)
+    try:
+        response = await _search_in_point_in_time(elastic, *search_args, pit_id)
+    except NotFoundError:
+        pit_id = await _open_point_in_time(elastic, index)
+        response = await _search_in_point_in_time(elastic, *search_args, pit_id)
+
+    hits = response["hits"]["hits"]
+    pit_id = response.get("pit_id", pit_id)
+    if len(hits) < page_size:
+        await elastic.options(ignore_status=404).close_point_in_time(id=pit_id)
+        return hits, None
+
+    return hits, Cursor(
+        search=cursor.search,
+        sort=cursor.sort,
+        search_after=hits[-1]["sort"],
+        pit_id=pit_id,
+    )
+
+
+async def _open_point_in_time(
+    elastic: AsyncElasticsearch,
+    index: str,
+) -> str:
+    response = await elastic.open_point_in_time(
+        index=index,
+        keep_alive=PIT_KEEP_ALIVE,
+    )
+    return response["id"]
+
+
+async def _search_in_point_in_time(
+    elastic: AsyncElasticsearch,
+    query: dict,
+    sort: list[dict],
+    page_size: int,
+    search_after: list[Any] | None,
+    source_includes: Optional[list[str]],
+    fetch_source: bool,
+    pit_id: str,
+) -> dict:
+    body = {
+        "query": query,
+        "size": page_size,
+        "sort": sort,
+        "pit": {
+            "id": pit_id,
+            "keep_alive": PIT_KEEP_ALIVE,
+        },
+    }
+    if search_after:
+        body["search_after"] = search_after
+    if not fetch_source:
+        body["_source"] = False
+    # Запрос с pit выполняется без указания индекса
+    return await elastic.search(
+        body=body,
+        source_includes=source_includes,
+    )
@@ -0,0 +1,634 @@
+from typing import Any, Awaitable, Callable, List, Optional
+
+import orjson
+from core.admission import background_priority
+from core.single_flight import SingleFlight, get_single_flight
+from db.known_ids import known_ids
+from db.local_cache import LocalCache
+from elasticsearch import AsyncElasticsearch, NotFoundError
+from redis.asyncio import Redis
+from services.cache import (
+    CachedValue,
+    IdList,
+    JsonBody,
+    ServiceCache,
+    batch_key,
+    computing,
+    decode_document,
+    decode_id_list,
+    expired_body,
+    join_json_bodies,
+    list_etag,
+    project_etag,
+    project_json,
+)
+from services.cache_key import build_cache_key, normalize_search
+from services.cursor import Cursor, search_after_page, sort_with_tiebreaker
+
+
+class DocumentService:
+    """
+    Documents of one elastic index cached in redis and in the local cache.
+
+    Documents are cached as json, the json methods return it as it is,
+    together with the entity tag computed when it was cached. The etag
+    methods return only the tag, so a conditional request is answered
+    without the body. Pages cache only the ids of their documents and are
+    built from the cached documents.
+
+    A service sets the index, the namespaces of its documents and pages in
+    the caches and builds the documents from the elastic source.
+    """
+
+    index: str
+    document_namespace: str
+    page_namespace: str
+    # Нечёткий поиск; None ищет только точные совпадения слов
+    fuzziness: Optional[str] = None
+
+    def __init__(
+        self,
+        redis: Redis,
+        elastic: AsyncElasticsearch,
+        local_cache: LocalCache,
+    ):
+        self.redis = redis
+        self.elastic = elastic
+        self.local_cache = local_cache
+        self.known_ids = known_ids
+        self.cache = ServiceCache(redis, self.document_namespace)
+        self.list_cache = ServiceCache(
+            redis,
+            self.page_namespace,
+            document_namespace=self.document_namespace,
+        )
+        self.single_flight = get_single_flight(self.document_namespace)
+        self.list_single_flight = get_single_flight(self.page_namespace)
+
+    @staticmethod
+    def _from_source(
+        source: dict,
+    ) -> dict:
+        """Returns the document served by the api built from its elastic source."""
+        raise NotImplementedError
+
+    async def get_json_by_id(
+        self,
+        document_id: str,
+        fields: Optional[tuple[str, ...]] = None,
+    ) -> Optional[JsonBody]:
+        """
+        Returns the document serialized to json.
+
+        A document with only the given fields is cut from the cached full document.
+        """
+        cache_key = build_cache_key(self.document_namespace, document_id)
+        document = self.local_cache.get(self.document_namespace, cache_key)
+        if not document:
+            # Id, которого нет в фильтре известных id, никогда не загружался: его не знают ни redis, ни elastic
+            if not await self.known_ids.might_exist(self.index, document_id):
+                return None
+            cached = await self.cache.get(cache_key)
+            if cached and cached.is_missing:
+                return None
+            if cached and not cached.is_expired:
+                document = JsonBody(cached.data, cached.etag)
+                if not self._refresh_if_stale(
+                    cached, cache_key, self.cache, self.single_flight, self._load_document, document_id
+                ):
+                    self.local_cache.set(self.document_namespace, cache_key, document, len(document.data))
+            else:
+                # Конкурентные промахи по одному ключу разделяют один запрос в elastic и одну запись в redis,
+                # а истёкшая запись отдаётся, только если свежую не удалось загрузить
+                document = await self.cache.with_fallback(
+                    self.single_flight.do(
+                        cache_key,
+                        self.cache.load_with_lease,
+                        cache_key,
+                        self._load_document,
+                        decode_document,
+                        document_id,
+                    ),
+                    expired_body(cached),
+                )
+                if not document:
+                    return None
+
+        if not fields:
+            return document
+        return JsonBody(project_json(document.data, fields), project_etag(document.etag, fields))
+
+    async def get_etag_by_id(
+        self,
+        document_id: str,
+        fields: Optional[tuple[str, ...]] = None,
+    ) -> Optional[str]:
+        """Returns the entity tag of the cached document, None if the document is not cached."""
+        cache_key = build_cache_key(self.document_namespace, document_id)
+        document = self.local_cache.get(self.document_namespace, cache_key)
+        etag = document.etag if document else await self.cache.get_etag(cache_key)
+        return project_etag(etag, fields) if etag else None
+
+    async def get_json_many_by_ids(
+        self,
+        document_ids: List[str],
+        fields: Optional[tuple[str, ...]] = None,
+    ) -> JsonBody:
+        """Returns the documents serialized to a json array in the requested order, unknown ids are skipped."""
+        document_ids = [
+            document_id
+            for document_id in dict.fromkeys(document_ids)
+            if await self.known_ids.might_exist(self.index, document_id)
+        ]
+        return join_json_bodies(await self._get_json_documents(document_ids, fields))
+
+    async def get_json_by_parameters(
+        self,
+        page_number: int,
+        page_size: int,
+        search: str | None = None,
+        sort: str | None = None,
+        fields: Optional[tuple[str, ...]] = None,
+    ) -> JsonBody:
+        """Returns a page of documents serialized to a json array."""
+        cache_key = self._list_cache_key(
+            search=search,
+            page_size=page_size,
+            page_number=page_number,
+            sort=sort,
+        )
+        page = await self._get_id_list(
+            cache_key,
+            self._load_page,
+            cache_key,
+            search=search,
+            page_number=page_number,
+            page_size=page_size,
+            sort=sort,
+        )
+        return join_json_bodies(await self._get_json_documents(page.ids, fields))
+
+    async def get_etag_by_parameters(
+        self,
+        page_number: int,
+        page_size: int,
+        search: str | None = None,
+        sort: str | None = None,
+        fields: Optional[tuple[str, ...]] = None,
+    ) -> Optional[str]:
+        """Returns the entity tag of the cached page, None if the page or any of its documents is not cached."""
+        cache_key = self._list_cache_key(
+            search=search,
+            page_size=page_size,
+            page_number=page_number,
+            sort=sort,
+        )
+        page = await self._get_cached_id_list(cache_key)
+        if not page:
+            return None
+        return await self._get_documents_etag(page.ids, fields)
+
+    async def get_json_page_by_cursor(
+        self,
+        page_size: int,
+        cursor: str,
+        search: str | None = None,
+        sort: str | None = None,
+        fields: Optional[tuple[str, ...]] = None,
+    ) -> tuple[JsonBody, Optional[str]]:
+        """
+        Returns a page of documents after the cursor serialized to a json array, and the cursor of the next page.
+
+        An empty cursor opens a new point in time for the search and sort,
+        a non-empty one continues the search it was created for. The etag of
+        the page covers the next cursor too.
+        """
+        position = Cursor.decode(cursor) if cursor else Cursor(search=search, sort=sort)
+        cache_key = self._cursor_cache_key(
+            page_size=page_size,
+            cursor=cursor,
+            search=position.search,
+            sort=position.sort,
+        )
+        page = await self._get_id_list(
+            cache_key,
+            self._load_cursor_page,
+            cache_key,
+            page_size,
+            position,
+        )
+        documents = await self._get_json_documents(page.ids, fields)
+        return join_json_bodies(documents, page.next_cursor), page.next_cursor
+
+    async def get_etag_page_by_cursor(
+        self,
+        page_size: int,
+        cursor: str,
+        search: str | None = None,
+        sort: str | None = None,
+        fields: Optional[tuple[str, ...]] = None,
+    ) -> Optional[str]:
+        """Returns the entity tag of the cached page, None if the page or any of its documents is not cached."""
+        position = Cursor.decode(cursor) if cursor else Cursor(search=search, sort=sort)
+        cache_key = self._cursor_cache_key(
+            page_size=page_size,
+            cursor=cursor,
+            search=position.search,
+            sort=position.sort,
+        )
+        page = await self._get_cached_id_list(cache_key)
+        if not page:
+            return None
+        return await self._get_documents_etag(page.ids, fields, page.next_cursor)
+
+    async def _get_id_list(
+        self,
+        cache_key: str,
+        load: Callable[..., Awaitable[IdList]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> IdList:
+        """Returns the ids of the cached page, or of the page loaded by the given function if it is not cached."""
+        page = self.local_cache.get(self.page_namespace, cache_key)
+        if page:
+            return page
+
+        cached = await self.list_cache.get(cache_key)
+        page = IdList.load(cached.data) if cached else None
+        if page and not cached.is_expired:
+            if not self._refresh_if_stale(
+                cached, cache_key, self.list_cache, self.list_single_flight, load, *args, **kwargs
+            ):
+                self.local_cache.set(self.page_namespace, cache_key, page, len(cached.data))
+            return page
+
+        # Истёкшая страница отдаётся, только если свежую не удалось загрузить
+        return await self.list_cache.with_fallback(
+            self.list_single_flight.do(
+                cache_key, self.list_cache.load_with_lease, cache_key, load, decode_id_list, *args, **kwargs
+            ),
+            page,
+        )
+
+    async def _get_cached_id_list(
+        self,
+        cache_key: str,
+    ) -> Optional[IdList]:
+        page = self.local_cache.get(self.page_namespace, cache_key)
+        if page:
+            return page
+        cached = await self.list_cache.get(cache_key)
+        if not cached or cached.is_expired:
+            return None
+        return IdList.load(cached.data)
+
+    async def _get_json_documents(
+        self,
+        document_ids: List[str],
+        fields: Optional[tuple[str, ...]] = None,
+    ) -> List[JsonBody]:
+        """
+        Returns the documents in the given order, ids with no document are skipped.
+
+        The documents are read from the local cache, then from redis with one
+        MGET, and the documents missing there are loaded with one mget to elastic.
+        """
+        documents, expired = await self._documents_from_cache(document_ids)
+        missing_ids = [document_id for document_id in document_ids if document_id not in documents]
+        if missing_ids:
+            # Истёкшие записи подменяют загрузку, только если они есть у всех недостающих id,
+            # иначе ответ был бы неполным
+            documents.update(
+                await self.cache.with_fallback(
+                    self.single_flight.do(batch_key(missing_ids), self._load_documents, missing_ids),
+                    expired if len(expired) == len(missing_ids) else None,
+                )
+            )
+
+        documents = [documents[document_id] for document_id in document_ids if documents.get(document_id)]
+        if not fields:
+            return documents
+        return [
+            JsonBody(project_json(document.data, fields), project_etag(document.etag, fields)) for document in documents
+        ]
+
+    async def _get_documents_etag(
+        self,
+        document_ids: List[str],
+        fields: Optional[tuple[str, ...]] = None,
+        next_cursor: Optional[str] = None,
+    ) -> Optional[str]:
+        """Returns the entity tag of the json array of the documents from their cached tags, None if any is not cached."""
+        etags = {}
+        redis_keys = {}
+        for document_id in document_ids:
+            cache_key = build_cache_key(self.document_namespace, document_id)
+            document = self.local_cache.get(self.document_namespace, cache_key)
+            if document:
+                etags[document_id] = document.etag
+            else:
+                redis_keys[document_id] = cache_key
+        if redis_keys:
+            redis_etags = await self.cache.mget_etags(list(redis_keys.values()))
+            for document_id, etag in zip(redis_keys, redis_etags):
+                if not etag:
+                    return None
+                etags[document_id] = etag
+        return list_etag((project_etag(etags[document_id], fields) for document_id in document_ids), next_cursor)
+
+    async def _load_document(
+        self,
+        document_id: str,
+    ) -> Optional[JsonBody]:
+        document = await self._get_document_from_elastic(document_id)
+        if not document:
+            self.known_ids.record_not_found(self.index)
+            await self.cache.set_missing(build_cache_key(self.document_namespace, document_id))
+            return None
+        return await self._put_document_to_cache(document_id, orjson.dumps(document))
+
+    async def _load_documents(
+        self,
+        document_ids: List[str],
+    ) -> dict[str, JsonBody]:
+        # Один mget в elastic только по тем id, которых нет в кэше;
+        # время загрузки записывается вместе с документами, по нему они обновляются досрочно
+        with computing():
+            documents = await self._get_documents_from_elastic(document_ids)
+            missing_ids = [document_id for document_id in document_ids if document_id not in documents]
+            self.known_ids.record_not_found(self.index, len(missing_ids))
+            return await self._put_documents_to_cache(
+                {document_id: orjson.dumps(document) for document_id, document in documents.items()},
+                missing_ids,
+            )
+
+    async def _load_page(
+        self,
+        cache_key: str,
+        page_number: int,
+        page_size: int,
+        search: str | None = None,
+        sort: str | None = None,
+    ) -> IdList:
+        document_ids, total = await self._get_page_ids_from_elastic(
+            search=search,
+            page_number=page_number,
+            page_size=page_size,
+            sort=sort,
+        )
+        page = IdList(document_ids, total)
+        # Пустая страница не кэшируется: ни один документ не вытеснит её, когда у поиска появятся результаты
+        if document_ids:
+            await self._put_id_list_to_cache(cache_key, page)
+        return page
+
+    async def _load_cursor_page(
+        self,
+        cache_key: str,
+        page_size: int,
+        position: Cursor,
+    ) -> IdList:
+        document_ids, next_cursor = await self._get_cursor_page_ids_from_elastic(
+            page_size=page_size,
+            cursor=position,
+        )
+        page = IdList(document_ids, next_cursor=next_cursor.encode() if next_cursor else None)
+        await self._put_id_list_to_cache(cache_key, page)
+        return page
+
+    async def _get_document_from_elastic(
+        self,
+        document_id: str,
+    ) -> Optional[dict]:
+        try:
+            doc = await self.elastic.get(
+                index=self.index,
+                id=document_id,
+            )
+        except NotFoundError:
+            return None
+        return self._from_source(doc["_source"])
+
+    async def _get_documents_from_elastic(
+        self,
+        document_ids: List[str],
+    ) -> dict[str, dict]:
+        try:
+            doc = await self.elastic.mget(
+                index=self.index,
+                ids=document_ids,
+            )
+        except NotFoundError:
+            return {}
+        return {
+            document["_id"]: self._from_source(document["_source"]) for document in doc["docs"] if document.get("found")
+        }
+
+    async def _get_page_ids_from_elastic(
+        self,
+        page_number: int,
+        page_size: int,
+        search: str | None = None,
+        sort: str | None = None,
+    ) -> tuple[list[str], int]:
+        query = {
+            "query": self._build_search_query(search),
+            "size": page_size,
+            "from": (page_number - 1) * page_size,
+            # Документы страницы берутся из кэша, от поиска нужны только их id
+            "_source": False,
+        }
+
+        if sort:
+            query["sort"] = self._build_sort(sort)
+
+        try:
+            doc = await self.elastic.search(
+                index=self.index,
+                body=query,
+            )
+        except NotFoundError:
+            return [], 0
+        return [document["_id"] for document in doc["hits"]["hits"]], doc["hits"]["total"]["value"]
+
+    async def _get_cursor_page_ids_from_elastic(
+        self,
+        page_size: int,
+        cursor: Cursor,
+    ) -> tuple[list[str], Optional[Cursor]]:
+        documents, next_cursor = await search_after_page(
+            self.elastic,
+            index=self.index,
+            query=self._build_search_query(cursor.search),
+            sort=sort_with_tiebreaker(self._build_sort(cursor.sort) if cursor.sort else None),
+            page_size=page_size,
+            cursor=cursor,
+            fetch_source=False,
+        )
+        return [document["_id"] for document in documents], next_cursor
+
+    def _build_search_query(
+        self,
+        search: str | None,
+    ) -> dict:
+        # Запрос строится по тому же тексту, что и ключ его страницы в кэше
+        search = normalize_search(search)
+        if not search:
+            return {"match_all": {}}
+        query = {
+            "query": search,
+            "fields": ["*"],
+        }
+        if self.fuzziness:
+            query["fuzziness"] = self.fuzziness
+        return {"multi_match": query}
+
+    @staticmethod
+    def _build_sort(
+        sort: str,
+    ) -> list[dict]:
+        if sort.startswith("-"):
+            return [{sort[1:]: "desc"}]
+        return [{sort: "asc"}]
+
+    async def _documents_from_cache(
+        self,
+        document_ids: List[str],
+    ) -> tuple[dict[str, Optional[JsonBody]], dict[str, JsonBody]]:
+        """
+        Returns the fresh and stale documents found in the caches, and apart from them the expired ones.
+
+        Ids known to have no document are returned with None.
+        """
+        documents = {}
+        expired = {}
+        redis_keys = {}
+        for document_id in document_ids:
+            cache_key = build_cache_key(self.document_namespace, document_id)
+            document = self.local_cache.get(self.document_namespace, cache_key)
+            if document:
+                documents[document_id] = document
+            else:
+                redis_keys[document_id] = cache_key
+        if not redis_keys:
+            return documents, expired
+
+        stale_ids = []
+        values = await self.cache.mget(list(redis_keys.values()))
+        for (document_id, cache_key), cached in zip(redis_keys.items(), values):
+            if not cached:
+                continue
+            if cached.is_missing:
+                # Известно, что документа нет: None не даёт загружать его из elastic
+                documents[document_id] = None
+                continue
+            document = JsonBody(cached.data, cached.etag)
+            if cached.is_expired:
+                expired[document_id] = document
+                continue
+            if cached.is_stale:
+                stale_ids.append(document_id)
+            else:
+                self.local_cache.set(self.document_namespace, cache_key, document, len(cached.data))
+            documents[document_id] = document
+
+        if stale_ids:
+            # Устаревшие документы обновляются в фоне одним mget, а не запросом на каждый
+            with background_priority():
+                self.single_flight.do_in_background(batch_key(stale_ids), self._load_documents, stale_ids)
+        return documents, expired
+
+    @staticmethod
+    def _refresh_if_stale(
+        cached: CachedValue,
+        cache_key: str,
+        cache: ServiceCache,
+        single_flight: SingleFlight,
+        load: Callable[..., Awaitable[Any]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> bool:
+        """
+        A stale value is served as is and reloaded in background, only fresh values go to the local cache.
+
+        The reload does not queue for elastic when it is at its limit, the next request retries it.
+        Of all the replicas that read the stale value, only the one that takes the lease reloads it.
+        """
+        if cached.is_stale:
+            with background_priority():
+                single_flight.do_in_background(cache_key, cache.refresh_with_lease, cache_key, load, *args, **kwargs)
+        return cached.is_stale
+
+    async def _put_document_to_cache(
+        self,
+        document_id: str,
+        document_json: bytes,
+    ) -> JsonBody:
+        cache_key = build_cache_key(self.document_namespace, document_id)
+        etag = await self.cache.set(
+            cache_key,
+            document_json,
+        )
+        document = JsonBody(document_json, etag)
+        self.local_cache.set(self.document_namespace, cache_key, document, len(document_json))
+        return document
+
+    async def _put_documents_to_cache(
+        self,
+        documents: dict[str, bytes],
+        missing_ids: List[str],
+    ) -> dict[str, JsonBody]:
+        cached_documents = {}
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for document_id, document_json in documents.items():
+                cache_key = build_cache_key(self.document_namespace, document_id)
+                etag = self.cache.set_in_pipeline(
+                    pipe,
+                    cache_key,
+                    document_json,
+                )
+                cached_documents[document_id] = JsonBody(document_json, etag)
+                self.local_cache.set(
+                    self.document_namespace, cache_key, cached_documents[document_id], len(document_json)
+                )
+            for document_id in missing_ids:
+                self.cache.set_missing_in_pipeline(pipe, build_cache_key(self.document_namespace, document_id))
+            await pipe.execute()
+        return cached_documents
+
+    async def _put_id_list_to_cache(
+        self,
+        cache_key: str,
+        page: IdList,
+        document_ids: Optional[List[str]] = None,
+    ):
+        """The page is evicted when any of the documents is reloaded, by default the documents of the page."""
+        data = page.dump()
+        await self.list_cache.set(
+            cache_key,
+            data,
+            document_ids=page.ids if document_ids is None else document_ids,
+        )
+        self.local_cache.set(self.page_namespace, cache_key, page, len(data))
+
+    def _list_cache_key(
+        self,
+        page_size: int,
+        page_number: int,
+        search: str | None = None,
+        sort: str | None = None,
+    ) -> str:
+        # Поля ответа в ключ не входят: страница хранит только id, и все проекции строятся из одной страницы
+        return build_cache_key(self.page_namespace, "page", normalize_search(search), sort, page_size, page_number)
+
+    def _cursor_cache_key(
+        self,
+        page_size: int,
+        cursor: str,
+        search: str | None = None,
+        sort: str | None = None,
+    ) -> str:
+        if not cursor:
+            return build_cache_key(self.page_namespace, "cursor", normalize_search(search), sort, page_size)
+        # Курсор длинный, поэтому в ключ попадает только его хэш
+        return build_cache_key(self.page_namespace, "cursor", cursor, page_size)
@@ -0,0 +1,96 @@
+import asyncio
+import contextlib
+from typing import AsyncIterator, Callable, Optional
+
+import orjson
+from core.config import settings
+from core.deadline import no_deadline
+from core.metrics import EXPORTED_DOCUMENTS
+from elasticsearch import AsyncElasticsearch
+from services.cursor import TIEBREAKER_FIELD, Cursor, search_after_page
+
+# Выгрузка идёт по id: он уникален, и id последнего полученного документа — готовая точка продолжения
+EXPORT_SORT = [{TIEBREAKER_FIELD: "asc"}]
+
+Page = tuple[list[dict], Optional[Cursor]]
+
+
+async def export_ndjson(
+    elastic: AsyncElasticsearch,
+    index: str,
+    convert: Callable[[dict], dict],
+    source_includes: Optional[list[str]] = None,
+    after: Optional[str] = None,
+    page_size: int = settings.export_page_size,
+) -> AsyncIterator[bytes]:
+    """
+    Exports the whole index in id order as NDJSON, one document per line.
+
+    The first page is read before the stream is returned, so a failure to
+    start the export is still answered with an error status. The rest is
+    read from the same point in time by search_after, one page ahead of the
+    client: the next page is read while the current one is being sent, and
+    no page is read before the previous one is sent, so the memory is
+    bounded by two pages and a slow client slows down the reading.
+
+    Every line is a checkpoint: an export broken off after a line resumes
+    with the id of its document as `after`.
+
+    :param convert: converts `_source` of a document to the json of the line
+    :param source_includes: fields of the documents to read, all of them if not given
+    :param after: id of the last document already received, the export starts after it
+    """
+    first_page = await search_after_page(
+        elastic,
+        index=index,
+        query={"match_all": {}},
+        sort=EXPORT_SORT,
+        page_size=page_size,
+        cursor=Cursor(search_after=[after] if after else None),
+        source_includes=source_includes,
+    )
+    return _stream_pages(elastic, index, convert, source_includes, page_size, first_page)
+
+
+async def _stream_pages(
+    elastic: AsyncElasticsearch,
+    index: str,
+    convert: Callable[[dict], dict],
+    source_includes: Optional[list[str]],
+    page_size: int,
+    page: Page,
+) -> AsyncIterator[bytes]:
+    next_page: Optional[asyncio.Task] = None
+    cursor = page[1]
+    try:
+        while True:
+            documents, cursor = page
+            if cursor is not None:
+                # Бюджет запроса рассчитан на первую страницу, следующие ограничены только таймаутом elastic
+                with no_deadline():
+                    next_page = asyncio.create_task(
+                        search_after_page(
+                            elastic,
+                            index=index,
+                            query={"match_all": {}},
+                            sort=EXPORT_SORT,
+                            page_size=page_size,
+                            cursor=cursor,
+                            source_includes=source_includes,
+                        )
+                    )
+            if documents:
+                EXPORTED_DOCUMENTS.labels(index).inc(len(documents))
+                yield b"".join(orjson.dumps(convert(document["_source"])) + b"\n" for document in documents)
+            if next_page is None:
+                return
+            page, next_page = await next_page, None
+    finally:
+        # Клиент отключился или чтение упало: point in time закрывается сразу, а не через keep_alive
+        if next_page is not None:
+            next_page.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await next_page
+        if cursor is not None and cursor.pit_id:
+            with no_deadline(), contextlib.suppress(Exception):
+                await elastic.options(ignore_status=404).close_point_in_time(id=cursor.pit_id)
@@ -1,194 +1,161 @@
 from functools import lru_cache
-from typing import List, Optional
+from typing import AsyncIterator, Optional
 
-import orjson
 from core.config import settings
 from db.elastic import get_elastic
+from db.local_cache import LocalCache, get_local_cache
 from db.redis import get_redis
 from elasticsearch import AsyncElasticsearch, NotFoundError
 from fastapi import Depends
-from models.film import Film
+from models.film import FILM_SOURCE_FIELDS, film_from_source
 from redis.asyncio import Redis
+from services.cache import IdList, JsonBody, join_json_bodies
+from services.cache_key import build_cache_key
+from services.document import DocumentService
+from services.export import export_ndjson
 
+# Поля, по которым more_like_this ищет похожие фильмы; ETL считает похожие заранее по тем же полям
+SIMILAR_FILM_FIELDS = ["title", "description", "genre", "actors_names"]
 
-class FilmService:
-    def __init__(
-        self,
-        redis: Redis,
-        elastic: AsyncElasticsearch,
-    ):
-        self.redis = redis
-        self.elastic = elastic
 
-    async def get_by_id(
+class FilmService(DocumentService):
+    """Films read from elastic and cached in redis and in the local cache, see DocumentService."""
+
+    index = "movies"
+    document_namespace = "movie"
+    page_namespace = "movies"
+    fuzziness = "AUTO"
+
+    @staticmethod
+    def _from_source(
+        source: dict,
+    ) -> dict:
+        return film_from_source(source)
+
+    async def get_json_similar(
         self,
         film_id: str,
-    ) -> Optional[Film]:
-        film = await self._film_from_cache(film_id)
-        if not film:
-            film = await self._get_film_from_elastic(film_id)
-            if not film:
-                return None
-            await self._put_film_to_cache(film)
+        fields: Optional[tuple[str, ...]] = None,
+    ) -> Optional[JsonBody]:
+        """
+        Returns the films most similar to the film serialized to a json array, None if there is no such film.
+
+        The ids of the similar films are precomputed by the ETL and stored in
+        the film, so a miss costs one get instead of a more_like_this search.
+        Like a page, only the ids are cached, and the films are read by one
+        batched lookup. The ids are evicted when the film is reloaded.
+        """
+        if not await self.get_json_by_id(film_id):
+            return None
+        cache_key = self._similar_films_cache_key(film_id)
+        page = await self._get_id_list(cache_key, self._load_similar_films, cache_key, film_id)
+        return join_json_bodies(await self._get_json_documents(page.ids, fields))
 
-        return film
+    async def get_etag_similar(
+        self,
+        film_id: str,
+        fields: Optional[tuple[str, ...]] = None,
+    ) -> Optional[str]:
+        """Returns the entity tag of the cached similar films, None if they or any of the films are not cached."""
+        page = await self._get_cached_id_list(self._similar_films_cache_key(film_id))
+        if not page:
+            return None
+        return await self._get_documents_etag(page.ids, fields)
 
-    async def get_many_by_parameters(
+    async def export_ndjson(
         self,
-        page_number: int,
-        page_size: int,
-        search: str | None = None,
-        sort: str | None = None,
-    ):
-        films = await self._film_list_from_cache(
-            search=search,
-            page_size=page_size,
-            page_number=page_number,
-            sort=sort,
+        fields: Optional[tuple[str, ...]] = None,
+        after: Optional[str] = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Returns the stream of all films in id order as NDJSON, see services.export.
+
+        The films are read from elastic, not from the caches: an export reads
+        every document once, and caching them would only evict the hot ones.
+        Only the elastic fields the given fields are built from are read.
+        """
+        source_includes = None
+        if fields:
+            source_includes = sorted({source for field in fields for source in FILM_SOURCE_FIELDS[field]})
+        return await export_ndjson(
+            self.elastic,
+            index=self.index,
+            convert=film_from_source,
+            source_includes=source_includes,
+            after=after,
         )
-        if not films:
-            films = await self._get_film_list_from_elastic(
-                search=search,
-                page_number=page_number,
-                page_size=page_size,
-                sort=sort,
-            )
-            if not films:
-                return []
-            await self._put_film_list_to_cache(
-                search=search,
-                page_number=page_number,
-                page_size=page_size,
-                sort=sort,
-                films=films,
-            )
-
-        return films
 
-    async def _get_film_from_elastic(
+    async def _load_similar_films(
         self,
+        cache_key: str,
         film_id: str,
-    ) -> Optional[Film]:
+    ) -> IdList:
+        similar_ids = await self._get_similar_film_ids_from_elastic(film_id)
+        page = IdList(similar_ids, len(similar_ids))
+        # Похожие хранятся в самом фильме: список устаревает, только когда ETL перезагружает фильм
+        await self._put_id_list_to_cache(cache_key, page, document_ids=[film_id])
+        return page
+
+    async def _get_similar_film_ids_from_elastic(
+        self,
+        film_id: str,
+    ) -> list[str]:
         try:
             doc = await self.elastic.get(
-                index="movies",
+                index=self.index,
                 id=film_id,
+                source_includes=["similar_ids"],
             )
-            return Film.parse_from_elastic(doc)
         except NotFoundError:
-            return None
-
-    async def _get_film_list_from_elastic(
-        self,
-        page_number: int,
-        page_size: int,
-        search: str | None = None,
-        sort: str = None,
-    ):
-        query = {
-            "query": {
-                "multi_match": {
-                    "query": search,
-                    "fields": ["*"],
-                    "fuzziness": "AUTO",
-                }
-            }
-            if search
-            else {"match_all": {}},
-            "size": page_size,
-            "from": (page_number - 1) * page_size,
-        }
-
-        if sort:
-            (sort_key, sort_order,) = (
-                (
-                    sort[1:],
-                    "desc",
-                )
-                if sort.startswith("-")
-                else (
-                    sort,
-                    "asc",
-                )
-            )
-            query["sort"] = [{sort_key: sort_order}]
+            return []
+        similar_ids = doc["_source"].get("similar_ids")
+        if similar_ids is not None:
+            return similar_ids[: settings.similar_films_count]
 
+        # Фильм загружен, пока ETL ещё не считал похожие: они ищутся на лету
         try:
             doc = await self.elastic.search(
-                index="movies",
-                body=query,
+                index=self.index,
+                body={
+                    "query": self._build_similar_query(film_id),
+                    "size": settings.similar_films_count,
+                    "_source": False,
+                },
             )
         except NotFoundError:
-            return None
-        documents = doc["hits"]["hits"]
-        films = [Film.parse_from_elastic(doc) for doc in documents]
-        return films
+            return []
+        return [document["_id"] for document in doc["hits"]["hits"]]
 
-    async def _film_from_cache(
+    def _build_similar_query(
         self,
         film_id: str,
-    ) -> Optional[Film]:
-        data = await self.redis.get(f"movie_{film_id}")
-        if not data:
-            return None
-
-        film = Film.parse_from_redis(data)
-        return film
-
-    async def _film_list_from_cache(
-        self,
-        page_size: int,
-        page_number: int,
-        search: str | None = None,
-        sort: str | None = None,
-    ):
-        cache_key = f"movies_{search or ''}_{sort or ''}_{page_size}_{page_number}"
-
-        data = await self.redis.get(cache_key)
-        if not data:
-            return None
-
-        film_list = orjson.loads(data)
-        films = [Film.parse_from_redis(film) for film in film_list]
-
-        return films
-
-    async def _put_film_to_cache(
-        self,
-        film: Film,
-    ):
-        await self.redis.set(
-            f"movie_{film.id}",
-            film.model_dump_json(),
-            settings.cache_expire_time,
-        )
+    ) -> dict:
+        return {
+            "more_like_this": {
+                "fields": SIMILAR_FILM_FIELDS,
+                "like": [{"_index": self.index, "_id": film_id}],
+                # Название и жанр встречаются в фильме по разу, с порогом по умолчанию (2) они бы не учитывались
+                "min_term_freq": 1,
+                "min_doc_freq": 2,
+                "max_query_terms": 25,
+            }
+        }
 
-    async def _put_film_list_to_cache(
+    def _similar_films_cache_key(
         self,
-        page_size: int,
-        page_number: int,
-        films: List[Film],
-        sort: str,
-        search: str,
-    ):
-        cache_key = f"movies_{search or ''}_{sort or ''}_{page_size}_{page_number}"
-
-        films_json_list = [film.model_dump_json() for film in films]
-        films_json_str = orjson.dumps(films_json_list)
-
-        await self.redis.set(
-            cache_key,
-            films_json_str,
-            settings.cache_expire_time,
-        )
+        film_id: str,
+    ) -> str:
+        return build_cache_key(self.page_namespace, "similar", film_id)
 
 
 @lru_cache()
 def get_film_service(
     redis: Redis = Depends(get_redis),
     elastic: AsyncElasticsearch = Depends(get_elastic),
+    local_cache: LocalCache = Depends(get_local_cache),
 ) -> FilmService:
     return FilmService(
         redis,
         elastic,
+        local_cache,
     )
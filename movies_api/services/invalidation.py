@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from typing import Any, Callable, Optional
+
+import orjson
+from core.config import settings
+from db.known_ids import KnownIds
+from db.local_cache import LocalCache
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from services.cache import etag_key, pages_key
+from services.cache_key import build_cache_key
+
+logger = logging.getLogger(__name__)
+
+# Индекс elastic -> (пространство документов, пространство страниц) в кэше
+INDEX_NAMESPACES = {
+    "movies": ("movie", "movies"),
+    "persons": ("person", "persons"),
+    "genres": ("genre", "genres"),
+}
+
+RECONNECT_DELAY_SECONDS = 5
+LISTEN_TIMEOUT_SECONDS = 10
+# Сообщение, которое ETL публикует в тот же канал, закончив цикл, в котором что-то загрузил
+ETL_CYCLE_FINISHED = "etl_cycle_finished"
+
+
+class CacheInvalidator:
+    """
+    Evicts cached documents and the pages that contain them when the ETL
+    reloads the documents into ElasticSearch.
+
+    Every worker listens to the channel on its own, because every worker has
+    its own local cache and its own copy of the filters of known ids, which
+    get the ids of the message as well. Deleting from redis is idempotent, so it does not
+    matter that the same keys are deleted by every worker.
+
+    When the ETL finishes a cycle it publishes an event to the same channel,
+    the callback given for it is called, e.g. to warm the evicted pages up.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        local_cache: LocalCache,
+        known_ids: Optional[KnownIds] = None,
+        channel: str = settings.cache_invalidation_channel,
+        on_etl_cycle: Optional[Callable[[], Any]] = None,
+    ):
+        self.redis = redis
+        self.local_cache = local_cache
+        self.known_ids = known_ids
+        self.channel = channel
+        self.on_etl_cycle = on_etl_cycle
+        self.invalidated_documents = 0
+        self.invalidated_pages = 0
+
+    async def invalidate(
+        self,
+        index: str,
+        ids: list[str],
+    ):
+        if index not in INDEX_NAMESPACES or not ids:
+            return
+        document_namespace, page_namespace = INDEX_NAMESPACES[index]
+        if self.known_ids is not None:
+            # ETL добавил id в фильтр в redis до загрузки, копия воркера получает их здесь, не дожидаясь перечитывания
+            self.known_ids.add(index, ids)
+        document_keys = [build_cache_key(document_namespace, document_id) for document_id in ids]
+
+        # Множества страниц не удаляем: их должен прочитать каждый воркер, они истекают вместе со страницами
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for document_id in ids:
+                pipe.smembers(pages_key(document_namespace, document_id))
+            pages = await pipe.execute()
+        page_keys = {page_key.decode() for document_pages in pages for page_key in document_pages}
+
+        keys = [*document_keys, *page_keys]
+        # Теги есть только у документов, тег страницы собирается из тегов её документов
+        await self.redis.delete(*keys, *(etag_key(key) for key in document_keys))
+        for document_key in document_keys:
+            self.local_cache.delete(document_namespace, document_key)
+        for page_key in page_keys:
+            self.local_cache.delete(page_namespace, page_key)
+
+        self.invalidated_documents += len(document_keys)
+        self.invalidated_pages += len(page_keys)
+        logger.info(
+            "Invalidated %s documents and %s pages of %s",
+            len(document_keys),
+            len(page_keys),
+            index,
+        )
+
+    async def listen(
+        self,
+    ):
+        """Listens to the invalidation channel until cancelled, reconnecting on redis errors."""
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    while True:
+                        # listen() ждал бы сообщения не дольше socket_timeout и падал бы в тихом канале
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True,
+                            timeout=LISTEN_TIMEOUT_SECONDS,
+                        )
+                        if message is None:
+                            continue
+                        await self._handle(message["data"])
+            except RedisError:
+                logger.exception("Cache invalidation listener lost connection to redis")
+                await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+
+    async def _handle(
+        self,
+        data: bytes,
+    ):
+        try:
+            message = orjson.loads(data)
+            if message.get("event") == ETL_CYCLE_FINISHED:
+                if self.on_etl_cycle is not None:
+                    self.on_etl_cycle()
+                return
+            await self.invalidate(message["index"], message["ids"])
+        except (orjson.JSONDecodeError, KeyError, TypeError, AttributeError):
+            logger.warning("Malformed cache invalidation message: %r", data)
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+
+from api.v1.params import DEFAULT_PAGE_SIZE
+from core.config import settings
+from db.local_cache import LocalCache
+from elasticsearch import AsyncElasticsearch
+from models.sort import MoviesSortOptions
+from redis.asyncio import Redis
+from services.cache_warmer import CacheWarmer
+from services.film import get_film_service
+from services.genre import get_genre_service
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_up(
+    redis: Redis,
+    elastic: AsyncElasticsearch,
+    local_cache: LocalCache,
+):
+    """
+    Prepares a new worker for traffic before it is reported ready.
+
+    Opens connections to redis and ElasticSearch, so the first requests do
+    not pay for the connection setup, and loads the default pages and the
+    requests recorded as the most frequent into the caches. A failed
+    warm-up is logged and the worker serves with what it has.
+    """
+    started = time.perf_counter()
+    try:
+        await open_connections(
+            redis,
+            elastic,
+            redis_connections=settings.warm_up_redis_connections,
+            elastic_connections=settings.warm_up_elastic_connections,
+        )
+        if settings.warm_up_hot_keys:
+            await prime_hot_keys(redis, elastic, local_cache)
+        if settings.warm_up_hot_requests:
+            await CacheWarmer(redis, elastic, local_cache).warm()
+    except Exception:
+        logger.exception("Warm-up failed, the worker starts with cold connections and caches")
+        return
+    logger.info("Warm-up finished in %.2f s", time.perf_counter() - started)
+
+
+async def open_connections(
+    redis: Redis,
+    elastic: AsyncElasticsearch,
+    redis_connections: int,
+    elastic_connections: int,
+):
+    pool = redis.connection_pool
+    connections = []
+    try:
+        # Соединения берутся, не возвращаясь, поэтому пул открывает новое на каждое
+        for _ in range(min(redis_connections, pool.max_connections)):
+            connections.append(await pool.get_connection("PING"))
+    finally:
+        for connection in connections:
+            await pool.release(connection)
+
+    # Одновременные запросы заставляют клиент elastic открыть столько же соединений
+    await asyncio.gather(*(elastic.ping() for _ in range(elastic_connections)))
+
+
+async def prime_hot_keys(
+    redis: Redis,
+    elastic: AsyncElasticsearch,
+    local_cache: LocalCache,
+):
+    """Loads the pages nearly every client starts with: the list of genres and the top rated films."""
+    # Те же сервисы, что получат обработчики, и те же параметры, что у запросов по умолчанию, иначе ключи не совпадут
+    film_service = get_film_service(redis, elastic, local_cache)
+    genre_service = get_genre_service(redis, elastic, local_cache)
+    await asyncio.gather(
+        genre_service.get_json_by_parameters(
+            search=None,
+            page_number=1,
+            page_size=DEFAULT_PAGE_SIZE,
+        ),
+        film_service.get_json_by_parameters(
+            page_number=1,
+            page_size=DEFAULT_PAGE_SIZE,
+            sort=MoviesSortOptions.desc,
+        ),
+    )
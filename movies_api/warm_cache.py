@@ -0,0 +1,47 @@
+"""
+Replays the requests the API recorded as the most frequent, to fill the caches after redis was flushed or a deploy.
+
+The API warms up by itself when a worker starts and after every ETL cycle
+that loaded documents, this command does the same on demand.
+
+Usage (from the movies_api directory):
+
+    python warm_cache.py [--limit 200] [--concurrency 8] [--rate 100]
+"""
+import argparse
+import asyncio
+
+from core.config import settings
+from db.local_cache import local_cache
+from elasticsearch import AsyncElasticsearch
+from redis.asyncio import Redis
+from services.cache_warmer import CacheWarmer
+
+
+async def warm_cache(
+    limit: int,
+    concurrency: int,
+    rate: float,
+) -> tuple[int, int]:
+    redis = Redis(host=settings.redis_host, port=settings.redis_port)
+    elastic = AsyncElasticsearch(hosts=[settings.elastic_url], request_timeout=settings.elastic_request_timeout)
+    try:
+        return await CacheWarmer(redis, elastic, local_cache, limit, concurrency, rate).warm()
+    finally:
+        await redis.close(close_connection_pool=True)
+        await elastic.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=settings.warm_up_hot_requests_limit, help="requests to replay")
+    parser.add_argument("--concurrency", type=int, default=settings.warm_up_concurrency, help="requests in flight")
+    parser.add_argument("--rate", type=float, default=settings.warm_up_rate, help="requests per second, 0 for no limit")
+    args = parser.parse_args()
+
+    replayed, failed = asyncio.run(warm_cache(args.limit, args.concurrency, args.rate))
+    print(f"Replayed {replayed} requests, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()